@@ -0,0 +1,64 @@
+"""
+Asyncio support for pymonetdb.
+
+Use ``await pymonetdb.aio.connect()`` to set up a connection. The API mirrors
+the regular DB-API interface, except that everything that talks to the server
+is a coroutine::
+
+    async with await pymonetdb.aio.connect('demo') as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute('SELECT * FROM tables')
+            async for row in cursor:
+                print(row)
+"""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0.  If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright 1997 - July 2008 CWI, August 2008 - 2016 MonetDB B.V.
+
+from typing import Optional, Union
+
+from pymonetdb.aio.connections import Connection
+from pymonetdb.aio.cursors import Cursor
+from pymonetdb.mapi import construct_target_from_args
+from pymonetdb.target import Target, looks_like_url
+
+__all__ = ['connect', 'Connection', 'Cursor']
+
+
+async def connect(
+        database: Union[str, Target],
+        hostname: Optional[str] = None,
+        port: Optional[int] = None,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+        unix_socket: Optional[str] = None,
+        connect_timeout: Optional[float] = None,
+        **kwargs) -> Connection:
+    """Set up an asyncio connection to a MonetDB SQL database
+
+    database : str or Target
+        name of the database, a
+        `MonetDB URL <https://www.monetdb.org/documentation/user-guide/client-interfaces/monetdb-urls/>`_
+        or a Target object.
+
+    The other parameters have the same meaning as for :func:`pymonetdb.connect`.
+    Further keyword arguments such as `tls`, `schema` or `replysize`
+    are set on the Target.
+    """
+    if isinstance(database, Target):
+        assert not kwargs
+        target = database.clone()
+    else:
+        name = None if looks_like_url(database) else database
+        target = construct_target_from_args(
+            name, username, password, 'sql', hostname=hostname, port=port, unix_socket=unix_socket,
+            connect_timeout=connect_timeout, **kwargs)
+        if name is None:
+            target.boundary()
+            target.parse(database)
+
+    connection = Connection(target)
+    await connection._connect()
+    return connection
@@ -0,0 +1,221 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0.  If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright 1997 - July 2008 CWI, August 2008 - 2016 MonetDB B.V.
+
+import logging
+from typing import Dict, List, Optional
+
+from pymonetdb.aio import cursors
+from pymonetdb.aio import mapi as aio_mapi
+from pymonetdb.exceptions import DatabaseError
+from pymonetdb.policy import BatchPolicy
+from pymonetdb import exceptions
+from pymonetdb import mapi
+from pymonetdb.sql.connections import _handshake_options, _local_timezone_offset_seconds, _setup_commands, \
+    _timezone_statement
+from pymonetdb.target import Target
+
+logger = logging.getLogger("pymonetdb")
+
+
+class Connection:
+    """An asyncio MonetDB SQL database connection, use pymonetdb.aio.connect() to create one.
+
+    This is the asyncio counterpart of :class:`pymonetdb.sql.connections.Connection`.
+    All methods that talk to the server are coroutines.
+    """
+
+    mapi: Optional[aio_mapi.Connection]
+
+    def __init__(self, target: Target):
+        """ Prepare a connection to a MonetDB SQL database.
+
+        Do not call this directly, call pymonetdb.aio.connect() instead.
+        """
+
+        try:
+            target.validate()
+        except ValueError as e:
+            raise DatabaseError(str(e))
+
+        policy = BatchPolicy()
+        policy.binary_level = target.connect_binary(BatchPolicy.MAX_BINARY_LEVEL)
+        if target.replysize is not None:
+            policy.replysize = target.replysize
+        if target.maxprefetch is not None:
+            policy.maxprefetch = target.maxprefetch
+
+        self.target = target
+        self.autocommit = target.autocommit
+        self.sizeheader = True
+        self._policy = policy
+        self._current_replysize = 100     # server default, will be updated after handshake
+        self._current_timezone_seconds_east = 0   # server default, will be updated
+        # seconds spent in each phase of connecting, see the sync Connection
+        self.connect_timings: Dict[str, float] = {}
+        self.mapi = None
+
+    async def _connect(self):
+        target = self.target
+        policy = self._policy
+
+        if target.timezone is None:
+            handshake_timezone_offset = _local_timezone_offset_seconds()
+        else:
+            handshake_timezone_offset = 60 * target.timezone
+
+        def handshake_options_callback(server_binexport_level: int) -> List[mapi.HandshakeOption]:
+            policy.server_binexport_level = server_binexport_level
+            return _handshake_options(self, target, policy, handshake_timezone_offset)
+
+        self.mapi = aio_mapi.Connection()
+        await self.mapi.connect(target, handshake_options_callback=handshake_options_callback,
+                                setup_commands=_setup_commands(target))
+
+        self._current_replysize = policy.handshake_reply_size()
+        self._current_timezone_seconds_east = handshake_timezone_offset
+        self.connect_timings = dict(self.mapi.connect_timings)
+
+    async def close(self):
+        """ Close the connection.
+
+        See :meth:`pymonetdb.sql.connections.Connection.close`.
+        """
+        if self.mapi:
+            if not self.autocommit and self.mapi.state == mapi.STATE_READY:
+                await self.rollback()
+            await self.mapi.disconnect()
+            self.mapi = None
+        else:
+            raise exceptions.Error("already closed")
+
+    async def __aenter__(self):
+        """This method is invoked when this Connection is used in an async with-statement.
+        """
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        """This method is invoked when this Connection is used in an async with-statement.
+        """
+        try:
+            await self.close()
+        except exceptions.Error:
+            pass
+        # Propagate any errors
+        return False
+
+    async def set_autocommit(self, autocommit):
+        """
+        Set auto commit on or off. 'autocommit' must be a boolean
+        """
+        await self.command("Xauto_commit %s" % int(autocommit))
+        self.autocommit = autocommit
+
+    async def set_sizeheader(self, sizeheader):
+        """
+        Set sizeheader on or off. When enabled monetdb will return
+        the size a type. 'sizeheader' must be a boolean.
+        """
+        await self.command("Xsizeheader %s" % int(sizeheader))
+        self.sizeheader = sizeheader
+
+    async def _change_replysize(self, replysize):
+        # sent along with the next command, which is the one it matters to
+        await self._command_nowait("Xreply_size %s" % int(replysize), defer=True)
+        self._current_replysize = replysize
+
+    async def set_timezone(self, seconds_east_of_utc):
+        cmd = _timezone_statement(seconds_east_of_utc)
+        async with self.cursor() as c:
+            await c.execute(cmd)
+        self._current_timezone_seconds_east = seconds_east_of_utc
+
+    def get_replysize(self) -> int:
+        return self._policy.replysize
+
+    def set_replysize(self, replysize: int):
+        self._policy.replysize = replysize
+
+    replysize = property(get_replysize, set_replysize)
+
+    def get_maxprefetch(self) -> int:
+        return self._policy.maxprefetch
+
+    def set_maxprefetch(self, maxprefetch: int):
+        self._policy.maxprefetch = maxprefetch
+
+    maxprefetch = property(get_maxprefetch, set_maxprefetch)
+
+    def get_binary(self) -> int:
+        return 1 if self._policy.binary_level else 0
+
+    def set_binary(self, binary: int):
+        self._policy.binary_level = binary > 0
+
+    binary = property(get_binary, set_binary)
+
+    async def commit(self):
+        """
+        Commit any pending transaction to the database.
+        """
+        self.__mapi_check()
+        async with self.cursor() as c:
+            return await c.execute('COMMIT')
+
+    async def rollback(self):
+        """
+        Roll back to the start of any pending transaction.
+        """
+        self.__mapi_check()
+        async with self.cursor() as c:
+            return await c.execute('ROLLBACK')
+
+    def cursor(self) -> cursors.Cursor:
+        """
+        Return a new asyncio Cursor Object using the connection.
+        """
+        return cursors.Cursor(self)
+
+    async def execute(self, query):
+        """ use this for executing SQL queries """
+        return await self.command('s' + query + '\n;')
+
+    async def command(self, command, check_errors: bool = True):
+        """ use this function to send low level mapi commands.
+        See :meth:`pymonetdb.mapi.Connection.cmd` for 'check_errors'."""
+        self.__mapi_check()
+        assert self.mapi
+        return await self.mapi.cmd(command, check_errors)
+
+    async def _command_nowait(self, command, defer: bool = False):
+        """ send a low level mapi command without waiting for its response.
+        See :meth:`pymonetdb.mapi.Connection.cmd_nowait`."""
+        self.__mapi_check()
+        assert self.mapi
+        await self.mapi.cmd_nowait(command, defer)
+
+    async def binary_command(self, command):
+        """ use this function to send low level mapi commands that return raw bytes"""
+        self.__mapi_check()
+        assert self.mapi
+        return await self.mapi.binary_cmd(command)
+
+    def __mapi_check(self):
+        """ check if there is a connection with a server """
+        if not self.mapi:
+            raise exceptions.Error("connection closed")
+        return True
+
+    # these are required by the python DBAPI
+    Warning = exceptions.Warning
+    Error = exceptions.Error
+    InterfaceError = exceptions.InterfaceError
+    DatabaseError = exceptions.DatabaseError
+    DataError = exceptions.DataError
+    OperationalError = exceptions.OperationalError
+    IntegrityError = exceptions.IntegrityError
+    InternalError = exceptions.InternalError
+    ProgrammingError = exceptions.ProgrammingError
+    NotSupportedError = exceptions.NotSupportedError
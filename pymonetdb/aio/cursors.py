@@ -0,0 +1,393 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0.  If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright 1997 - July 2008 CWI, August 2008 - 2016 MonetDB B.V.
+
+import asyncio
+import typing
+from typing import Any, AsyncIterator, Dict, List, Optional, Sequence, Tuple, Union
+
+from pymonetdb.exceptions import Error, ProgrammingError
+from pymonetdb.sql import arrow, columnar, cursors
+from pymonetdb.sql.prefetch import Prefetch
+
+if typing.TYPE_CHECKING:
+    from pymonetdb.aio.connections import Connection
+
+
+class TaskPrefetch(Prefetch):
+    """Sends the command and receives the response in an asyncio task.
+    The connection's lock keeps other commands from interfering."""
+
+    def __init__(self, connection: 'Connection', command: str, binary: bool, start: int, count: int):
+        super().__init__(command, binary, start, count)
+        if binary:
+            self.task = asyncio.ensure_future(connection.binary_command(command))
+        else:
+            self.task = asyncio.ensure_future(connection.command(command))
+
+    async def result(self) -> Any:
+        return await self.task
+
+    async def wait(self):
+        await asyncio.wait([self.task])
+        self.discard()
+
+    def discard(self):
+        # retrieve the outcome when it arrives so asyncio does not complain
+        # about exceptions that were never retrieved
+        self.task.add_done_callback(lambda task: task.cancelled() or task.exception())
+
+
+class Cursor(cursors.Cursor):
+    """Asyncio counterpart of :class:`pymonetdb.sql.cursors.Cursor`.
+
+    The methods that may need to talk to the server, such as execute() and
+    the fetch methods, are coroutines. Result sets can also be consumed
+    using ``async for``, either row by row or batch by batch using
+    :meth:`fetch_batches`.
+
+    Result parsing and decoding, both text and binary, is shared with the
+    regular Cursor.
+    """
+
+    connection: 'Connection'  # type: ignore[assignment]
+
+    def __init__(self, connection: 'Connection'):
+        super().__init__(connection)  # type: ignore[arg-type]
+
+    async def close(self):  # type: ignore[override]
+        """ Close the cursor now.
+
+        See :meth:`pymonetdb.sql.cursors.Cursor.close`.
+        """
+        prefetched = self._prefetched
+        self._prefetched = None
+        if isinstance(prefetched, TaskPrefetch):
+            await prefetched.wait()
+        try:
+            await self._close_earlier_resultsets()
+        except Error:
+            pass
+        self.connection = None
+
+    def __enter__(self):
+        raise ProgrammingError("use 'async with' with asyncio cursors")
+
+    async def __aenter__(self):
+        """This method is invoked when this Cursor is used in an async with-statement.
+        """
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        """This method is invoked when this Cursor is used in an async with-statement.
+        """
+        try:
+            await self.close()
+        except Error:
+            pass
+        # Propagate any errors
+        return False
+
+    async def _close_earlier_resultsets(self):  # type: ignore[override]
+        for rs in self._resultsets_to_close:
+            command = 'Xclose %s' % rs
+            await self.connection._command_nowait(command)
+        del self._resultsets_to_close[:]
+
+    async def _close_finished_resultset(self):  # type: ignore[override]
+        finished = self._finished_resultset()
+        if finished:
+            await self.connection._command_nowait('Xclose %s' % finished)
+
+    async def execute(self, operation: str,  # type: ignore[override]
+                      parameters: Optional[Union[Dict, Sequence[Any]]] = None):
+        """Prepare and execute a database operation (query or
+        command).  Parameters may be provided as mapping and
+        will be bound to variables in the operation.
+        """
+
+        if not self.connection:
+            self._exception_handler(ProgrammingError, "cursor is closed")
+
+        # clear message history
+        self.messages = []
+
+        self._discard_prefetch()
+        await self._close_earlier_resultsets()
+
+        # set the number of rows to fetch
+        desired_replysize = self._policy.new_query()
+        if self.connection._current_replysize != desired_replysize:
+            await self.connection._change_replysize(desired_replysize)
+
+        self.operation = operation
+        query = self._format_query(operation, parameters)
+
+        block = await self.connection.execute(query)
+        self._store_result(block, update_existing=False)
+        self.nextset()
+        self._executed = operation
+        return self.rowcount if self.rowcount >= 0 else None
+
+    async def execute_batch(self, statements: Sequence[str],  # type: ignore[override]
+                            parameters: Optional[Sequence[Optional[Union[Dict, Sequence[Any]]]]] = None) -> List[int]:
+        """Execute several statements in a single round trip.
+
+        See :meth:`pymonetdb.sql.cursors.Cursor.execute_batch`.
+        """
+
+        if not self.connection:
+            self._exception_handler(ProgrammingError, "cursor is closed")
+
+        self.messages = []
+
+        self._discard_prefetch()
+        await self._close_earlier_resultsets()
+
+        desired_replysize = self._policy.new_query()
+        if self.connection._current_replysize != desired_replysize:
+            await self.connection._change_replysize(desired_replysize)
+
+        query = self._batch_query(statements, parameters)
+        self.operation = query
+        block = await self.connection.command('s' + query + '\n;', check_errors=False)
+        try:
+            return self._store_batch_result(block, len(statements))
+        finally:
+            self._executed = query
+
+    async def executemany(self, operation, seq_of_parameters):  # type: ignore[override]
+        """Prepare a database operation (query or command) and then
+        execute it against all parameter sequences or mappings
+        found in the sequence seq_of_parameters.
+
+        See :meth:`pymonetdb.sql.cursors.Cursor.executemany`.
+        It will return the number or rows affected
+        """
+
+        count = 0
+        inserts = self._multirow_inserts(operation, seq_of_parameters)
+        if inserts is not None:
+            for query in inserts:
+                count += await self.execute(query)
+            self.operation = operation
+        else:
+            for parameters in seq_of_parameters:
+                count += await self.execute(operation, parameters)
+        self.rowcount = count
+        return count
+
+    async def fetchone(self):  # type: ignore[override]
+        """Fetch the next row of a query result set, returning a
+        single sequence, or None when no more data is available."""
+
+        self._check_resultset()
+
+        cache_end = self._offset + len(self._rows)
+        if self.rownumber >= cache_end:
+            if self.rownumber >= self.rowcount:
+                await self._close_finished_resultset()
+                return None
+            await self._populate_cache(0, self.rownumber + 1)
+
+        result = self._rows[self.rownumber - self._offset]
+        self.rownumber += 1
+        return result
+
+    async def fetchmany(self, size=None):  # type: ignore[override]
+        """Fetch the next set of rows of a query result, returning a
+        sequence of sequences (e.g. a list of tuples). An empty
+        sequence is returned when no more rows are available."""
+
+        self._check_resultset()
+
+        if size is None:
+            size = self.arraysize
+
+        cache_end = self._offset + len(self._rows)
+        requested_end = min(self.rownumber + size, self.rowcount)
+
+        if requested_end <= cache_end:
+            result = self._rows[self.rownumber - self._offset:requested_end - self._offset]
+            self.rownumber = requested_end
+        else:
+            result = self._rows[self.rownumber - self._offset:cache_end - self._offset]
+            self.rownumber = cache_end
+            await self._populate_cache(len(result), requested_end)
+            result += self._rows[self.rownumber - self._offset:requested_end - self._offset]
+            self.rownumber = requested_end
+
+        if self.rownumber >= self.rowcount:
+            await self._close_finished_resultset()
+        return result
+
+    async def fetchall(self):  # type: ignore[override]
+        """Fetch all remaining rows of a query result, returning
+        them as a sequence of sequences (e.g. a list of tuples)."""
+
+        return await self.fetchmany(self.rowcount)
+
+    async def fetch_batches(self,  # type: ignore[override]
+                            size: Optional[int] = None) -> AsyncIterator[List[Tuple]]:
+        """Iterate over the remaining rows of the result set, one batch at a time.
+
+        Each batch is a list of row tuples, exactly as they were received
+        from the server. If 'size' is given, each request to the server asks
+        for at least that many rows, otherwise the batch size is determined by
+        the replysize and maxprefetch settings.
+        """
+
+        self._check_resultset()
+
+        while True:
+            batch = self._take_cached_rows()
+            if batch:
+                yield batch
+            assert self.rownumber is not None
+            if self.rownumber >= self.rowcount:
+                await self._close_finished_resultset()
+                return
+            requested_end = min(self.rownumber + (size or 1), self.rowcount)
+            await self._populate_cache(0, requested_end)
+
+    async def fetch_columns(self, size: Optional[int] = None,  # type: ignore[override]
+                            datetime64: bool = False) -> List[Tuple[Any, Optional[Any]]]:
+        """Fetch the next 'size' rows of the result set, default all
+        remaining rows, as one NumPy array per column.
+
+        See :meth:`pymonetdb.sql.cursors.Cursor.fetch_columns`.
+        """
+
+        self._check_resultset()
+        assert self.description is not None and self.rownumber is not None
+
+        if size is None:
+            size = self.rowcount
+        requested_end = min(self.rownumber + size, self.rowcount)
+
+        dtypes = self._column_dtypes(datetime64)
+        chunks: List[List[columnar.Column]] = [[] for _ in dtypes]
+        already_used = 0
+        while self.rownumber < requested_end:
+            if self.rownumber >= self._offset + len(self._rows):
+                await self._populate_cache(already_used, requested_end)
+                continue
+            already_used += self._take_column_chunks(dtypes, chunks, requested_end)
+
+        if self.rownumber >= self.rowcount:
+            await self._close_finished_resultset()
+        return [columnar.concat(chunk, dtype) for chunk, dtype in zip(chunks, dtypes)]
+
+    async def fetchnumpy(self, datetime64: bool = False) -> Dict[str, Any]:  # type: ignore[override]
+        """Fetch all remaining rows of the result set as a dict that maps
+        each column name to a NumPy array.
+
+        See :meth:`pymonetdb.sql.cursors.Cursor.fetchnumpy`.
+        """
+        columns = await self.fetch_columns(datetime64=datetime64)
+        assert self.description is not None
+        return {d.name: columnar.masked(col) for d, col in zip(self.description, columns)}
+
+    async def _cached_batches(self,  # type: ignore[override]
+                              size: Optional[int]) -> AsyncIterator[Tuple[Sequence, int, int]]:
+        """See :meth:`pymonetdb.sql.cursors.Cursor._cached_batches`"""
+
+        self._check_resultset()
+        assert self.rownumber is not None
+
+        while True:
+            cache_end = self._offset + len(self._rows)
+            if self.rownumber < cache_end:
+                start = self.rownumber - self._offset
+                self.rownumber = cache_end
+                yield self._rows, start, len(self._rows)
+            if self.rownumber >= self.rowcount:
+                await self._close_finished_resultset()
+                return
+            requested_end = min(self.rownumber + (size or 1), self.rowcount)
+            await self._populate_cache(0, requested_end)
+
+    async def _column_batches(self, size: Optional[int],  # type: ignore[override]
+                              datetime64: bool = False) -> AsyncIterator[List[columnar.Column]]:
+        """See :meth:`pymonetdb.sql.cursors.Cursor._column_batches`"""
+        dtypes = self._column_dtypes(datetime64)
+        async for batch, start, end in self._cached_batches(size):
+            yield [columnar.from_batch(batch, i, dtype, start, end) for i, dtype in enumerate(dtypes)]
+
+    async def fetch_df(self, categorical: bool = False):  # type: ignore[override]
+        """Fetch all remaining rows of the result set as a pandas DataFrame.
+
+        See :meth:`pymonetdb.sql.cursors.Cursor.fetch_df`.
+        """
+        columns = await self.fetch_columns(datetime64=True)
+        assert self.description is not None
+        return columnar.to_dataframe(columns, self.description, categorical)
+
+    async def fetch_df_batches(self, size: Optional[int] = None,  # type: ignore[override]
+                               categorical: bool = False) -> AsyncIterator[Any]:
+        """Iterate over the remaining rows of the result set as a sequence of
+        pandas DataFrames, one per batch received from the server.
+
+        See :meth:`pymonetdb.sql.cursors.Cursor.fetch_df_batches`.
+        """
+        async for columns in self._column_batches(size, datetime64=True):
+            assert self.description is not None
+            yield columnar.to_dataframe(columns, self.description, categorical)
+
+    async def fetch_record_batches(self,  # type: ignore[override]
+                                   batch_rows: Optional[int] = None) -> AsyncIterator[Any]:
+        """Iterate over the remaining rows of the result set as a sequence of
+        pyarrow.RecordBatch objects, one per batch received from the server.
+
+        See :meth:`pymonetdb.sql.cursors.Cursor.fetch_record_batches`.
+        """
+        self._check_resultset()
+        assert self.description is not None
+        arrow_schema = arrow.schema(self.description, self.decimals)
+        async for batch, start, end in self._cached_batches(batch_rows):
+            yield self._record_batch(arrow_schema, batch, start, end)
+
+    async def fetch_arrow(self) -> Any:  # type: ignore[override]
+        """Fetch all remaining rows of the result set as a pyarrow.Table.
+
+        See :meth:`pymonetdb.sql.cursors.Cursor.fetch_arrow`.
+        """
+        self._check_resultset()
+        assert self.description is not None
+        arrow_schema = arrow.schema(self.description, self.decimals)
+        batches = [batch async for batch in self.fetch_record_batches()]
+        return arrow.pyarrow().Table.from_batches(batches, schema=arrow_schema)
+
+    async def _populate_cache(self, already_used, requested_end):
+        stride = requested_end - (self.rownumber - already_used)
+        prefetched = self._take_prefetched(requested_end)
+        if prefetched:
+            assert isinstance(prefetched, TaskPrefetch)
+            binary, count = prefetched.binary, prefetched.count
+            self._rows = []
+            self._offset = self.rownumber
+            response = await prefetched.result()
+        else:
+            command, binary, count = self._prepare_populate(already_used, requested_end)
+            if binary:
+                response = await self.connection.binary_command(command)
+            else:
+                response = await self.connection.command(command)
+        self._store_batch(response, binary, count)
+        next_batch = self._plan_prefetch(stride)
+        if next_batch:
+            self._prefetched = TaskPrefetch(self.connection, *next_batch)
+
+    def __iter__(self):
+        raise ProgrammingError("use 'async for' with asyncio cursors")
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        row = await self.fetchone()
+        if not row:
+            raise StopAsyncIteration
+        return row
@@ -0,0 +1,402 @@
+"""
+This is the asyncio implementation of the mapi protocol.
+"""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0.  If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright 1997 - July 2008 CWI, August 2008 - 2016 MonetDB B.V.
+
+import asyncio
+from contextlib import asynccontextmanager
+import logging
+import socket
+import struct
+import time
+from typing import AsyncIterator, Callable, Dict, List, Optional, Tuple, Union
+
+from pymonetdb import mapi
+from pymonetdb.exceptions import DatabaseError, Error, OperationalError, ProgrammingError
+from pymonetdb.mapi import CONNECTION_ATTEMPT_DELAY, HandshakeOption, MAX_PACKAGE_LENGTH, MSG_ERROR_B, \
+    MSG_FILETRANS_B, MSG_MORE, MSG_REDIRECT, PIPELINE_WINDOW, READ_AHEAD_SIZE, STATE_INIT, STATE_READY
+from pymonetdb.target import Target
+
+logger = logging.getLogger(__name__)
+
+
+class Connection:
+    """
+    MAPI (low level MonetDB API) connection running on asyncio streams.
+
+    The login handshake and the interpretation of the responses are
+    delegated to a :class:`pymonetdb.mapi.Connection` that is never connected
+    itself, only the network traffic is handled here.
+    """
+
+    state: int = STATE_INIT
+    reader: Optional[asyncio.StreamReader] = None
+    writer: Optional[asyncio.StreamWriter] = None
+    server_endian: Optional[str] = None
+    binexport_level: int = 0
+    # responses to commands sent by cmd_nowait() that have not been read yet
+    unread_responses: int = 0
+    # commands passed to cmd_nowait(defer=True) that have not been sent yet
+    deferred_commands: Tuple[str, ...] = ()
+
+    def __init__(self):
+        self._protocol = mapi.Connection()
+        self._lock = asyncio.Lock()
+
+    @property
+    def target(self) -> Target:
+        return self._protocol.target
+
+    @property
+    def connect_timings(self) -> Dict[str, float]:
+        return self._protocol.connect_timings
+
+    async def connect(self, target: Target,
+                      handshake_options_callback: Optional[Callable[[int], List[HandshakeOption]]] = None,
+                      setup_commands: Optional[List[str]] = None):
+        """ setup connection to MAPI server
+        See :meth:`pymonetdb.mapi.Connection.connect` for 'setup_commands'.
+        """
+        started = time.monotonic()
+        self._protocol.target = target.clone()
+        self._protocol.handshake_options_callback = handshake_options_callback
+        self._protocol.setup_commands = list(setup_commands or [])
+        self._protocol.connect_timings = {}
+        self._protocol.validate_target()
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(f"Connecting to {self.target.summary_url()}")
+
+        timeout = self.target.connect_timeout
+        if timeout < 0 and timeout != -1:
+            raise ProgrammingError("negative socket timeouts are forbidden")
+
+        try:
+            if timeout > 0:
+                await asyncio.wait_for(self._connect(), timeout)
+            else:
+                await self._connect()
+        except Exception as e:
+            logger.error(f"Could not connect to {self.target.summary_url()}: {e}")
+            self._close_streams()
+            raise
+        self.connect_timings['total'] = time.monotonic() - started
+
+    async def _connect(self):
+        key = self.target.cache_key()
+        if not await self._connect_cached_endpoint(key):
+            if self.target.connect_scan:
+                await self._scan_sockdir()
+            else:
+                await self._connect_target()
+        if self.target.cache_key() != key:
+            # we were redirected or found a socket by scanning
+            mapi._remember_endpoint(key, self.target)
+
+    async def _connect_cached_endpoint(self, key) -> bool:
+        """See mapi.Connection._connect_cached_endpoint"""
+        endpoint = mapi._cached_endpoint(key)
+        if endpoint is None:
+            return False
+        original = self._protocol.target
+        self._protocol.target = endpoint
+        try:
+            logger.debug(f"Trying cached endpoint {endpoint.summary_url()}")
+            await self._connect_target()
+            return True
+        except (OSError, DatabaseError) as e:
+            logger.debug(f"Cached endpoint failed, forgetting it: {e}")
+            mapi._forget_endpoint(key)
+            self.state = STATE_INIT
+            self._protocol.target = original
+            return False
+
+    async def _scan_sockdir(self):
+        for sock in self._protocol._sockdir_candidates():
+            try:
+                self.target.sock = sock
+                self._protocol.validate_target()
+                await self._connect_target()
+                # If it works, use this
+                return
+            except OSError:
+                # just try another one if the socket doesn't work somehow
+                pass
+            except DatabaseError as e:
+                if 'no such database' in str(e):
+                    # just try another one
+                    pass
+                else:
+                    # other errors are a cause for concern
+                    raise
+
+        # last resort
+        logger.debug("Trying a TCP connection to localhost")
+        self.target.sock = ''
+        self.target.host = 'localhost'
+        self._protocol.validate_target()
+        await self._connect_target()
+
+    async def _connect_target(self):
+        # Close any remainders of previous attempts
+        self._close_streams()
+
+        # Enter a loop to deal with redirects.
+        for i in range(10):
+            if self.writer is None:
+                with self._protocol._timed('connect'):
+                    await self._open_streams()
+            with self._protocol._timed('login'):
+                challenge = await self._getblock()
+                response = self._protocol._challenge_response(challenge)
+                await self._putblock(response)
+                prompt = (await self._getblock()).strip()
+            if self._protocol._check_login_prompt(prompt):
+                break
+            if not prompt.startswith(MSG_REDIRECT + 'mapi:merovingian:'):
+                # The target has been updated, reconnect
+                self._close_streams()
+        else:
+            raise OperationalError("too many redirects")
+        logger.debug("Login succeeded")
+
+        self.state = STATE_READY
+        self.server_endian = self._protocol.server_endian
+        self.binexport_level = self._protocol.binexport_level
+
+        with self._protocol._timed('setup'):
+            await self._run_setup_commands()
+
+    async def _run_setup_commands(self):
+        """See mapi.Connection._run_setup_commands"""
+        clientinfo = self._protocol._clientinfo_command()
+        commands, fallbacks = self._protocol._setup_batch(clientinfo)
+        responses: List[Union[str, Error]] = []
+        if commands:
+            assert self.writer
+            async with self._exchange():
+                for command in commands:
+                    self.writer.write(self._frame(command))
+                await self.writer.drain()
+                for command in commands:
+                    response = await self._getblock_and_refuse_files()
+                    try:
+                        responses.append(self._protocol._handle_response(response))
+                    except Error as e:
+                        responses.append(e)
+        self._protocol._check_setup_responses(clientinfo, commands, responses)
+        for opt in fallbacks:
+            await opt.fallback(opt.value)
+
+    async def _open_streams(self):  # noqa C901
+        target = self.target
+        err = None
+
+        unix = target.connect_unix
+        if unix and hasattr(socket, 'AF_UNIX'):
+            try:
+                logger.debug('Trying %s', unix)
+                self.reader, self.writer = await asyncio.open_unix_connection(unix, limit=READ_AHEAD_SIZE)
+                logger.debug("Connected")
+                # Send a '0' to let the other side know we're not going to try
+                # to pass a file handle.
+                self.writer.write(b'0')
+                return
+            except OSError as e:
+                err = e
+
+        host = target.connect_tcp
+        if host:
+            port = target.connect_port
+            ssl_context = mapi.get_ssl_context(target) if target.tls else None
+            try:
+                logger.debug('Trying %s port %d', host, port)
+                self.reader, self.writer = await asyncio.open_connection(
+                    host, port, ssl=ssl_context, server_hostname=host if ssl_context else None,
+                    limit=READ_AHEAD_SIZE, happy_eyeballs_delay=CONNECTION_ATTEMPT_DELAY, interleave=1)
+                logger.debug("Connected")
+            except OSError as e:
+                err = e
+            else:
+                sock = self.writer.get_extra_info('socket')
+                if sock is not None:
+                    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+                if ssl_context is None:
+                    # See mapi.Connection.prime_or_wrap_connection
+                    self.writer.write(b'\x00\x00\x00\x00\x00\x00\x00\x00')
+                elif target.connect_tls_verify == 'hash':
+                    ssl_object = self.writer.get_extra_info('ssl_object')
+                    mapi.verify_fingerprint(ssl_object.getpeercert(binary_form=True), target.certhash)
+                    logger.debug(f"TLS certificate matches hash {target.certhash}")
+                return
+
+        if err is not None:
+            raise err
+        raise DatabaseError("endpoint not found")
+
+    def _close_streams(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = None
+        self.writer = None
+        self.unread_responses = 0
+        self.deferred_commands = ()
+
+    async def disconnect(self):
+        """ disconnect from the monetdb server """
+        logger.debug("Closing connection")
+        self.state = STATE_INIT
+        writer = self.writer
+        self._close_streams()
+        if writer is not None:
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+    async def cmd(self, operation: str, check_errors: bool = True):
+        """ put a mapi command on the line.
+        See :meth:`pymonetdb.mapi.Connection.cmd` for 'check_errors'."""
+        logger.debug("executing command %s" % operation)
+
+        if self.state != STATE_READY:
+            raise ProgrammingError("Not connected")
+
+        async with self._exchange():
+            await self._send_command(operation)
+            await self._skip_unread_responses()
+            response = await self._getblock_and_refuse_files()
+            if response == MSG_MORE:
+                # tell server it isn't going to get more
+                await self._putblock("")
+                response = await self._getblock_and_refuse_files()
+        if not check_errors:
+            return response
+        return self._protocol._handle_response(response)
+
+    async def binary_cmd(self, operation: str) -> memoryview:
+        """ put a mapi command on the line, with a binary response."""
+        logger.debug("executing binary command %s" % operation)
+
+        if self.state != STATE_READY:
+            raise ProgrammingError("Not connected")
+
+        async with self._exchange():
+            await self._send_command(operation)
+            await self._skip_unread_responses()
+            buffer = bytearray()
+            await self._getblock_raw(buffer)
+        view = memoryview(buffer)
+        self._protocol._check_binary_response(view)
+        return view
+
+    async def cmd_nowait(self, operation: str, defer: bool = False):
+        """ put a mapi command on the line without waiting for the response.
+        See :meth:`pymonetdb.mapi.Connection.cmd_nowait`."""
+        logger.debug("sending command %s" % operation)
+
+        if self.state != STATE_READY:
+            raise ProgrammingError("Not connected")
+
+        async with self._exchange():
+            if defer and len(self.deferred_commands) + 1 < PIPELINE_WINDOW:
+                self.deferred_commands += (operation,)
+                return
+            if self.unread_responses >= PIPELINE_WINDOW:
+                await self._skip_unread_responses()
+            await self._send_command(operation)
+            self.unread_responses += 1
+
+    @asynccontextmanager
+    async def _exchange(self) -> AsyncIterator[None]:
+        """Hold the lock while talking to the server. If the exchange is
+        interrupted halfway, for example because the task is cancelled, the
+        rest of the response would be read by the next command, so the
+        connection is closed instead."""
+        async with self._lock:
+            try:
+                yield
+            except BaseException:
+                logger.debug("Exchange with the server interrupted, closing the connection")
+                self.state = STATE_INIT
+                self._close_streams()
+                raise
+
+    async def _send_command(self, operation: str):
+        """Put the command on the line, preceded by the deferred commands"""
+        assert self.writer
+        deferred = self.deferred_commands
+        self.deferred_commands = ()
+        self.unread_responses += len(deferred)
+        for block in deferred + (operation,):
+            self.writer.write(self._frame(block))
+        await self.writer.drain()
+
+    async def _skip_unread_responses(self):
+        """Read and discard the responses to the commands sent by cmd_nowait()"""
+        while self.unread_responses > 0:
+            self.unread_responses -= 1
+            buffer = bytearray()
+            await self._getblock_raw(buffer)
+            if buffer[:1] == MSG_ERROR_B:
+                logger.warning("Ignoring error: %s", str(buffer[1:], 'utf-8', 'replace').strip())
+
+    async def _getblock(self) -> str:
+        """ read one mapi encoded block """
+        buffer = bytearray()
+        await self._getblock_raw(buffer)
+        return str(buffer, 'utf-8')
+
+    async def _getblock_and_refuse_files(self) -> str:
+        """ read one mapi encoded block, refusing any file transfers the server requests"""
+        buffer = bytearray()
+        while True:
+            offset = len(buffer)
+            await self._getblock_raw(buffer)
+            i = buffer.rfind(b'\n', offset, len(buffer) - 1)
+            if i >= offset + 2 and buffer[i - 2: i + 1] == MSG_FILETRANS_B:
+                # File transfer request. Chop the cmd off the buffer
+                del buffer[i - 2:]
+                await self._putblock("File transfers are not supported by pymonetdb.aio\n")
+                continue
+            return str(buffer, 'utf-8')
+
+    async def _getblock_raw(self, buffer: bytearray):
+        """ append one mapi block to 'buffer' """
+        assert self.reader
+        try:
+            while True:
+                header = await self.reader.readexactly(2)
+                unpacked = header[0] + 256 * header[1]
+                length = unpacked >> 1
+                if length:
+                    buffer += await self.reader.readexactly(length)
+                if unpacked & 1:
+                    return
+        except asyncio.IncompleteReadError:
+            raise BrokenPipeError("Server closed connection")
+
+    async def _putblock(self, block: str):
+        """ wrap the line in mapi format and put it into the socket """
+        assert self.writer
+        self.writer.write(self._frame(block))
+        await self.writer.drain()
+
+    @staticmethod
+    def _frame(block: str) -> bytearray:
+        """ wrap the line in mapi format """
+        data = memoryview(block.encode('utf-8'))
+        out = bytearray()
+        pos = 0
+        while True:
+            chunk = data[pos:pos + MAX_PACKAGE_LENGTH]
+            last = len(chunk) < MAX_PACKAGE_LENGTH
+            out += struct.pack('<H', (len(chunk) << 1) + last)
+            out += chunk
+            pos += len(chunk)
+            if last:
+                break
+        return out
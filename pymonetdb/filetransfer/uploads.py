@@ -10,7 +10,7 @@ import typing
 from io import BufferedIOBase, BufferedWriter, RawIOBase, TextIOBase, TextIOWrapper
 from abc import ABC, abstractmethod
 from typing import Any, Optional, Union
-from pymonetdb.mapi import MSG_MORE, MSG_FILETRANS
+from pymonetdb.mapi import MSG_MORE, MSG_FILETRANS, MAX_SEND_BUFFER_SIZE
 from pymonetdb.exceptions import ProgrammingError
 
 if typing.TYPE_CHECKING:
@@ -96,7 +96,8 @@ class Upload:
         to the server.
         """
         if not self.writer:
-            self.writer = BufferedWriter(self._raw())
+            # Buffer enough data to fill the mapi send buffer in one go
+            self.writer = BufferedWriter(self._raw(), buffer_size=MAX_SEND_BUFFER_SIZE)
         return self.writer
 
     def text_writer(self) -> TextIOBase:
@@ -109,7 +110,7 @@ class Upload:
             # Without the Any annotation there is no way I can convince the
             # type checker that TextIOWrapper can accept a NormalizeCrLf
             # object. Apparently being a subclass of BufferedIOBase is not enough.
-            w: Any = NormalizeCrLf(self._raw())
+            w: Any = NormalizeCrLf(self.binary_writer())
             self.twriter = TextIOWrapper(w, encoding='utf-8', newline='\n')
         return self.twriter
 
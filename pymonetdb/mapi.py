@@ -8,21 +8,26 @@ This is the python implementation of the mapi protocol.
 # Copyright 1997 - July 2008 CWI, August 2008 - 2016 MonetDB B.V.
 
 
+import contextlib
+import copy
+import errno
 import os
 import platform
 import re
+import selectors
 import socket
 import logging
 import struct
 import hashlib
 import ssl
 import sys
+import threading
 import time
 import typing
-from typing import Callable, Dict, List, Optional, Tuple, Union
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Union
 
 # import pymonetdb
-from pymonetdb.exceptions import OperationalError, DatabaseError, \
+from pymonetdb.exceptions import Error, OperationalError, DatabaseError, \
     ProgrammingError, NotSupportedError, IntegrityError
 from pymonetdb.target import Target
 from pymonetdb import __version__
@@ -35,6 +40,25 @@ logger = logging.getLogger(__name__)
 
 MAX_PACKAGE_LENGTH = (1024 * 8) - 2
 
+# Outgoing frames are collected in a buffer of at most this size before they
+# are handed to the socket, so large blocks need one sendall() per 64 frames
+# rather than two per frame.
+MAX_SEND_BUFFER_SIZE = 64 * (MAX_PACKAGE_LENGTH + 2)
+
+# Incoming data is read from the socket in chunks of up to this size.
+# The frame headers are then parsed from memory.
+READ_AHEAD_SIZE = 256 * 1024
+
+# Pipelined commands are sent in windows of at most this many commands and
+# bytes. The server stops reading while its responses are not being consumed,
+# so the window must fit in the socket buffers to avoid a deadlock.
+PIPELINE_WINDOW = 128
+PIPELINE_WINDOW_BYTES = 64 * 1024
+
+# When a host name resolves to several addresses, RFC 8305 recommends
+# starting the next connection attempt 250 ms after the previous one.
+CONNECTION_ATTEMPT_DELAY = 0.25
+
 MSG_PROMPT = ""
 MSG_MORE = "\1\2\n"
 MSG_FILETRANS = "\1\3\n"
@@ -105,13 +129,41 @@ class Connection(object):
     is_raw_control: Optional[bool] = None
     handshake_options_callback: Optional[Callable[[int], List['HandshakeOption']]] = None
     remaining_handshake_options: List['HandshakeOption'] = []
+    # commands that complete the connection setup after login, see connect()
+    setup_commands: List[str] = []
+    # seconds spent in each phase of connect()
+    connect_timings: Dict[str, float] = {}
     clientinfo: Optional[Dict[str, Optional[str]]] = None
     uploader: Optional['Uploader'] = None
     downloader: Optional['Downloader'] = None
     stashed_buffer: Optional[bytearray] = None
+    send_buffer: Optional[bytearray] = None
+    recv_buffer: Optional[bytearray] = None
+    recv_pos: int = 0
+    recv_end: int = 0
+    binary_size_hint: int = 0
+    # responses to commands sent by cmd_nowait() that have not been read yet
+    unread_responses: int = 0
+    # commands passed to cmd_nowait(defer=True) that have not been sent yet
+    deferred_commands: Tuple[str, ...] = ()
+    # whether a transaction is open according to the last &4 reply, which
+    # START TRANSACTION, COMMIT and ROLLBACK send, see _track_transaction()
+    in_transaction: bool = False
+    # time.monotonic() value by which socket operations must complete, see command_deadline()
+    deadline: Optional[float] = None
+    deadline_saved_timeout: Optional[float] = None
 
     def connect(self, database: Optional[Union[Target, str]] = None, *args, **kwargs):
         """ setup connection to MAPI server
+
+        Keyword argument 'setup_commands' can hold commands to run right after
+        login. They are sent in a single batch together with the handshake
+        options the server did not accept during login, so they do not cost a
+        round trip each. The first one to fail raises an exception.
+
+        Afterwards, 'connect_timings' holds the seconds spent resolving the
+        host name, connecting, in the TLS handshake, logging in, on the setup
+        commands and in total.
         """
 
         # Ideally we'd just take the Target as a parameter, but we want to
@@ -121,6 +173,9 @@ class Connection(object):
         if callback is not None:
             self.handshake_options_callback = callback
             del kwargs['handshake_options_callback']
+        self.setup_commands = list(kwargs.pop('setup_commands', None) or [])
+        self.connect_timings = {}
+        started = time.monotonic()
 
         # Create Target or use given
         if isinstance(database, Target):
@@ -135,16 +190,51 @@ class Connection(object):
 
         self.set_deadline()
 
+        key = self.target.cache_key()
         try:
-            if self.target.connect_scan:
-                self.scan_sockdir()
-            else:
-                self.connect_target()
+            if not self._connect_cached_endpoint(key):
+                if self.target.connect_scan:
+                    self.scan_sockdir()
+                else:
+                    self.connect_target()
         except Exception as e:
             logger.error(f"Could not connect to {self.target.summary_url()}: {e}")
             raise
+        if self.target.cache_key() != key:
+            # we were redirected or found a socket by scanning
+            _remember_endpoint(key, self.target)
 
         self.clear_deadline()
+        self.connect_timings['total'] = time.monotonic() - started
+
+    @contextlib.contextmanager
+    def _timed(self, phase: str):
+        """Add the time spent in the with-block to connect_timings[phase]"""
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            elapsed = time.monotonic() - started
+            self.connect_timings[phase] = self.connect_timings.get(phase, 0.0) + elapsed
+
+    def _connect_cached_endpoint(self, key: Tuple) -> bool:
+        """Connect to where earlier connections to this target ended up.
+        Return False if there is no such endpoint or it doesn't work anymore."""
+        endpoint = _cached_endpoint(key)
+        if endpoint is None:
+            return False
+        original = self.target
+        self.target = endpoint
+        try:
+            logger.debug(f"Trying cached endpoint {endpoint.summary_url()}")
+            self.connect_target()
+            return True
+        except (OSError, DatabaseError) as e:
+            logger.debug(f"Cached endpoint failed, forgetting it: {e}")
+            _forget_endpoint(key)
+            self.state = STATE_INIT
+            self.target = original
+            return False
 
     def validate_target(self):
         try:
@@ -218,30 +308,63 @@ class Connection(object):
         # handle during the handshake
         self.state = STATE_READY
 
-        if self.clientinfo:
-            lang = self.target.language
-            if lang == 'sql':
-                cmd = "Xclientinfo " + "".join(
-                    f"{k}={v or ''}\n"
-                    for k, v in self.clientinfo.items()
-                    if v is None or '\n' not in v
-                )
-            elif lang == 'mal' or lang == 'msql':
-                cmd = "\n".join(
-                    f'clients.setinfo("{mal_escape(k)}", "{mal_escape(v or "")}");'
-                    for k, v in self.clientinfo.items()
-                    if v is None or '\n' not in v
-                )
-            else:
-                cmd = None
-            if cmd:
-                try:
-                    self.cmd(cmd)
-                except OperationalError as e:
-                    logger.warning(f"Server rejected clientinfo: {e}")
+        with self._timed('setup'):
+            self._run_setup_commands()
+
+    def _run_setup_commands(self):
+        """Send the client info, the handshake options the server did not
+        accept and the setup commands in one pipelined batch"""
+        clientinfo = self._clientinfo_command()
+        commands, fallbacks = self._setup_batch(clientinfo)
+        responses = self.cmd_pipelined(commands) if commands else []
+        self._check_setup_responses(clientinfo, commands, responses)
+        for opt in fallbacks:
+            opt.fallback(opt.value)
 
+    def _setup_batch(self, clientinfo: Optional[str]) -> Tuple[List[str], List['HandshakeOption']]:
+        """Return the commands to send after login, and the handshake options
+        that have no command and must be set by calling their fallback"""
+        commands = [clientinfo] if clientinfo else []
+        fallbacks = []
         for opt in self.remaining_handshake_options:
-            opt.fallback(opt.value)
+            if opt.command is None:
+                fallbacks.append(opt)
+            else:
+                commands.append(opt.command(opt.value))
+        commands += self.setup_commands
+        return commands, fallbacks
+
+    def _check_setup_responses(self, clientinfo: Optional[str], commands: List[str],
+                               responses: List[Union[str, Error]]):
+        """Raise the first error in the responses to the setup batch. The
+        server rejecting the client info only merits a warning."""
+        for command, response in zip(commands, responses):
+            if not isinstance(response, Error):
+                continue
+            if command is clientinfo and isinstance(response, OperationalError):
+                logger.warning(f"Server rejected clientinfo: {response}")
+                continue
+            raise response
+
+    def _clientinfo_command(self) -> Optional[str]:
+        """Return the command that sends the client details, if any"""
+        if not self.clientinfo:
+            return None
+        lang = self.target.language
+        if lang == 'sql':
+            return "Xclientinfo " + "".join(
+                f"{k}={v or ''}\n"
+                for k, v in self.clientinfo.items()
+                if v is None or '\n' not in v
+            )
+        elif lang == 'mal' or lang == 'msql':
+            return "\n".join(
+                f'clients.setinfo("{mal_escape(k)}", "{mal_escape(v or "")}");'
+                for k, v in self.clientinfo.items()
+                if v is None or '\n' not in v
+            )
+        else:
+            return None
 
     def connect_loop(self):
         for i in range(10):
@@ -252,13 +375,16 @@ class Connection(object):
                 self.try_connect()
                 assert self.sock is not None
                 self.raw_sock = self.sock
+                self._discard_recv_buffer()
+                self._reset_pipeline()
 
                 # Once connected, deal with the file handle passing protocol,
                 # AND with TLS. Note that these are necessarily exclusive, we
                 # can't do TLS over unix domain sockets.
                 self.is_raw_control = False
                 if self.is_tcp:
-                    self.prime_or_wrap_connection()
+                    with self._timed('tls'):
+                        self.prime_or_wrap_connection()
                 elif self.target.language == 'control':
                     self.is_raw_control = True
                 else:
@@ -273,7 +399,12 @@ class Connection(object):
             if self.is_raw_control:
                 # no login needed, we're done
                 break
-            elif self._login():
+            with self._timed('login'):
+                logged_in = self._login()
+            if logged_in:
+                if isinstance(self.sock, ssl.SSLSocket):
+                    # By now any TLS 1.3 session tickets have been received
+                    _remember_tls_session(self.target, self.sock)
                 break
             else:
                 # _login has determined that we need another round
@@ -289,7 +420,8 @@ class Connection(object):
             try:
                 logger.debug('Trying %s', sock)
                 self.update_socket_timeout(s, True)
-                s.connect(sock)
+                with self._timed('connect'):
+                    s.connect(sock)
                 # it worked!
                 logger.debug("Connected")
                 self.sock = s
@@ -302,31 +434,37 @@ class Connection(object):
         host = self.target.connect_tcp
         if host:
             port = self.target.connect_port
-            addrs = socket.getaddrinfo(host, port, socket.AF_UNSPEC, socket.SOCK_STREAM)
-            for fam, typ, proto, cname, addr in addrs:
-                s = socket.socket(fam, typ, proto)
-                try:
-                    if len(addr) >= 4 and (addr[2] != 0 or addr[3] != 0):
-                        logger.debug('Trying %s port %d flow %d scope %d', *addr)
-                    else:
-                        logger.debug('Trying %s port %d', addr[0], addr[1])
-                    self.update_socket_timeout(s, True)
-                    s.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
-                    s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
-                    s.connect(addr)
-                    # it worked!
-                    logger.debug("Connected")
-                    self.sock = s
-                    self.is_tcp = True
-                    return
-                except OSError as e:
-                    s.close()
-                    err = e
+            try:
+                s = self._connect_tcp(host, port)
+                self.sock = s
+                self.is_tcp = True
+                return
+            except OSError as e:
+                # the addresses may have changed
+                _forget_resolved(host, port)
+                err = e
 
         if err is not None:
             raise err
         raise DatabaseError("endpoint not found")
 
+    def _connect_tcp(self, host: str, port: int) -> socket.socket:
+        with self._timed('resolve'):
+            addrs = _interleave_families(_resolve(host, port))
+        if self.connect_deadline is not None:
+            deadline = self.connect_deadline
+        else:
+            default_timeout = socket.getdefaulttimeout()
+            deadline = float('inf') if default_timeout is None else time.time() + default_timeout
+        with self._timed('connect'):
+            s = _connect_staggered(addrs, deadline)
+        logger.debug("Connected")
+        s.settimeout(socket.getdefaulttimeout())
+        self.update_socket_timeout(s, True)
+        s.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        s.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return s
+
     def prime_or_wrap_connection(self):  # noqa: C901
         if not self.target.tls:
             # Prime the connection with some NUL bytes.
@@ -341,38 +479,15 @@ class Connection(object):
 
         target = self.target
         verification_mode = target.connect_tls_verify
+        ssl_context = get_ssl_context(target)
 
-        if target.dangerous_tls_nocheck:
-            disabled_checks = set(target.dangerous_tls_nocheck.split(','))
-        else:
-            disabled_checks = set()
-
-        # Set up the SSL context. How to do that depends on the verification mode
-        if verification_mode == 'system':
-            ssl_context = ssl.create_default_context()
-        elif verification_mode == 'cert':
-            ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
-            ssl_context.load_verify_locations(target.cert)
-        else:
-            assert verification_mode == 'hash'
-            ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
-            disabled_checks.add('host')
-            disabled_checks.add('cert')
-
-        # The following is common between all verification modes
-        ssl_context.minimum_version = ssl.TLSVersion.TLSv1_3
-        ssl_context.set_alpn_protocols(["mapi/9"])
-        if target.clientkey:
-            certfile = (target.clientcert or target.clientkey)
-            keyfile = target.clientkey
-            ssl_context.load_cert_chain(certfile, keyfile)
-        if 'host' in disabled_checks:
-            ssl_context.check_hostname = False
-        if 'cert' in disabled_checks:
-            ssl_context.verify_mode = ssl.CERT_NONE
-
-        # Perform the SSL handshake and switch to the encrypted connection
-        self.sock = ssl_context.wrap_socket(self.sock, server_hostname=target.connect_tcp)
+        # Perform the SSL handshake and switch to the encrypted connection,
+        # resuming an earlier session with the same server if we have one.
+        # The session key includes the context key, so the session always
+        # belongs to ssl_context.
+        session = _cached_tls_session(target)
+        self.sock = ssl_context.wrap_socket(self.sock, server_hostname=target.connect_tcp, session=session)
+        _record_tls_handshake(session is not None, self.sock.session_reused)
 
         # In hash mode, verify the identity of the server. Otherwise, just log a message about it
         if verification_mode == 'hash':
@@ -397,7 +512,10 @@ class Connection(object):
         response = self._challenge_response(challenge)
         self._putblock(response)
         prompt = self._getblock().strip()
+        return self._check_login_prompt(prompt)
 
+    def _check_login_prompt(self, prompt: str) -> bool:
+        """Return True if the login succeeded, False if another attempt is needed"""
         if len(prompt) == 0 or prompt == MSG_OK:
             # server is happy
             return True
@@ -436,21 +554,36 @@ class Connection(object):
 
     def _verify_fingerprint(self, fingerprint: str):
         assert self.sock and isinstance(self.sock, ssl.SSLSocket)
+        verify_fingerprint(self.sock.getpeercert(binary_form=True), fingerprint)
 
-        m = re.match(r'sha256:([0-9a-fA-F:]+)$', fingerprint)
-        if not m:
-            raise ssl.SSLError(f"invalid certificate hash {fingerprint!r}")
-        digits = m.group(1).lower().replace(':', '')
-
-        der = self.sock.getpeercert(binary_form=True)
-        if not der:
-            raise ssl.SSLError("server has no certificate")
+    def scan_sockdir(self):
+        for sock in self._sockdir_candidates():
+            try:
+                self.target.sock = sock
+                self.validate_target()
+                self.connect_target()
+                # If it works, use this
+                return
+            except OSError:
+                # just try another one if the socket doesn't work somehow
+                pass
+            except DatabaseError as e:
+                if 'no such database' in str(e):
+                    # just try another one
+                    pass
+                else:
+                    # other errors are a cause for concern
+                    raise
 
-        digest = hashlib.sha256(der).hexdigest()
-        if not digest.startswith(digits):
-            raise ssl.SSLError(f"wrong server certificate hash: {fingerprint}")
+        # last resort
+        logger.debug("Trying a TCP connection to localhost")
+        self.target.sock = ''
+        self.target.host = 'localhost'
+        self.validate_target()
+        self.connect_target()
 
-    def scan_sockdir(self):   # noqa C901
+    def _sockdir_candidates(self) -> List[str]:  # noqa C901
+        """List the Unix domain sockets scan_sockdir() should try, best first"""
         try:
             my_uid = os.getuid()
         except AttributeError:
@@ -485,36 +618,14 @@ class Connection(object):
             else:
                 strange_socks.append(entry.path)
 
-        # Try to connect to each of them
-        for sock in my_socks + strange_socks:
-            try:
-                self.target.sock = sock
-                self.validate_target()
-                self.connect_target()
-                # If it works, use this
-                return
-            except OSError:
-                # just try another one if the socket doesn't work somehow
-                pass
-            except DatabaseError as e:
-                if 'no such database' in str(e):
-                    # just try another one
-                    pass
-                else:
-                    # other errors are a cause for concern
-                    raise
-
-        # last resort
-        logger.debug("Trying a TCP connection to localhost")
-        self.target.sock = ''
-        self.target.host = 'localhost'
-        self.validate_target()
-        self.connect_target()
+        return my_socks + strange_socks
 
     def disconnect(self):
         """ disconnect from the monetdb server """
         logger.debug("Closing connection")
         self.state = STATE_INIT
+        self._discard_recv_buffer()
+        self._reset_pipeline()
         if self.sock is not None:
             self.sock.close()
             self.sock = None
@@ -524,6 +635,8 @@ class Connection(object):
         sock = self.sock
         self.sock = None
         self.state = STATE_INIT
+        self._discard_recv_buffer()
+        self._reset_pipeline()
         if not sock:
             return
         bad_header = struct.pack('<H', 2 * 8193 + 0)  # larger than allowed, and not the final message
@@ -536,22 +649,146 @@ class Connection(object):
             # don't care
             pass
 
-    def cmd(self, operation: str):  # noqa: C901
-        """ put a mapi command on the line"""
+    def cmd(self, operation: str, check_errors: bool = True):
+        """ put a mapi command on the line.
+
+        If 'check_errors' is False, the response is returned as is, without
+        raising an exception for the errors in it."""
         logger.debug("executing command %s" % operation)
 
         if self.state != STATE_READY:
             raise ProgrammingError("Not connected")
 
-        self._putblock(operation)
+        self._send_command(operation)
+        self._skip_unread_responses()
         response = self._getblock_and_transfer_files()
+        if response == MSG_MORE:
+            # tell server it isn't going to get more
+            return self.cmd("", check_errors)
+        self._track_transaction(response)
+        if not check_errors:
+            return response
+        return self._handle_response(response)
+
+    def _track_transaction(self, response: str):
+        """Update in_transaction from the last &4 reply in 'response', if any.
+        The server reports 'f' while auto-commit is off."""
+        if response.startswith(MSG_QBLOCK):
+            return
+        if response.startswith(MSG_QTRANS):
+            i = 0
+        else:
+            i = response.rfind("\n" + MSG_QTRANS) + 1
+            if not i:
+                return
+        self.in_transaction = response[i + 3:i + 4] == 'f'
+
+    def cmd_pipelined(self, operations: Sequence[str]) -> List[Union[str, Error]]:
+        """ put several mapi commands on the line before reading the responses.
+
+        Returns a list holding, for each command, the response or the Error
+        it resulted in. File transfers cannot be pipelined; if the server
+        requests one the connection is closed.
+        """
+        logger.debug("executing %d pipelined commands" % len(operations))
+
+        if self.state != STATE_READY:
+            raise ProgrammingError("Not connected")
+
+        results: List[Union[str, Error]] = []
+        pos = 0
+        while pos < len(operations):
+            window: List[bytes] = []
+            size = 0
+            while pos < len(operations) and len(window) < PIPELINE_WINDOW:
+                data = operations[pos].encode('utf-8')
+                if window and size + len(data) > PIPELINE_WINDOW_BYTES:
+                    break
+                window.append(data)
+                size += len(data)
+                pos += 1
+            self._send_deferred(window)
+            self._skip_unread_responses()
+            for i in range(len(window)):
+                results.append(self._get_pipelined_response())
+        return results
+
+    def cmd_nowait(self, operation: str, defer: bool = False):
+        """ put a mapi command on the line without waiting for the response.
+
+        The response is read and discarded when the next command is executed.
+        This is meant for commands such as Xclose, whose outcome does not
+        matter. Errors are logged.
+
+        If 'defer' is set, the command is only sent right before the next
+        command, in the same network write. Use this for settings such as
+        Xreply_size that only matter to the next command.
+        """
+        logger.debug("sending command %s" % operation)
+
+        if self.state != STATE_READY:
+            raise ProgrammingError("Not connected")
+
+        if defer and len(self.deferred_commands) + 1 < PIPELINE_WINDOW:
+            self.deferred_commands += (operation,)
+            return
+        if self.unread_responses >= PIPELINE_WINDOW:
+            # make sure the server is not blocked on writing the responses
+            self._skip_unread_responses()
+        self._send_command(operation)
+        self.unread_responses += 1
+
+    def _send_command(self, operation: str):
+        """Put the command on the line, preceded by the deferred commands"""
+        if self.deferred_commands:
+            self._send_deferred([operation.encode('utf-8')])
+        else:
+            self._putblock(operation)
+
+    def _send_deferred(self, blocks: List[bytes]):
+        """Put the deferred commands on the line, followed by 'blocks'.
+        The responses to the deferred commands are skipped later."""
+        deferred = self.deferred_commands
+        self.deferred_commands = ()
+        self._putblocks_raw([cmd.encode('utf-8') for cmd in deferred] + blocks)
+        self.unread_responses += len(deferred)
+
+    def _skip_unread_responses(self):
+        """Read and discard the responses to the commands sent by cmd_nowait()"""
+        while self.unread_responses > 0:
+            self.unread_responses -= 1
+            buffer = self._get_buffer()
+            end = self._getblock_raw(buffer, 0)
+            if buffer[:1] == MSG_ERROR_B:
+                logger.warning("Ignoring error: %s", str(buffer[1:end], 'utf-8', 'replace').strip())
+            self._stash_buffer(buffer)
+
+    def _get_pipelined_response(self) -> Union[str, Error]:
+        buffer = self._get_buffer()
+        end = self._getblock_raw(buffer, 0)
+        i = buffer.rfind(b'\n', 0, end - 1)
+        if i >= 2 and buffer[i - 2: i + 1] == MSG_FILETRANS_B:
+            # The server would take our next commands for file contents
+            self._sabotage()
+            raise ProgrammingError("file transfers cannot be pipelined")
+        response = str(memoryview(buffer)[:end], 'utf-8')
+        self._stash_buffer(buffer)
+        if response == MSG_MORE:
+            # The server would take our next commands for the rest of this one
+            self._sabotage()
+            raise ProgrammingError("incomplete statement in pipeline")
+        self._track_transaction(response)
+        try:
+            return self._handle_response(response)
+        except Error as e:
+            return e
+
+    def _handle_response(self, response: str):  # noqa: C901
+        """ check the response to a command for errors and strip the OK marker"""
         if not len(response):
             return ""
         elif response.startswith(MSG_OK):
             return response[3:].strip() or ""
-        if response == MSG_MORE:
-            # tell server it isn't going to get more
-            return self.cmd("")
 
         # If we are performing an update test for errors such as a failed
         # transaction.
@@ -581,24 +818,46 @@ class Connection(object):
         else:
             raise ProgrammingError("unknown state: %s" % response)
 
-    def binary_cmd(self, operation: str) -> memoryview:
+    def new_binary_buffer(self) -> bytearray:
+        """Return a new buffer for binary_cmd() the size of the previous
+        binary response"""
+        return bytearray(self.binary_size_hint)
+
+    def binary_cmd(self, operation: str, buffer: Optional[bytearray] = None) -> memoryview:
         """ put a mapi command on the line, with a binary response.
 
-        returns a memoryview that can only be used until the next
-        operation on this Connection object.
+        The response is received into 'buffer', which is enlarged as needed.
+        If no buffer is given, a buffer owned by this Connection is used and
+        the returned memoryview can only be used until the next operation on
+        this Connection object.
+
+        Before reading, the buffer is enlarged to the size of the previous
+        binary response so a series of similar batches does not need to grow
+        it step by step. Callers that need a new buffer for every response
+        should pass one from :meth:`new_binary_buffer`, which already has
+        that size.
         """
         logger.debug("executing binary command %s" % operation)
 
         if self.state != STATE_READY:
             raise ProgrammingError("Not connected")
 
-        self._putblock(operation)
-        buffer = self._get_buffer()
+        self._send_command(operation)
+        self._skip_unread_responses()
+        stash = buffer is None
+        if buffer is None:
+            buffer = self._get_buffer()
+        _grow_buffer(buffer, self.binary_size_hint)
         n = self._getblock_raw(buffer, 0)
+        self.binary_size_hint = n
         view = memoryview(buffer)[:n]
-        self._stash_buffer(buffer)
+        if stash:
+            self._stash_buffer(buffer)
+        self._check_binary_response(view)
+        return view
 
-        # Handle !Error message
+    def _check_binary_response(self, view: memoryview):
+        """ raise an exception if the binary response is an !Error message"""
         if view[0:len(MSG_ERROR_B)] == MSG_ERROR_B:
             msg_bytes = bytes(view)
             idx = msg_bytes.find(b'\n')
@@ -607,8 +866,6 @@ class Connection(object):
             exception, msg = handle_error(str(msg_bytes, 'utf-8'))
             raise exception(msg)
 
-        return view
-
     def _challenge_response(self, challenge: str):  # noqa: C901
         """ generate a response to a mapi login challenge """
 
@@ -760,8 +1017,12 @@ class Connection(object):
         return offset
 
     def _get_minor_block(self, buffer: bytearray, offset: int) -> Tuple[int, bool]:
-        self._getbytes(buffer, offset, 2)
-        unpacked = buffer[offset] + 256 * buffer[offset + 1]
+        if self.recv_end - self.recv_pos < 2:
+            self._fill_recv_buffer(2)
+        assert self.recv_buffer is not None
+        pos = self.recv_pos
+        unpacked = self.recv_buffer[pos] + 256 * self.recv_buffer[pos + 1]
+        self.recv_pos = pos + 2
         length = unpacked >> 1
         last = unpacked & 1
         if length:
@@ -774,25 +1035,102 @@ class Connection(object):
         Enlarge buffer if necessary.
         Return offset + count if all goes well.
         """
-        assert self.sock
         end = count + offset
-        if len(buffer) < end:
-            # enlarge
-            nblocks = 1 + (end - len(buffer)) // 8192
-            buffer += bytes(nblocks * 8192)
+        _grow_buffer(buffer, end)
         while offset < end:
-            view = memoryview(buffer)[offset:end]
-            n = self.sock.recv_into(view)
-            if n == 0:
-                raise BrokenPipeError("Server closed connection")
+            if self.recv_pos == self.recv_end:
+                self._fill_recv_buffer(1)
+            assert self.recv_buffer is not None
+            n = min(end - offset, self.recv_end - self.recv_pos)
+            buffer[offset:offset + n] = memoryview(self.recv_buffer)[self.recv_pos:self.recv_pos + n]
+            self.recv_pos += n
             offset += n
         return end
 
+    def _fill_recv_buffer(self, minimum: int):
+        """
+        Read from the socket until at least 'minimum' bytes are available
+        in the read-ahead buffer.
+        """
+        assert self.sock
+        assert minimum <= READ_AHEAD_SIZE
+        if self.recv_buffer is None:
+            self.recv_buffer = bytearray(READ_AHEAD_SIZE)
+        buffer = self.recv_buffer
+        available = self.recv_end - self.recv_pos
+        if self.recv_pos:
+            # move the leftovers to the front
+            if available:
+                buffer[:available] = buffer[self.recv_pos:self.recv_end]
+            self.recv_pos = 0
+            self.recv_end = available
+        view = memoryview(buffer)
+        while self.recv_end < minimum:
+            if self.deadline is not None:
+                self._apply_deadline()
+            n = self.sock.recv_into(view[self.recv_end:])
+            if n == 0:
+                raise BrokenPipeError("Server closed connection")
+            self.recv_end += n
+
+    @contextlib.contextmanager
+    def command_deadline(self, deadline: Optional[float]):
+        """Context manager that makes socket operations within the block fail
+        once time.monotonic() passes 'deadline'. None means no deadline.
+
+        When the deadline passes, the connection is left halfway through an
+        exchange with the server, so it is closed and OperationalError is
+        raised.
+        """
+        if deadline is None or self.deadline is not None:
+            # no deadline, or an outer deadline is already in effect
+            yield
+            return
+        assert self.sock
+        self.deadline = deadline
+        self.deadline_saved_timeout = self.sock.gettimeout()
+        try:
+            yield
+        except socket.timeout:
+            if time.monotonic() < deadline:
+                # the socket's own timeout expired first
+                raise
+            logger.debug("Deadline exceeded, closing connection")
+            self._sabotage()
+            raise OperationalError("deadline exceeded, connection closed")
+        finally:
+            self.deadline = None
+            if self.sock is not None:
+                self.sock.settimeout(self.deadline_saved_timeout)
+
+    def _apply_deadline(self):
+        """Set the socket timeout to the time remaining until the deadline"""
+        assert self.sock and self.deadline is not None
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout("deadline exceeded")
+        if self.deadline_saved_timeout is not None:
+            remaining = min(remaining, self.deadline_saved_timeout)
+        self.sock.settimeout(remaining)
+
+    def _discard_recv_buffer(self):
+        """Forget any data left in the read-ahead buffer"""
+        self.recv_pos = 0
+        self.recv_end = 0
+
+    def _reset_pipeline(self):
+        """Forget the commands of cmd_nowait() when the socket goes away"""
+        self.unread_responses = 0
+        self.deferred_commands = ()
+
     def _recv_to_end(self) -> str:
         """
         Read bytes from the socket until the server closes the connection
         """
         parts = []
+        if self.recv_buffer is not None and self.recv_pos < self.recv_end:
+            parts.append(bytes(self.recv_buffer[self.recv_pos:self.recv_end]))
+            self._discard_recv_buffer()
         while True:
             assert self.sock
             received = self.sock.recv(4096)
@@ -822,21 +1160,52 @@ class Connection(object):
             # control does not use the blocking protocol
             return self._send_all_and_shutdown(data)
         else:
-            self._putblock_raw(block.encode(), True)
+            self._putblock_raw(data, True)
 
     def _putblock_raw(self, block, finish):
         """ put the data into the socket """
-        pos = 0
-        last = 0
-        while not last:
-            data = memoryview(block)[pos:pos + MAX_PACKAGE_LENGTH]
-            length = len(data)
-            if length < MAX_PACKAGE_LENGTH:
-                last = 1
-            flag = struct.pack('<H', (length << 1) + (last if finish else 0))
-            self.sock.sendall(flag)
-            self.sock.sendall(data)
-            pos += length
+        self._putblocks_raw([block], finish)
+
+    def _putblocks_raw(self, blocks: Sequence[bytes], finish: bool = True):
+        """ put the data into the socket, each item of 'blocks' as a separate block
+
+        The frames are assembled in a reusable send buffer so that many of
+        them can be written with a single sendall().
+        """
+        assert self.sock
+        # Note that a block whose length is a multiple of MAX_PACKAGE_LENGTH
+        # is followed by an empty frame, hence the + 1.
+        needed = sum(len(b) + 2 * (len(b) // MAX_PACKAGE_LENGTH + 1) for b in blocks)
+        out = self._get_send_buffer(min(needed, MAX_SEND_BUFFER_SIZE))
+        used = 0
+        for block in blocks:
+            data = memoryview(block)
+            total = len(data)
+            pos = 0
+            while True:
+                length = min(total - pos, MAX_PACKAGE_LENGTH)
+                last = length < MAX_PACKAGE_LENGTH
+                if used + 2 + length > len(out):
+                    if self.deadline is not None:
+                        self._apply_deadline()
+                    self.sock.sendall(memoryview(out)[:used])
+                    used = 0
+                flag = (length << 1) + (1 if last and finish else 0)
+                struct.pack_into('<H', out, used, flag)
+                out[used + 2:used + 2 + length] = data[pos:pos + length]
+                used += 2 + length
+                pos += length
+                if last:
+                    break
+        if self.deadline is not None:
+            self._apply_deadline()
+        self.sock.sendall(memoryview(out)[:used])
+
+    def _get_send_buffer(self, size: int) -> bytearray:
+        """Return the send buffer, making sure it holds at least 'size' bytes"""
+        if self.send_buffer is None or len(self.send_buffer) < size:
+            self.send_buffer = bytearray(size)
+        return self.send_buffer
 
     def _send_all_and_shutdown(self, block):
         """ put the data into the socket """
@@ -870,6 +1239,296 @@ class Connection(object):
         self.downloader = downloader
 
 
+def create_ssl_context(target: Target) -> ssl.SSLContext:
+    """Set up the SSL context for a TLS connection to the given Target"""
+    verification_mode = target.connect_tls_verify
+
+    if target.dangerous_tls_nocheck:
+        disabled_checks = set(target.dangerous_tls_nocheck.split(','))
+    else:
+        disabled_checks = set()
+
+    # Set up the SSL context. How to do that depends on the verification mode
+    if verification_mode == 'system':
+        ssl_context = ssl.create_default_context()
+    elif verification_mode == 'cert':
+        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        ssl_context.load_verify_locations(target.cert)
+    else:
+        assert verification_mode == 'hash'
+        ssl_context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        disabled_checks.add('host')
+        disabled_checks.add('cert')
+
+    # The following is common between all verification modes
+    ssl_context.minimum_version = ssl.TLSVersion.TLSv1_3
+    ssl_context.set_alpn_protocols(["mapi/9"])
+    if target.clientkey:
+        certfile = (target.clientcert or target.clientkey)
+        keyfile = target.clientkey
+        ssl_context.load_cert_chain(certfile, keyfile)
+    if 'host' in disabled_checks:
+        ssl_context.check_hostname = False
+    if 'cert' in disabled_checks:
+        ssl_context.verify_mode = ssl.CERT_NONE
+
+    return ssl_context
+
+
+_endpoint_lock = threading.Lock()
+_endpoints: Dict[Tuple, Target] = {}
+
+
+def clear_endpoint_cache():
+    """Forget where earlier connections were redirected to or found by scanning"""
+    with _endpoint_lock:
+        _endpoints.clear()
+
+
+def _cached_endpoint(key: Tuple) -> Optional[Target]:
+    with _endpoint_lock:
+        endpoint = _endpoints.get(key)
+    return endpoint.clone() if endpoint is not None else None
+
+
+def _remember_endpoint(key: Tuple, target: Target):
+    with _endpoint_lock:
+        _endpoints[key] = target.clone()
+
+
+def _forget_endpoint(key: Tuple):
+    with _endpoint_lock:
+        _endpoints.pop(key, None)
+
+
+_dns_lock = threading.Lock()
+_dns_cache: Dict[Tuple[str, int], Tuple[float, List[Tuple]]] = {}
+_dns_cache_ttl = 0.0
+
+
+def set_dns_cache_ttl(seconds: float):
+    """Remember resolved host names for the given number of seconds.
+
+    This saves a DNS lookup when the same server is connected to over and
+    over, for example by a connection pool. The default, 0, disables the
+    cache. Cached addresses are forgotten when connecting to them fails.
+    """
+    global _dns_cache_ttl
+    with _dns_lock:
+        _dns_cache_ttl = seconds
+        if seconds <= 0:
+            _dns_cache.clear()
+
+
+def clear_dns_cache():
+    """Forget all cached host name lookups"""
+    with _dns_lock:
+        _dns_cache.clear()
+
+
+def _resolve(host: str, port: int) -> List[Tuple]:
+    key = (host, port)
+    with _dns_lock:
+        ttl = _dns_cache_ttl
+        entry = _dns_cache.get(key)
+    now = time.monotonic()
+    if entry is not None and entry[0] > now:
+        return entry[1]
+    addrs = socket.getaddrinfo(host, port, socket.AF_UNSPEC, socket.SOCK_STREAM)
+    if ttl > 0:
+        with _dns_lock:
+            _dns_cache[key] = (now + ttl, addrs)
+    return addrs
+
+
+def _forget_resolved(host: str, port: int):
+    with _dns_lock:
+        _dns_cache.pop((host, port), None)
+
+
+def _interleave_families(addrs: List[Tuple]) -> List[Tuple]:
+    """Reorder the addresses so the address families alternate, as described
+    in RFC 8305 section 4. Within a family the order is preserved."""
+    by_family: Dict[int, List[Tuple]] = {}
+    for addr in addrs:
+        by_family.setdefault(addr[0], []).append(addr)
+    queues = list(by_family.values())
+    result = []
+    while queues:
+        for q in queues:
+            result.append(q.pop(0))
+        queues = [q for q in queues if q]
+    return result
+
+
+def _connect_staggered(addrs: List[Tuple], deadline: float) -> socket.socket:  # noqa: C901
+    """Connect to the first of the addresses that answers, RFC 8305 style.
+
+    Rather than waiting for each attempt to time out before trying the next
+    address, a new attempt is started every CONNECTION_ATTEMPT_DELAY seconds,
+    or as soon as an attempt fails, while the earlier attempts remain in
+    progress. The first to succeed wins.
+    """
+    pending = list(addrs)
+    attempts: Dict[socket.socket, Tuple] = {}
+    selector = selectors.DefaultSelector()
+    err: Optional[OSError] = None
+    next_start = 0.0
+    try:
+        while pending or attempts:
+            now = time.time()
+            if now >= deadline:
+                raise socket.timeout("timed out")
+            if pending and (not attempts or now >= next_start):
+                fam, typ, proto, cname, addr = pending.pop(0)
+                if len(addr) >= 4 and (addr[2] != 0 or addr[3] != 0):
+                    logger.debug('Trying %s port %d flow %d scope %d', *addr)
+                else:
+                    logger.debug('Trying %s port %d', addr[0], addr[1])
+                s = socket.socket(fam, typ, proto)
+                s.setblocking(False)
+                rc = s.connect_ex(addr)
+                if rc not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK, errno.EAGAIN):
+                    s.close()
+                    err = OSError(rc, os.strerror(rc))
+                    continue
+                selector.register(s, selectors.EVENT_WRITE)
+                attempts[s] = addr
+                next_start = now + CONNECTION_ATTEMPT_DELAY
+            timeout = deadline - now
+            if pending:
+                timeout = min(timeout, next_start - now)
+            for key, _ in selector.select(None if timeout == float('inf') else max(timeout, 0)):
+                s = typing.cast(socket.socket, key.fileobj)
+                selector.unregister(s)
+                del attempts[s]
+                rc = s.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+                if rc == 0:
+                    s.setblocking(True)
+                    return s
+                s.close()
+                err = OSError(rc, os.strerror(rc))
+                # start the next attempt right away
+                next_start = now
+    finally:
+        for s in attempts:
+            s.close()
+        selector.close()
+    assert err is not None
+    raise err
+
+
+class TlsStats:
+    """Counters describing the process-wide SSL context cache and TLS session resumption"""
+
+    contexts_created = 0
+    context_cache_hits = 0
+    handshakes = 0
+    # Handshakes where we offered a cached session, and where the server accepted it
+    resumptions_attempted = 0
+    resumptions = 0
+
+    def clone(self) -> "TlsStats":
+        return copy.copy(self)
+
+
+_tls_lock = threading.Lock()
+_tls_contexts: Dict[Tuple, ssl.SSLContext] = {}
+_tls_sessions: Dict[Tuple, ssl.SSLSession] = {}
+_tls_stats = TlsStats()
+
+
+def tls_stats() -> TlsStats:
+    """Return a snapshot of the SSL context cache and TLS session resumption counters"""
+    with _tls_lock:
+        return _tls_stats.clone()
+
+
+def clear_tls_cache():
+    """Forget all cached SSL contexts and TLS sessions"""
+    with _tls_lock:
+        _tls_contexts.clear()
+        _tls_sessions.clear()
+
+
+def _file_stamp(path: str) -> Optional[float]:
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _tls_context_key(target: Target) -> Tuple:
+    # Include the modification times so updated certificate files are picked up
+    files = (target.cert, target.clientkey, target.clientcert)
+    stamps = tuple(_file_stamp(f) if f else None for f in files)
+    return (target.connect_tls_verify, target.dangerous_tls_nocheck) + files + stamps
+
+
+def get_ssl_context(target: Target) -> ssl.SSLContext:
+    """Return a cached SSL context for the given Target, creating it if necessary.
+
+    Setting up a context involves loading certificates from disk, which is
+    relatively expensive. Targets that only differ in fields that do not
+    affect the context share it.
+    """
+    key = _tls_context_key(target)
+    with _tls_lock:
+        ssl_context = _tls_contexts.get(key)
+        if ssl_context is not None:
+            _tls_stats.context_cache_hits += 1
+            return ssl_context
+    ssl_context = create_ssl_context(target)
+    with _tls_lock:
+        _tls_stats.contexts_created += 1
+        return _tls_contexts.setdefault(key, ssl_context)
+
+
+def _tls_session_key(target: Target) -> Tuple:
+    return _tls_context_key(target) + (target.connect_tcp, target.connect_port)
+
+
+def _cached_tls_session(target: Target) -> Optional[ssl.SSLSession]:
+    key = _tls_session_key(target)
+    with _tls_lock:
+        session = _tls_sessions.get(key)
+        if session is not None and session.time + session.timeout <= time.time():
+            del _tls_sessions[key]
+            session = None
+    return session
+
+
+def _remember_tls_session(target: Target, sock: ssl.SSLSocket):
+    session = sock.session
+    if session is not None and session.has_ticket:
+        with _tls_lock:
+            _tls_sessions[_tls_session_key(target)] = session
+
+
+def _record_tls_handshake(attempted: bool, reused: bool):
+    with _tls_lock:
+        _tls_stats.handshakes += 1
+        if attempted:
+            _tls_stats.resumptions_attempted += 1
+        if reused:
+            _tls_stats.resumptions += 1
+
+
+def verify_fingerprint(der: Optional[bytes], fingerprint: str):
+    """Raise an SSLError if the DER encoded certificate does not match the fingerprint"""
+    m = re.match(r'sha256:([0-9a-fA-F:]+)$', fingerprint)
+    if not m:
+        raise ssl.SSLError(f"invalid certificate hash {fingerprint!r}")
+    digits = m.group(1).lower().replace(':', '')
+
+    if not der:
+        raise ssl.SSLError("server has no certificate")
+
+    digest = hashlib.sha256(der).hexdigest()
+    if not digest.startswith(digits):
+        raise ssl.SSLError(f"wrong server certificate hash: {fingerprint}")
+
+
 def mal_escape(s):
     mapping = {'\n': r'\n', '\t': r'\t', '"': r'\"', '\\': r'\\'}
     return "".join(mapping.get(c, c) for c in s)
@@ -884,18 +1543,30 @@ class HandshakeOption:
     The `level` is used to determine if the server supports this option.
     The `fallback` is a function-like object that can be called with the
     value (not converted to an integer) as a parameter.
+    If `command` is given, it is called with the value instead and returns
+    the MAPI command that sets the option, which is sent together with the
+    other commands that complete the connection setup.
     Field `sent` can be used to keep track of whether the option has been sent.
     """
 
-    def __init__(self, level, name, fallback, value):
+    def __init__(self, level, name, fallback, value, command=None):
         self.level = level
         self.name = name
         self.value = value
         self.fallback = fallback
+        self.command = command
         self.sent = False
 
 
-def construct_target_from_args(database: Optional[str], username: str, password: str, language: str,  # noqa: C901
+def _grow_buffer(buffer: bytearray, size: int):
+    """Enlarge 'buffer' to at least 'size' bytes, at least doubling it to
+    keep the number of reallocations logarithmic"""
+    if len(buffer) < size:
+        buffer += bytes(max(size, 2 * len(buffer)) - len(buffer))
+
+
+def construct_target_from_args(database: Optional[str], username: Optional[str], password: Optional[str],  # noqa: C901
+                               language: Optional[str],
                                hostname: Optional[str] = None, port: Optional[int] = None, unix_socket: Optional[str] = None,
                                connect_timeout: Optional[Union[float, int]] = None,
                                **kwargs):
@@ -0,0 +1,417 @@
+"""
+A thread-safe pool of SQL connections.
+
+Setting up a connection takes several round trips to the server: the login
+handshake, possibly redirects and the session options that are sent after
+logging in. Applications that run many short transactions can keep a pool of
+connections around instead::
+
+    pool = pymonetdb.pool.ConnectionPool('monetdb://localhost/demo', max_size=4)
+    with pool.connection() as conn:
+        with conn.cursor() as c:
+            c.execute('SELECT 42')
+
+When a connection is returned to the pool, any pending transaction is rolled
+back and the schema, autocommit mode, statement timeout and replysize are
+reset to the values they had when the connection was created.
+"""
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0.  If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright 1997 - July 2008 CWI, August 2008 - 2016 MonetDB B.V.
+
+import contextlib
+import copy
+import logging
+import threading
+import time
+from typing import Dict, Iterator, List, Optional, Tuple, Union
+
+from pymonetdb.exceptions import Error, OperationalError, ProgrammingError
+from pymonetdb.mapi import STATE_READY
+from pymonetdb.sql.connections import Connection
+from pymonetdb.target import Target, looks_like_url
+
+logger = logging.getLogger(__name__)
+
+
+class PoolStats:
+    """Counters describing the activity of a :class:`ConnectionPool`"""
+
+    # Open connections, idle or in use
+    size = 0
+    idle = 0
+    in_use = 0
+
+    # Connections handed out and connections that had to be waited for
+    checkouts = 0
+    waits = 0
+    # Total and maximum time in seconds spent waiting for a connection
+    wait_time = 0.0
+    max_wait_time = 0.0
+    # Checkouts that gave up waiting
+    timeouts = 0
+
+    created = 0
+    discarded = 0
+    failed_health_checks = 0
+
+    def clone(self) -> "PoolStats":
+        return copy.copy(self)
+
+
+class _Entry:
+    """Bookkeeping for one pooled connection"""
+
+    def __init__(self, conn: Connection, schema: str):
+        self.conn = conn
+        self.schema = schema
+        self.policy = conn._policy.clone()
+        self.statement_timeout = conn.statement_timeout
+        self.created = self.last_used = time.monotonic()
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of :class:`pymonetdb.sql.connections.Connection` objects
+    that all connect to the same Target.
+
+    target
+        a :class:`pymonetdb.Target`, a MonetDB URL or a database name.
+    min_size
+        number of connections that are created up front and kept around
+        even when idle.
+    max_size
+        maximum number of connections, idle or in use.
+    timeout
+        maximum number of seconds :meth:`getconn` waits for a connection to
+        become available when `max_size` connections are in use.
+    idle_timeout
+        connections that have been idle for longer than this many seconds are
+        closed, as long as at least `min_size` connections remain.
+        None means never.
+    max_lifetime
+        connections older than this many seconds are closed instead of being
+        handed out again. None means never.
+    check_after
+        connections that have been idle for at least this many seconds are
+        checked with a cheap command before they are handed out.
+        None disables the check.
+    reset_schema
+        whether to restore the original schema when a connection is returned.
+    """
+
+    def __init__(self, target: Union[str, Target], *,
+                 min_size: int = 0,
+                 max_size: int = 10,
+                 timeout: float = 30.0,
+                 idle_timeout: Optional[float] = 600.0,
+                 max_lifetime: Optional[float] = 3600.0,
+                 check_after: Optional[float] = 0.0,
+                 reset_schema: bool = True):
+        if min_size < 0 or max_size < 1 or min_size > max_size:
+            raise ProgrammingError(f"invalid pool size: min_size={min_size}, max_size={max_size}")
+        self.target = _make_target(target)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.max_lifetime = max_lifetime
+        self.check_after = check_after
+        self.reset_schema = reset_schema
+
+        self._cond = threading.Condition()
+        self._idle: List[_Entry] = []   # most recently returned last
+        self._in_use: Dict[int, _Entry] = {}
+        self._size = 0    # idle, in use or being created
+        self._closed = False
+        self._stats = PoolStats()
+
+        try:
+            for i in range(min_size):
+                entry = self._create()
+                with self._cond:
+                    self._size += 1
+                    self._idle.append(entry)
+        except BaseException:
+            self.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        # Propagate any errors
+        return False
+
+    def key(self) -> Tuple:
+        """Hashable value identifying the Target of this pool"""
+        return self.target.cache_key()
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    def stats(self) -> PoolStats:
+        """Return a snapshot of the pool statistics"""
+        with self._cond:
+            stats = self._stats.clone()
+            stats.idle = len(self._idle)
+            stats.in_use = len(self._in_use)
+            stats.size = self._size
+        return stats
+
+    @contextlib.contextmanager
+    def connection(self, timeout: Optional[float] = None) -> Iterator[Connection]:
+        """Context manager that checks out a connection and returns it to the pool afterwards"""
+        conn = self.getconn(timeout)
+        try:
+            yield conn
+        finally:
+            self.putconn(conn)
+
+    def getconn(self, timeout: Optional[float] = None) -> Connection:
+        """
+        Take a connection from the pool, creating a new one if none is idle
+        and the pool is not full. Otherwise, wait at most `timeout` seconds
+        (default: the timeout of the pool) for a connection to be returned.
+
+        The connection must be handed back using :meth:`putconn`.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        while True:
+            entry = self._take(timeout)
+            if entry is None:
+                try:
+                    entry = self._create()
+                except BaseException:
+                    with self._cond:
+                        self._size -= 1
+                        self._cond.notify()
+                    raise
+            elif self._expired(entry, time.monotonic()) or not self._healthy(entry):
+                self._discard(entry)
+                continue
+            with self._cond:
+                self._in_use[id(entry.conn)] = entry
+                self._stats.checkouts += 1
+            return entry.conn
+
+    def putconn(self, conn: Connection, discard: bool = False):
+        """
+        Return a connection to the pool. The session is reset first.
+        If `discard` is True or the reset fails, the connection is closed
+        instead.
+        """
+        with self._cond:
+            entry = self._in_use.pop(id(conn), None)
+        if entry is None or entry.conn is not conn:
+            raise ProgrammingError("connection does not belong to this pool")
+
+        if not discard and not self._closed and not self._expired(entry, time.monotonic()):
+            try:
+                self._reset(entry)
+            except (Error, OSError) as e:
+                logger.debug(f"Discarding pooled connection, reset failed: {e}")
+                discard = True
+        else:
+            discard = True
+
+        if discard:
+            self._discard(entry)
+            return
+
+        entry.last_used = time.monotonic()
+        with self._cond:
+            if self._closed:
+                discard = True
+            else:
+                self._idle.append(entry)
+                self._cond.notify()
+        if discard:
+            self._discard(entry)
+
+    def close(self):
+        """
+        Close the idle connections. Connections that are currently checked
+        out are closed when they are returned.
+        """
+        with self._cond:
+            self._closed = True
+            idle = self._idle
+            self._idle = []
+            self._cond.notify_all()
+        for entry in idle:
+            self._discard(entry)
+
+    def _take(self, timeout: float) -> Optional[_Entry]:
+        """Pop an idle entry, or reserve a slot and return None, or time out"""
+        stale: List[_Entry] = []
+        started = None
+        entry: Optional[_Entry]
+        try:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        raise ProgrammingError("connection pool is closed")
+                    stale += self._prune_locked()
+                    if self._idle:
+                        entry = self._idle.pop()
+                        break
+                    if self._size < self.max_size:
+                        self._size += 1
+                        entry = None
+                        break
+                    now = time.monotonic()
+                    if started is None:
+                        started = now
+                        self._stats.waits += 1
+                    remaining = started + timeout - now
+                    if remaining <= 0:
+                        self._stats.timeouts += 1
+                        self._record_wait_locked(started)
+                        raise OperationalError(
+                            f"no connection became available within {timeout} seconds")
+                    self._cond.wait(remaining)
+                if started is not None:
+                    self._record_wait_locked(started)
+                return entry
+        finally:
+            for e in stale:
+                _close_quietly(e.conn)
+
+    def _record_wait_locked(self, started: float):
+        waited = time.monotonic() - started
+        self._stats.wait_time += waited
+        self._stats.max_wait_time = max(self._stats.max_wait_time, waited)
+
+    def _prune_locked(self) -> List[_Entry]:
+        """Remove expired idle entries, oldest first, keeping at least min_size.
+        The caller must close the connections of the returned entries."""
+        now = time.monotonic()
+        stale = []
+        keep = []
+        for entry in self._idle:
+            if self._size > self.min_size and self._expired(entry, now, idle=True):
+                stale.append(entry)
+                self._size -= 1
+                self._stats.discarded += 1
+            else:
+                keep.append(entry)
+        if stale:
+            self._idle = keep
+        return stale
+
+    def _expired(self, entry: _Entry, now: float, idle: bool = False) -> bool:
+        if self.max_lifetime is not None and now - entry.created >= self.max_lifetime:
+            return True
+        if idle and self.idle_timeout is not None and now - entry.last_used >= self.idle_timeout:
+            return True
+        return False
+
+    def _create(self) -> _Entry:
+        conn = Connection(self.target)
+        try:
+            with conn.cursor() as c:
+                c.execute("SELECT CURRENT_SCHEMA")
+                schema = c.fetchone()[0]
+            if not conn.autocommit:
+                conn.rollback()
+        except BaseException:
+            _close_quietly(conn)
+            raise
+        with self._cond:
+            self._stats.created += 1
+        return _Entry(conn, '"' + schema.replace('"', '""') + '"')
+
+    def _healthy(self, entry: _Entry) -> bool:
+        conn = entry.conn
+        if conn.mapi is None or conn.mapi.state != STATE_READY:
+            return False
+        if self.check_after is None or time.monotonic() - entry.last_used < self.check_after:
+            return True
+        try:
+            # Cheap round trip that does not start a transaction
+            conn.command("Xreply_size %d" % conn._current_replysize)
+            return True
+        except (Error, OSError) as e:
+            logger.debug(f"Pooled connection failed health check: {e}")
+            with self._cond:
+                self._stats.failed_health_checks += 1
+            return False
+
+    def _reset(self, entry: _Entry):
+        conn = entry.conn
+        if conn.mapi is None or conn.mapi.state != STATE_READY:
+            raise OperationalError("connection is closed")
+        autocommit = self.target.autocommit
+        if conn.autocommit != autocommit:
+            if not conn.autocommit or conn.mapi.in_transaction:
+                conn.rollback()
+            conn.set_autocommit(autocommit)
+        if conn.statement_timeout != entry.statement_timeout:
+            conn.set_statement_timeout(entry.statement_timeout)
+        statements = []
+        if self.reset_schema:
+            statements.append("SET SCHEMA " + entry.schema)
+        if not conn.autocommit:
+            # Roll back the user's transaction, and the one started by SET SCHEMA.
+            statements = ['ROLLBACK'] + statements + (['ROLLBACK'] if statements else [])
+        elif conn.mapi.in_transaction:
+            # The user started a transaction with START TRANSACTION
+            statements = ['ROLLBACK'] + statements
+        if statements:
+            conn.execute(";\n".join(statements))
+        conn._policy = entry.policy.clone()
+
+    def _discard(self, entry: _Entry):
+        _close_quietly(entry.conn)
+        with self._cond:
+            self._size -= 1
+            self._stats.discarded += 1
+            self._cond.notify()
+
+
+def _make_target(target: Union[str, Target]) -> Target:
+    if isinstance(target, Target):
+        return target.clone()
+    result = Target()
+    if looks_like_url(target):
+        result.parse(target)
+    else:
+        result.database = target
+    return result
+
+
+def _close_quietly(conn):
+    # No need to roll back, the server does that when the connection drops
+    mapi = conn.mapi
+    conn.mapi = None
+    if mapi is not None:
+        try:
+            mapi.disconnect()
+        except OSError:
+            pass
+
+
+_pools: Dict[Tuple, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(target: Union[str, Target], **kwargs) -> ConnectionPool:
+    """
+    Return the process-wide pool for the given Target, creating it if
+    necessary. The keyword arguments are passed to :class:`ConnectionPool`
+    when a new pool is created and ignored otherwise.
+    """
+    target = _make_target(target)
+    key = target.cache_key()
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None or pool.closed:
+            pool = ConnectionPool(target, **kwargs)
+            _pools[key] = pool
+        return pool
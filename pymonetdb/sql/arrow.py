@@ -0,0 +1,198 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0.  If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright 1997 - July 2008 CWI, August 2008 - 2016 MonetDB B.V.
+
+"""
+functions for converting result sets to Apache Arrow record batches
+
+PyArrow is an optional dependency, it is only imported when these functions
+are used.
+"""
+
+from decimal import Decimal
+from importlib import import_module
+import json
+import sys
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from pymonetdb.exceptions import InterfaceError, InternalError
+from pymonetdb.sql import columnar, pythonize, pythonizebin, types
+from pymonetdb.sql.rows import ColumnBatch
+
+if TYPE_CHECKING:
+    from pymonetdb.sql.cursors import Description
+
+
+def pyarrow():
+    """Import PyArrow, raising ImportError with a helpful message if it is missing"""
+    try:
+        return import_module('pyarrow')
+    except ImportError as e:
+        raise ImportError(f"PyArrow is required for Arrow fetches: {e}") from e
+
+
+# Arrow types of the MonetDB types, as the name of a pyarrow factory
+# function and its arguments. Types that are not listed become strings.
+ARROW_TYPES: Dict[str, Tuple[str, Tuple]] = {
+    types.TINYINT: ('int8', ()),
+    types.SMALLINT: ('int16', ()),
+    types.INT: ('int32', ()),
+    types.BIGINT: ('int64', ()),
+    types.HUGEINT: ('decimal128', (38, 0)),
+    types.REAL: ('float32', ()),
+    types.FLOAT: ('float64', ()),
+    types.DOUBLE: ('float64', ()),
+    types.BOOLEAN: ('bool_', ()),
+    types.BLOB: ('binary', ()),
+    types.DATE: ('date32', ()),
+    types.TIME: ('time64', ('us',)),
+    types.TIMESTAMP: ('timestamp', ('us',)),
+    types.TIMESTAMPTZ: ('timestamp', ('us', 'UTC')),
+    types.MONTH_INTERVAL: ('int32', ()),
+    types.SEC_INTERVAL: ('duration', ('us',)),
+    types.DAY_INTERVAL: ('int64', ()),
+}
+
+# How to turn the Python values of a column into something PyArrow accepts
+# for the Arrow type, if they need converting.
+VALUE_CONVERTERS: Dict[str, Callable[[Any], Any]] = {
+    types.HUGEINT: Decimal,
+    types.JSON: json.dumps,
+}
+
+
+def arrow_type(description: 'Description', decimals: str = 'decimal'):
+    """The Arrow type used for columns with the given description. For
+    DECIMAL, 'decimals' is the representation, see Cursor.decimals."""
+    pa = pyarrow()
+    if description.type_code == types.DECIMAL:
+        representation = pythonize.decimal_representation(decimals, description.precision)
+        if representation == 'float':
+            return pa.float64()
+        if representation == 'scaled':
+            return pa.int64()
+        return pa.decimal128(description.precision, description.scale)
+    factory, args = ARROW_TYPES.get(description.type_code, ('string', ()))
+    return getattr(pa, factory)(*args)
+
+
+def schema(description: List['Description'], decimals: str = 'decimal'):
+    """The Arrow schema of a result set"""
+    pa = pyarrow()
+    return pa.schema([pa.field(d.name, arrow_type(d, decimals)) for d in description])
+
+
+def from_values(values: Sequence[Any], type_code: str, atype):
+    """Convert a sequence of Python values, None for NULL, to an Arrow array"""
+    pa = pyarrow()
+    converter = VALUE_CONVERTERS.get(type_code)
+    if converter is None and pa.types.is_string(atype) and type_code not in columnar.STRING_TYPES:
+        converter = str
+    if converter is not None:
+        values = [None if v is None else converter(v) for v in values]
+    return pa.array(values, type=atype)
+
+
+def from_binary(decoder: 'pythonizebin.BinaryDecoder', type_code: str, atype, server_endian: str, data: memoryview):
+    """Convert one column of a binary result set to an Arrow array.
+
+    Fixed width columns are wrapped without copying if the server has our
+    byte order, strings are converted to Arrow's offsets and data buffers in
+    bulk. Other columns are decoded to Python objects first.
+    """
+    pa = pyarrow()
+    if isinstance(decoder, pythonizebin.IntegerDecoder):
+        if decoder.mapper is None and pa.types.is_integer(atype):
+            # scaled DECIMALs are transferred in fewer bits than the int64 they become
+            width = 8 * columnar.numpy().dtype(decoder.array_letter).itemsize
+            array = _fixed_width(getattr(pa, f'int{width}')(), decoder.array_letter, decoder.null_value,
+                                 server_endian, data)
+            return array if array.type == atype else array.cast(atype)
+        if isinstance(decoder, pythonizebin.DecimalDecoder) and pa.types.is_floating(atype):
+            values, mask = columnar.from_binary(decoder, 'f8', server_endian, data)
+            return pa.array(values, type=atype, mask=mask)
+        if pa.types.is_boolean(atype):
+            return _booleans(decoder.null_value, data)
+    elif isinstance(decoder, pythonizebin.FloatDecoder):
+        return _fixed_width(atype, decoder.array_letter, None, server_endian, data)
+    elif isinstance(decoder, pythonizebin.ZeroDelimitedDecoder) and pa.types.is_string(atype):
+        return _strings(data)
+    return from_values(decoder.decode(server_endian, data), type_code, atype)
+
+
+def from_batch(batch: Sequence, colno: int, type_code: str, atype, start: int, end: int):
+    """Convert the values of column 'colno' in rows start:end of a batch to an
+    Arrow array. The batch is a list of tuples or a ColumnBatch."""
+    if not isinstance(batch, ColumnBatch):
+        return from_values([row[colno] for row in batch[start:end]], type_code, atype)
+    if batch.is_decoded(colno):
+        return from_values(batch.column(colno)[start:end], type_code, atype)
+    array = from_binary(batch.decoders[colno], type_code, atype, batch.server_endian, batch.slices[colno])
+    if len(array) != len(batch):
+        raise InterfaceError(f"expected {len(batch)} values in column {colno}, found {len(array)}")
+    return array.slice(start, end - start)
+
+
+def _validity(valid) -> Tuple[Optional[Any], int]:
+    """Turn a boolean array into an Arrow validity bitmap and a null count"""
+    np = columnar.numpy()
+    null_count = len(valid) - int(np.count_nonzero(valid))
+    if null_count == 0:
+        return None, 0
+    return pyarrow().py_buffer(np.packbits(valid, bitorder='little')), null_count
+
+
+def _fixed_width(atype, letter: str, null_value: Optional[int], server_endian: str, data: memoryview):
+    np = columnar.numpy()
+    pa = pyarrow()
+    values = np.frombuffer(data, dtype=np.dtype(letter).newbyteorder('<' if server_endian == 'little' else '>'))
+    if server_endian != sys.byteorder:
+        values = values.byteswap().view(values.dtype.newbyteorder('='))
+    if null_value is None:
+        validity, null_count = _validity(~np.isnan(values))
+    else:
+        validity, null_count = _validity(values != null_value)
+    buffers = [validity, pa.py_buffer(values)]
+    return pa.Array.from_buffers(atype, len(values), buffers, null_count=null_count)
+
+
+def _booleans(null_value: int, data: memoryview):
+    np = columnar.numpy()
+    pa = pyarrow()
+    raw = np.frombuffer(data, dtype=np.int8)
+    validity, null_count = _validity(raw != null_value)
+    bits = pa.py_buffer(np.packbits(raw > 0, bitorder='little'))
+    return pa.Array.from_buffers(pa.bool_(), len(raw), [validity, bits], null_count=null_count)
+
+
+def _strings(data: memoryview):
+    """Convert NUL-terminated strings, with b'\\x80' for NULL, to an Arrow string array"""
+    np = columnar.numpy()
+    pa = pyarrow()
+    raw = np.frombuffer(data, dtype=np.uint8)
+    ends = np.flatnonzero(raw == 0)
+    n = len(ends)
+    if n and ends[-1] != len(raw) - 1:
+        raise InternalError("string column does not end in a terminator")
+    starts = np.zeros(n, dtype=ends.dtype)
+    starts[1:] = ends[:-1] + 1
+    lengths = ends - starts
+    nulls = (lengths == 1) & (raw[starts] == 0x80)
+    lengths[nulls] = 0
+    # drop the terminators and the NULL markers, keep the rest
+    keep = raw != 0
+    keep[starts[nulls]] = False
+    chars = raw[keep]
+    if len(chars) >= 1 << 31:
+        raise InternalError("string column too large")
+    offsets = np.zeros(n + 1, dtype=np.int32)
+    np.cumsum(lengths, out=offsets[1:])
+    validity, null_count = _validity(~nulls)
+    buffers = [validity, pa.py_buffer(offsets), pa.py_buffer(chars)]
+    return pa.Array.from_buffers(pa.string(), n, buffers, null_count=null_count)
+
+
+def record_batch(arrays: List[Any], arrow_schema):
+    return pyarrow().RecordBatch.from_arrays(arrays, schema=arrow_schema)
@@ -0,0 +1,274 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0.  If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright 1997 - July 2008 CWI, August 2008 - 2016 MonetDB B.V.
+
+"""
+functions for converting result sets to NumPy arrays, one array per column,
+and to pandas DataFrames
+
+NumPy and pandas are optional dependencies, they are only imported when these
+functions are used.
+
+Each column is represented as a pair (values, mask). 'values' is a NumPy
+array and 'mask' is either None, meaning the column contains no NULLs, or
+a boolean array that is True where the value is NULL. The entries of
+'values' at NULL positions are unspecified.
+"""
+
+from datetime import timezone
+from importlib import import_module
+from typing import TYPE_CHECKING, Any, List, Optional, Sequence, Tuple
+
+from pymonetdb.exceptions import InterfaceError
+from pymonetdb.sql import pythonizebin, types
+from pymonetdb.sql.rows import ColumnBatch
+
+if TYPE_CHECKING:
+    from pymonetdb.sql.cursors import Description
+
+Column = Tuple[Any, Optional[Any]]
+
+# NumPy dtypes for the column types that map to fixed width values.
+# Other columns become arrays of Python objects.
+NUMPY_DTYPES = {
+    types.TINYINT: 'i1',
+    types.SMALLINT: 'i2',
+    types.INT: 'i4',
+    types.BIGINT: 'i8',
+    types.REAL: 'f4',
+    types.FLOAT: 'f8',
+    types.DOUBLE: 'f8',
+    types.BOOLEAN: '?',
+    types.MONTH_INTERVAL: 'i4',
+}
+
+# NumPy dtypes for the temporal types, used if datetime64 output is
+# requested. TIMESTAMPTZ values are converted to UTC.
+DATETIME64_DTYPES = {
+    types.DATE: 'datetime64[D]',
+    types.TIMESTAMP: 'datetime64[us]',
+    types.TIMESTAMPTZ: 'datetime64[us]',
+}
+
+
+def numpy():
+    """Import NumPy, raising ImportError with a helpful message if it is missing"""
+    try:
+        return import_module('numpy')
+    except ImportError as e:
+        raise ImportError(f"NumPy is required for columnar fetches: {e}") from e
+
+
+def pandas():
+    """Import pandas, raising ImportError with a helpful message if it is missing"""
+    try:
+        return import_module('pandas')
+    except ImportError as e:
+        raise ImportError(f"pandas is required for DataFrame fetches: {e}") from e
+
+
+# NumPy dtypes for the representations of DECIMAL, see Cursor.decimals
+DECIMAL_DTYPES = {
+    'decimal': 'O',
+    'float': 'f8',
+    'scaled': 'i8',
+}
+
+
+def column_dtype(type_code: str, datetime64: bool = False, decimals: str = 'decimal') -> str:
+    """The NumPy dtype used for columns of the given MonetDB type. If
+    'datetime64' is set, DATE and TIMESTAMP columns get a datetime64 dtype.
+    For DECIMAL, 'decimals' is the representation of the column as returned
+    by pythonize.decimal_representation()."""
+    if datetime64 and type_code in DATETIME64_DTYPES:
+        return DATETIME64_DTYPES[type_code]
+    if type_code == types.DECIMAL:
+        return DECIMAL_DTYPES[decimals]
+    return NUMPY_DTYPES.get(type_code, 'O')
+
+
+def from_values(values: Sequence[Any], dtype: str) -> Column:
+    """Convert a sequence of Python values, None for NULL, to a column"""
+    np = numpy()
+    mask = None
+    if dtype == 'O':
+        arr = np.empty(len(values), dtype=object)
+        arr[:] = values
+        if None in values:
+            mask = np.equal(arr, None)
+        return arr, mask
+    if dtype.startswith('datetime64'):
+        # NumPy does not accept time zones, and turns None into NaT
+        naive = [v if v is None or getattr(v, 'tzinfo', None) is None else
+                 v.astimezone(timezone.utc).replace(tzinfo=None) for v in values]
+        arr = np.array(naive, dtype=dtype)
+        mask = np.isnat(arr)
+        return arr, (mask if mask.any() else None)
+    if None in values:
+        mask = np.fromiter((v is None for v in values), dtype=bool, count=len(values))
+        values = [0 if v is None else v for v in values]
+    return np.array(values, dtype=dtype), mask
+
+
+def from_binary(decoder: 'pythonizebin.BinaryDecoder', dtype: str, server_endian: str, data: memoryview) -> Column:
+    """Convert one column of a binary result set to a column.
+
+    Fixed width columns are interpreted in place where possible, so the
+    values array may refer to the memory of 'data'. Other columns are
+    decoded to Python objects first.
+    """
+    np = numpy()
+    if dtype != 'O':
+        byteorder = '<' if server_endian == 'little' else '>'
+        if isinstance(decoder, pythonizebin.IntegerDecoder) and (decoder.mapper is None or dtype == '?'):
+            raw = np.frombuffer(data, dtype=np.dtype(decoder.array_letter).newbyteorder(byteorder))
+            mask = raw == decoder.null_value
+            values = raw != 0 if dtype == '?' else raw.astype(dtype, copy=False)
+            return values, (mask if mask.any() else None)
+        if isinstance(decoder, pythonizebin.DecimalDecoder) and dtype == 'f8':
+            raw = np.frombuffer(data, dtype=np.dtype(decoder.array_letter).newbyteorder(byteorder))
+            mask = raw == decoder.null_value
+            return raw / 10 ** decoder.scale, (mask if mask.any() else None)
+        if isinstance(decoder, pythonizebin.FloatDecoder):
+            raw = np.frombuffer(data, dtype=np.dtype(decoder.array_letter).newbyteorder(byteorder))
+            mask = np.isnan(raw)
+            return raw.astype(dtype, copy=False), (mask if mask.any() else None)
+        if isinstance(decoder, (pythonizebin.TimestampDecoder, pythonizebin.DateDecoder)):
+            return _datetime64_from_binary(decoder, dtype, byteorder, data)
+    return from_values(decoder.decode(server_endian, data), dtype)
+
+
+def _datetime64_from_binary(decoder: 'pythonizebin.TemporalDecoder', dtype: str, byteorder: str,
+                            data: memoryview) -> Column:
+    """Convert the records of a binary DATE or TIMESTAMP column to a
+    datetime64 array without creating Python objects"""
+    np = numpy()
+    date_fields = [('day', 'u1'), ('month', 'u1'), ('year', byteorder + 'i2')]
+    if isinstance(decoder, pythonizebin.DateDecoder):
+        records = np.frombuffer(data, dtype=np.dtype(date_fields))
+        mask = records['month'] > pythonizebin.NULL_MONTH
+    else:
+        time_fields = [('micros', byteorder + 'u4'), ('second', 'u1'), ('minute', 'u1'), ('hour', 'u1'), ('pad', 'u1')]
+        records = np.frombuffer(data, dtype=np.dtype(time_fields + date_fields))
+        mask = records['micros'] >= pythonizebin.NULL_MICROS
+    any_null = mask.any()
+
+    def field(name):
+        values = records[name].astype('i8')
+        if any_null:
+            values[mask] = 1
+        return values
+
+    days = _days_from_civil(field('year'), field('month'), field('day'))
+    if isinstance(decoder, pythonizebin.DateDecoder):
+        values = days.astype('datetime64[D]')
+    else:
+        seconds = days * 86400 + field('hour') * 3600 + field('minute') * 60 + field('second')
+        values = (seconds * 1_000_000 + field('micros')).astype('datetime64[us]')
+    values = values.astype(dtype, copy=False)
+    if any_null:
+        values[mask] = np.datetime64('NaT')
+    return values, (mask if any_null else None)
+
+
+def _days_from_civil(year, month, day):
+    """Count the days since 1970-01-01 of the given proleptic Gregorian
+    dates, for arrays of years, months and days"""
+    # This is Howard Hinnant's days_from_civil. Years start in March so
+    # the leap day comes last.
+    year = year - (month <= 2)
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * ((month + 9) % 12) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+
+def from_batch(batch: Sequence, colno: int, dtype: str, start: int, end: int) -> Column:
+    """Convert the values of column 'colno' in rows start:end of a batch to a
+    column. The batch is a list of tuples or a ColumnBatch."""
+    if not isinstance(batch, ColumnBatch):
+        return from_values([row[colno] for row in batch[start:end]], dtype)
+    if dtype == 'O' or batch.is_decoded(colno):
+        return from_values(batch.column(colno)[start:end], dtype)
+    values, mask = from_binary(batch.decoders[colno], dtype, batch.server_endian, batch.slices[colno])
+    if len(values) != len(batch):
+        raise InterfaceError(f"expected {len(batch)} values in column {colno}, found {len(values)}")
+    return values[start:end], (None if mask is None else mask[start:end])
+
+
+def concat(chunks: List[Column], dtype: str) -> Column:
+    """Concatenate the columns in 'chunks' into a single column"""
+    np = numpy()
+    if not chunks:
+        return np.empty(0, dtype=dtype), None
+    if len(chunks) == 1:
+        return chunks[0]
+    values = np.concatenate([v for v, _ in chunks])
+    if all(m is None for _, m in chunks):
+        return values, None
+    mask = np.concatenate([np.zeros(len(v), dtype=bool) if m is None else m for v, m in chunks])
+    return values, mask
+
+
+def to_values(column: Column, start: int = 0) -> List[Any]:
+    """Convert a column, from position 'start' on, back to a list of Python values"""
+    values, mask = column
+    result = values[start:].tolist()
+    if mask is not None:
+        for i in mask[start:].nonzero()[0].tolist():
+            result[i] = None
+    return result
+
+
+def masked(column: Column):
+    """Return the column as a plain array if it has no NULLs, otherwise as a masked array"""
+    values, mask = column
+    if mask is None:
+        return values
+    return numpy().ma.MaskedArray(values, mask=mask)
+
+
+STRING_TYPES = {types.CHAR, types.VARCHAR, types.CLOB, types.URL}
+
+
+def to_pandas(column: Column, type_code: str, categorical: bool = False):
+    """Convert a column to a pandas array of the appropriate dtype.
+
+    Integer and boolean columns with NULLs become nullable extension arrays,
+    DATE and TIMESTAMP columns become datetime64, and string columns become
+    categoricals if 'categorical' is set.
+    """
+    np = numpy()
+    pd = pandas()
+    values, mask = column
+    kind = values.dtype.kind
+    if kind in 'iu':
+        return values if mask is None else pd.arrays.IntegerArray(values, mask)
+    if kind == 'b':
+        return values if mask is None else pd.arrays.BooleanArray(values, mask)
+    if kind == 'f':
+        return values if mask is None else np.where(mask, np.nan, values)
+    if type_code == types.DATE:
+        return values.astype('datetime64[s]')
+    if type_code == types.TIMESTAMP:
+        return values.astype('datetime64[us]')
+    if type_code == types.TIMESTAMPTZ:
+        return pd.to_datetime(values, utc=True)
+    if categorical and type_code in STRING_TYPES:
+        return pd.Categorical(values)
+    return values
+
+
+def to_dataframe(columns: List[Column], description: List['Description'], categorical: bool = False):
+    """Build a pandas DataFrame from the columns of a result set"""
+    pd = pandas()
+    data = {
+        i: to_pandas(column, d.type_code, categorical)
+        for i, (column, d) in enumerate(zip(columns, description))
+    }
+    df = pd.DataFrame(data, copy=False)
+    df.columns = [d.name for d in description]
+    return df
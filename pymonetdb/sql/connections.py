@@ -4,12 +4,19 @@
 #
 # Copyright 1997 - July 2008 CWI, August 2008 - 2016 MonetDB B.V.
 
+from contextlib import contextmanager
 from datetime import datetime, timedelta, timezone
 import logging
-from typing import List
+import math
+import re
+import time
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from pymonetdb.exceptions import DatabaseError
 from pymonetdb.sql import cursors
+from pymonetdb.sql.pipeline import Pipeline
+from pymonetdb.sql.prepared import PreparedStatementCache
+from pymonetdb.sql.prefetch import ThreadPrefetch
 from pymonetdb.policy import BatchPolicy
 from pymonetdb import exceptions
 from pymonetdb import mapi
@@ -17,6 +24,10 @@ from pymonetdb.target import Target
 
 logger = logging.getLogger("pymonetdb")
 
+# How long to wait for the server to abort a query that exceeded the
+# statement timeout before giving up on the connection.
+STATEMENT_TIMEOUT_GRACE = 2.0
+
 
 class Connection:
     """A MonetDB SQL database connection, use pymonetdb.connect() to create one."""
@@ -42,6 +53,12 @@ class Connection:
 
         self.autocommit = target.autocommit
         self.sizeheader = True
+        self.statement_timeout: Optional[float] = None
+        self._deadline: Optional[float] = None
+        # batch being fetched in the background by one of the cursors
+        self._prefetch: Optional[ThreadPrefetch] = None
+        # server-side prepared statements, see set_prepared_cache_size()
+        self._prepared_cache: Optional[PreparedStatementCache] = None
         self._policy = policy
         self._current_replysize = 100     # server default, will be updated after handshake
         self._current_timezone_seconds_east = 0   # server default, will be updated
@@ -53,24 +70,16 @@ class Connection:
 
         def handshake_options_callback(server_binexport_level: int) -> List[mapi.HandshakeOption]:
             policy.server_binexport_level = server_binexport_level
-            return [
-                # Level numbers taken from mapi.h.
-                mapi.HandshakeOption(1, "auto_commit", self.set_autocommit, target.autocommit),
-                mapi.HandshakeOption(2, "reply_size", self._change_replysize, policy.handshake_reply_size()),
-                mapi.HandshakeOption(3, "size_header", self.set_sizeheader, True),
-                mapi.HandshakeOption(5, "time_zone", self.set_timezone, handshake_timezone_offset),
-            ]
+            return _handshake_options(self, target, policy, handshake_timezone_offset)
 
         self.mapi = mapi.Connection()
-        self.mapi.connect(target, handshake_options_callback=handshake_options_callback)
+        self.mapi.connect(target, handshake_options_callback=handshake_options_callback,
+                          setup_commands=_setup_commands(target))
 
         self._current_replysize = policy.handshake_reply_size()
         self._current_timezone_seconds_east = handshake_timezone_offset
-
-        if target.schema:
-            quoted = target.schema.replace('"', '""')
-            with self.cursor() as c:
-                c.execute("SET SCHEMA " + quoted)
+        # seconds spent in each phase of connecting, for diagnosing slow connects
+        self.connect_timings: Dict[str, float] = dict(self.mapi.connect_timings)
 
     def close(self):
         """ Close the connection.
@@ -83,7 +92,8 @@ class Connection:
         to be performed.
         """
         if self.mapi:
-            if not self.autocommit:
+            self._wait_prefetch()
+            if not self.autocommit and self.mapi.state == mapi.STATE_READY:
                 self.rollback()
             self.mapi.disconnect()
             self.mapi = None
@@ -111,6 +121,7 @@ class Connection:
         """
         self.command("Xauto_commit %s" % int(autocommit))
         self.autocommit = autocommit
+        self.mapi.in_transaction = not autocommit
 
     def set_sizeheader(self, sizeheader):
         """
@@ -121,14 +132,12 @@ class Connection:
         self.sizeheader = sizeheader
 
     def _change_replysize(self, replysize):
-        self.command("Xreply_size %s" % int(replysize))
+        # sent along with the next command, which is the one it matters to
+        self._command_nowait("Xreply_size %s" % int(replysize), defer=True)
         self._current_replysize = replysize
 
     def set_timezone(self, seconds_east_of_utc):
-        hours = int(seconds_east_of_utc / 3600)
-        remaining = seconds_east_of_utc - 3600 * hours
-        minutes = int(remaining / 60)
-        cmd = f"SET TIME ZONE INTERVAL '{hours:+03}:{abs(minutes):02}' HOUR TO MINUTE;"
+        cmd = _timezone_statement(seconds_east_of_utc)
         c = self.cursor()
         c.execute(cmd)
         c.close()
@@ -199,7 +208,10 @@ class Connection:
         rollback to be performed.
         """
         self.__mapi_check()
-        return self.cursor().execute('ROLLBACK')
+        result = self.cursor().execute('ROLLBACK')
+        if self._prepared_cache is not None:
+            self._prepared_cache.rolled_back()
+        return result
 
     def cursor(self):
         """
@@ -210,19 +222,174 @@ class Connection:
         """
         return cursors.Cursor(self)
 
+    def pipeline(self) -> Pipeline:
+        """
+        Return a :class:`~pymonetdb.sql.pipeline.Pipeline` which sends many
+        statements to the server before reading the responses.
+        """
+        self.__mapi_check()
+        return Pipeline(self)
+
+    def set_statement_timeout(self, seconds: Optional[float]):
+        """
+        Limit the time each statement or fetch may take. None or 0 means no limit.
+
+        The server is asked to abort queries that run longer than this,
+        rounded up to whole seconds, using sys.setquerytimeout. The query then
+        fails with an error and the connection remains usable. If the server
+        has not responded STATEMENT_TIMEOUT_GRACE seconds after that, the
+        connection is closed and OperationalError is raised.
+        """
+        server_seconds = math.ceil(seconds) if seconds else 0
+        self.execute("CALL sys.setquerytimeout(%d)" % server_seconds)
+        self.statement_timeout = seconds or None
+
+    def set_prepared_cache_size(self, size: int):
+        """
+        Let the cursors execute statements with parameters as server-side
+        prepared statements, and keep up to 'size' of them. 0 disables this.
+
+        The first time a SELECT, INSERT, UPDATE, DELETE, MERGE, WITH or CALL
+        statement with pyformat parameters is executed, it is prepared using
+        PREPARE. Later executions of the same statement, with any parameter
+        values, use EXEC so the server does not have to parse and optimize it
+        again. When the cache is full, the least recently used statement is
+        deallocated on the server.
+
+        Statements are only prepared when autocommit is on, because a failed
+        PREPARE would abort the transaction. With autocommit off, statements
+        that are already in the cache are still executed with EXEC and others
+        are executed normally. If the server cannot prepare a statement, for
+        example because the type of a parameter cannot be determined, it is
+        executed normally instead and not offered for preparing again.
+
+        MonetDB versions older than Dec2023 drop all prepared statements when
+        a transaction fails or is rolled back; the cache is emptied as well.
+        """
+        self.__mapi_check()
+        cache = self._prepared_cache
+        evicted: List[int] = []
+        if size > 0 and cache is None:
+            keep = self._server_version() >= (11, 49)   # Dec2023 or newer
+            self._prepared_cache = PreparedStatementCache(size, keep)
+        elif size > 0:
+            assert cache is not None
+            evicted = cache.resize(size)
+        elif cache is not None:
+            evicted = cache.clear()
+            self._prepared_cache = None
+        self._deallocate(evicted)
+
+    def _server_version(self) -> Tuple[int, ...]:
+        """Return the version of the server, for example (11, 49, 1)"""
+        c = self.cursor()
+        try:
+            c.execute("SELECT value FROM sys.environment WHERE name = 'monet_version'")
+            row = c.fetchone()
+        finally:
+            c.close()
+        if row is None:
+            return ()
+        return tuple(int(part) for part in re.findall(r'\d+', row[0]))
+
+    def _prepare(self, sql: str) -> Optional[int]:
+        """Prepare the statement, add it to the cache and return its id.
+        Returns None if the server cannot prepare it."""
+        cache = self._prepared_cache
+        assert cache is not None
+        c = self.cursor()
+        try:
+            c.execute("PREPARE " + sql)
+            stmt_id = c.lastrowid
+        except exceptions.DatabaseError:
+            cache.add(sql, None)
+            return None
+        finally:
+            c.close()
+        self._deallocate(cache.add(sql, stmt_id))
+        return stmt_id
+
+    def _deallocate(self, stmt_ids: List[int]):
+        for stmt_id in stmt_ids:
+            try:
+                self.execute("DEALLOCATE PREPARE %d" % stmt_id)
+            except exceptions.DatabaseError as e:
+                logger.warning("Could not deallocate prepared statement %d: %s", stmt_id, e)
+
+    @contextmanager
+    def deadline(self, seconds: float) -> Iterator['Connection']:
+        """
+        Context manager that limits the time all operations in the block may
+        take together, for example an execute() followed by fetchall().
+
+        When the time is up, the statement in progress is cancelled by closing
+        the connection, and OperationalError is raised.
+        """
+        self.__mapi_check()
+        saved = self._deadline
+        deadline = time.monotonic() + seconds
+        self._deadline = deadline if saved is None else min(saved, deadline)
+        try:
+            yield self
+        finally:
+            self._deadline = saved
+
+    def _command_deadline(self):
+        """Context manager applying the deadline for the next command, if any"""
+        deadline = self._deadline
+        if deadline is None and self.statement_timeout:
+            deadline = time.monotonic() + self.statement_timeout + STATEMENT_TIMEOUT_GRACE
+        return self.mapi.command_deadline(deadline)
+
     def execute(self, query):
         """ use this for executing SQL queries """
-        return self.command('s' + query + '\n;')
+        try:
+            return self.command('s' + query + '\n;')
+        except exceptions.DatabaseError as e:
+            self._statement_failed(query, e)
+            raise
+
+    def _statement_failed(self, query: str, error: Exception):
+        if self._prepared_cache is not None:
+            self._prepared_cache.statement_failed(query, error)
+
+    def _wait_prefetch(self):
+        """Wait until the background fetch of a cursor, if any, has received
+        its response so the connection can be used for something else"""
+        prefetch = self._prefetch
+        if prefetch is not None:
+            self._prefetch = None
+            prefetch.wait()
+
+    def command(self, command, check_errors: bool = True):
+        """ use this function to send low level mapi commands.
+        See :meth:`pymonetdb.mapi.Connection.cmd` for 'check_errors'."""
+        self.__mapi_check()
+        self._wait_prefetch()
+        with self._command_deadline():
+            return self.mapi.cmd(command, check_errors)
 
-    def command(self, command):
-        """ use this function to send low level mapi commands """
+    def _command_nowait(self, command, defer: bool = False):
+        """ send a low level mapi command without waiting for its response.
+        See :meth:`pymonetdb.mapi.Connection.cmd_nowait`."""
         self.__mapi_check()
-        return self.mapi.cmd(command)
+        self._wait_prefetch()
+        self.mapi.cmd_nowait(command, defer)
 
-    def binary_command(self, command):
-        """ use this function to send low level mapi commands that return raw bytes"""
+    def binary_command(self, command, buffer: Optional[bytearray] = None):
+        """ use this function to send low level mapi commands that return raw bytes.
+        See :meth:`pymonetdb.mapi.Connection.binary_cmd` for 'buffer'."""
         self.__mapi_check()
-        return self.mapi.binary_cmd(command)
+        self._wait_prefetch()
+        with self._command_deadline():
+            return self.mapi.binary_cmd(command, buffer)
+
+    def _new_binary_buffer(self) -> bytearray:
+        """Return a new buffer for binary_command(), see
+        :meth:`pymonetdb.mapi.Connection.new_binary_buffer`"""
+        self.__mapi_check()
+        self._wait_prefetch()
+        return self.mapi.new_binary_buffer()
 
     def __mapi_check(self):
         """ check if there is a connection with a server """
@@ -260,3 +427,35 @@ def _local_timezone_offset_seconds():
     # the time zones east of UTC do. This means the offset is
     # positive if we are east.
     return round(utc_now.timestamp() - our_now.timestamp())
+
+
+def _timezone_statement(seconds_east_of_utc) -> str:
+    hours = int(seconds_east_of_utc / 3600)
+    remaining = seconds_east_of_utc - 3600 * hours
+    minutes = int(remaining / 60)
+    return f"SET TIME ZONE INTERVAL '{hours:+03}:{abs(minutes):02}' HOUR TO MINUTE;"
+
+
+def _handshake_options(conn, target: Target, policy: BatchPolicy, timezone_offset: int) -> List[mapi.HandshakeOption]:
+    """The options to set during the handshake. If the server does not
+    support one of them, its command is sent right after login."""
+    return [
+        # Level numbers taken from mapi.h.
+        mapi.HandshakeOption(1, "auto_commit", conn.set_autocommit, target.autocommit,
+                             lambda v: "Xauto_commit %d" % int(v)),
+        mapi.HandshakeOption(2, "reply_size", conn._change_replysize, policy.handshake_reply_size(),
+                             lambda v: "Xreply_size %d" % int(v)),
+        mapi.HandshakeOption(3, "size_header", conn.set_sizeheader, True,
+                             lambda v: "Xsizeheader %d" % int(v)),
+        mapi.HandshakeOption(5, "time_zone", conn.set_timezone, timezone_offset,
+                             lambda v: 's' + _timezone_statement(v) + '\n;'),
+    ]
+
+
+def _setup_commands(target: Target) -> List[str]:
+    """The commands to send right after login"""
+    commands = []
+    if target.schema:
+        quoted = target.schema.replace('"', '""')
+        commands.append('sSET SCHEMA ' + quoted + '\n;')
+    return commands
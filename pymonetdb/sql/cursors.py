@@ -6,17 +6,31 @@
 
 import logging
 from collections import namedtuple
+import re
 import struct
-from typing import Any, List, Optional, Dict, Sequence, Tuple, Type, Union
+from typing import Any, Callable, Iterator, List, Optional, Dict, Sequence, Tuple, Type, Union
 from pymonetdb.policy import BatchPolicy
 import pymonetdb.sql.connections
 from pymonetdb.sql.debug import debug, export
-from pymonetdb.sql import monetize, pythonize, pythonizebin
+from pymonetdb.sql.prefetch import Prefetch, ThreadPrefetch
+from pymonetdb.sql import arrow, columnar, monetize, pythonize, pythonizebin
+from pymonetdb.sql.rows import ColumnBatch, compact_batch
 from pymonetdb.exceptions import Error, ProgrammingError, InterfaceError
 from pymonetdb import mapi
 
 logger = logging.getLogger("pymonetdb")
 
+# INSERT statements whose rows executemany() combines into multi-row INSERTs.
+# Group 1 is everything up to and including VALUES, group 2 the row.
+INSERT_VALUES_RE = re.compile(
+    r'\s*(INSERT\s+INTO\s+[^;()]+?(?:\([^;()]*\)\s*)?VALUES\s*)(\([^;]*\))\s*;?\s*', re.IGNORECASE)
+
+# executemany() sends multi-row INSERTs of at most about this many characters
+EXECUTEMANY_BATCH_SIZE = 1_000_000
+
+# SQLSTATEs of a failed COMMIT: concurrency conflict, other failure
+COMMIT_FAILURES = ('40001', '2D000')
+
 Description = namedtuple('Description', ('name', 'type_code', 'display_size', 'internal_size', 'precision', 'scale',
                                          'null_ok'))
 
@@ -42,14 +56,20 @@ class Cursor(object):
     rownumber: Optional[int]
     _executed: Optional[str]
     _offset: int
-    _rows: List[Tuple]
+    _rows: Union[List[Tuple], ColumnBatch]
+    lazy_rows: bool
+    compact_rows: bool
+    decimals: str
+    prefetch: bool
+    _prefetched: Optional[Prefetch]
     _resultsets_to_close: List[str]
+    _resultset_closed: bool
     _query_id: Optional[str]
     messages: List[Tuple[Type[Exception], str]]
     lastrowid: Optional[int]
     _unpack_int64: str
 
-    _next_result_sets: List[Tuple[str, int, List[Description], List[Tuple]]]
+    _next_result_sets: List[Tuple[Optional[str], int, Optional[List[Description]], List[Tuple], Optional[int]]]
 
     def __init__(self, connection: 'pymonetdb.sql.connections.Connection'):
         """This read-only attribute return a reference to the Connection
@@ -109,12 +129,38 @@ class Cursor(object):
         # the offset of the current resultset in the total resultset
         self._offset = 0
 
-        # the resultset
+        # the resultset. A list of tuples, or a ColumnBatch if the rows were
+        # received in binary
         self._rows = []
 
+        # Pymonetdb-specific. If True, rows received in binary are returned as
+        # Row objects that behave like tuples but only decode the columns
+        # that are actually accessed.
+        self.lazy_rows = False
+
+        # Pymonetdb-specific. If True, cached batches are stored column by
+        # column in arrays and bytes rather than as Python objects, and rows
+        # are only built when they are fetched.
+        self.compact_rows = False
+
+        # Pymonetdb-specific. How DECIMAL values are returned: 'decimal' for
+        # decimal.Decimal, 'float' for float, or 'scaled' for the integer
+        # value multiplied by 10 ** scale. Columns that do not fit in 64 bits
+        # remain Decimal with 'scaled'.
+        self.decimals = 'decimal'
+
+        # Pymonetdb-specific. If True, the next batch of the result set is
+        # requested in the background while the current one is processed.
+        self.prefetch = False
+        self._prefetched = None
+
         # ids of result sets that must eventually be closed on the server
         self._resultsets_to_close = []
 
+        # whether the current result set has been closed on the server
+        # because all of its rows have been fetched
+        self._resultset_closed = False
+
         # used to identify a query during server contact.
         # Only select queries have query ID
         self._query_id = None
@@ -159,18 +205,46 @@ class Cursor(object):
         if not self._executed:
             self._exception_handler(ProgrammingError, "do a execute() first")
 
+    def _check_resultset(self):
+        self._check_executed()
+        if self._query_id is None:
+            msg = "query didn't result in a resultset"
+            self._exception_handler(ProgrammingError, msg)
+
     def _close_earlier_resultsets(self):
+        # The responses are only read when the next command is executed
         for rs in self._resultsets_to_close:
             command = 'Xclose %s' % rs
-            self.connection.command(command)
+            self.connection._command_nowait(command)
         del self._resultsets_to_close[:]
 
+    def _finished_resultset(self) -> Optional[str]:
+        """If all rows of the current result set have been fetched and it
+        still has to be closed on the server, return its id. The cursor will
+        not fetch from it anymore."""
+        query_id = self._query_id
+        if query_id is None or self.rownumber is None or self.rownumber < self.rowcount:
+            return None
+        if query_id not in self._resultsets_to_close:
+            return None
+        self._resultsets_to_close.remove(query_id)
+        self._resultset_closed = True
+        return query_id
+
+    def _close_finished_resultset(self):
+        """Close the current result set on the server if all rows have been
+        fetched, without waiting for the response"""
+        finished = self._finished_resultset()
+        if finished:
+            self.connection._command_nowait('Xclose %s' % finished)
+
     def close(self):
         """ Close the cursor now (rather than whenever __del__ is
         called).  The cursor will be unusable from this point
         forward; an Error (or subclass) exception will be raised
         if any operation is attempted with the cursor."""
 
+        self._discard_prefetch()
         try:
             self._close_earlier_resultsets()
         except Error:
@@ -204,6 +278,7 @@ class Cursor(object):
         # clear message history
         self.messages = []
 
+        self._discard_prefetch()
         self._close_earlier_resultsets()
 
         # set the number of rows to fetch
@@ -218,6 +293,128 @@ class Cursor(object):
         else:
             self.operation = operation
 
+        query = self._prepared_query(operation, parameters)
+        if query is None:
+            query = self._format_query(operation, parameters)
+
+        block = self.connection.execute(query)
+        self._store_result(block, update_existing=False)
+        self.nextset()
+        self._executed = operation
+        return self.rowcount if self.rowcount >= 0 else None
+
+    def execute_batch(self, statements: Sequence[str],
+                      parameters: Optional[Sequence[Optional[Union[Dict, Sequence[Any]]]]] = None) -> List[int]:
+        """Pymonetdb-specific. Execute several statements in a single round
+        trip.
+
+        The statements are combined into one block and sent to the server at
+        once. If 'parameters' is given, it holds the parameters of each
+        statement, or None for a statement without parameters.
+
+        Every statement gets its own result, including statements that do not
+        return rows. Afterwards the cursor holds the result of the first
+        statement and :meth:`nextset` moves on to the next, updating rowcount,
+        lastrowid and description. Returns the rowcount of each statement.
+
+        If a statement fails, the server skips the statements after it. The
+        message of the exception starts with the number of the failed
+        statement, counting from 1, and the results of the statements before
+        it are available as described above.
+
+        Statements must not contain -- comments, because a comment would
+        swallow the separator between them. Use execute() for those.
+        """
+
+        if not self.connection:
+            self._exception_handler(ProgrammingError, "cursor is closed")
+
+        self.messages = []
+
+        self._discard_prefetch()
+        self._close_earlier_resultsets()
+
+        desired_replysize = self._policy.new_query()
+        if self.connection._current_replysize != desired_replysize:
+            self.connection._change_replysize(desired_replysize)
+
+        query = self._batch_query(statements, parameters)
+        self.operation = query
+        block = self.connection.command('s' + query + '\n;', check_errors=False)
+        try:
+            rowcounts = self._store_batch_result(block, len(statements))
+        except Error as e:
+            self.connection._statement_failed(query, e)
+            raise
+        finally:
+            self._executed = query
+        return rowcounts
+
+    def _batch_query(self, statements: Sequence[str],
+                     parameters: Optional[Sequence[Optional[Union[Dict, Sequence[Any]]]]]) -> str:
+        """Combine the statements of execute_batch() into one block"""
+        if parameters is not None and len(parameters) != len(statements):
+            self._exception_handler(ProgrammingError, "expected parameters for each of the statements")
+        if not statements:
+            self._exception_handler(ProgrammingError, "no statements to execute")
+        queries = []
+        for i, operation in enumerate(statements):
+            if '--' in operation:
+                self._exception_handler(ProgrammingError, "statement %d: comments are not supported" % (i + 1))
+            query = self._format_query(operation, parameters[i] if parameters else None)
+            queries.append(query.strip().rstrip(';'))
+        return ";\n".join(queries)
+
+    def _store_batch_result(self, block: str, count: int) -> List[int]:
+        """Store the results of the statements sent by execute_batch() and
+        raise an exception if one of them failed"""
+        lines = block.split("\n")
+        error_line = next((i for i, line in enumerate(lines) if line.startswith(mapi.MSG_ERROR)), None)
+        last_reply = None
+        if error_line is not None:
+            block = "\n".join(lines[:error_line]) + "\n"
+            last_reply = next((line[:2] for line in reversed(lines[:error_line])
+                               if line.startswith(mapi.MSG_Q) and not line.startswith(mapi.MSG_QBLOCK)), None)
+        self._store_result(block, update_existing=False, all_results=True)
+        rowcounts = [result[1] for result in self._next_result_sets]
+        self.nextset()
+        if error_line is not None:
+            exception, msg = mapi.handle_error(lines[error_line][1:])
+            failed = len(rowcounts) + 1
+            if (self.connection.autocommit and last_reply in (mapi.MSG_QUPDATE, mapi.MSG_QSCHEMA)
+                    and msg[:5] in COMMIT_FAILURES):
+                # the implicit commit after the previous statement, which
+                # changed the database, failed
+                failed -= 1
+            self._exception_handler(exception, "statement %d: %s" % (failed, msg))
+        if len(rowcounts) != count:
+            msg = "expected %d results, got %d" % (count, len(rowcounts))
+            logger.warning(msg)
+            self.messages.append((Warning, msg))
+        return rowcounts
+
+    def _prepared_query(self, operation: str, parameters: Optional[Union[Dict, Sequence[Any]]]) -> Optional[str]:
+        """If the connection caches prepared statements and the operation can
+        be prepared, return the EXEC statement that executes it with the
+        parameters. Otherwise, return None."""
+        cache = self.connection._prepared_cache
+        if cache is None or not parameters or pymonetdb.paramstyle != 'pyformat':
+            return None
+        found = cache.lookup(operation, parameters)
+        if found is None:
+            return None
+        sql, args, stmt_id = found
+        if stmt_id is None:
+            if not self.connection.autocommit:
+                # a failed PREPARE would abort the transaction
+                return None
+            stmt_id = self.connection._prepare(sql)
+            if stmt_id is None:
+                return None
+        return 'EXEC %d(%s)' % (stmt_id, ', '.join(monetize.convert(arg) for arg in args))
+
+    def _format_query(self, operation: str, parameters: Optional[Union[Dict, Sequence[Any]]]) -> str:
+        """Substitute the parameters into the operation"""
         query = ""
         if parameters:
             if isinstance(parameters, dict):
@@ -241,27 +438,58 @@ class Cursor(object):
                 self._exception_handler(ValueError, msg % type(parameters))
         else:
             query = operation
-
-        block = self.connection.execute(query)
-        self._store_result(block, update_existing=False)
-        self.nextset()
-        self._executed = operation
-        return self.rowcount if self.rowcount >= 0 else None
+        return query
 
     def executemany(self, operation, seq_of_parameters):
         """Prepare a database operation (query or command) and then
         execute it against all parameter sequences or mappings
         found in the sequence seq_of_parameters.
 
+        If the operation is a plain INSERT INTO ... VALUES (...) statement,
+        the rows are combined into multi-row INSERT statements so only a
+        few statements are sent to the server. A failing row then prevents
+        all rows in the same statement from being inserted.
+
         It will return the number or rows affected
         """
 
         count = 0
-        for parameters in seq_of_parameters:
-            count += self.execute(operation, parameters)
+        inserts = self._multirow_inserts(operation, seq_of_parameters)
+        if inserts is not None:
+            for query in inserts:
+                count += self.execute(query)
+            self.operation = operation
+        else:
+            for parameters in seq_of_parameters:
+                count += self.execute(operation, parameters)
         self.rowcount = count
         return count
 
+    def _multirow_inserts(self, operation: str, seq_of_parameters) -> Optional[Iterator[str]]:
+        """If the operation is an INSERT that executemany() can combine, return
+        an iterator over multi-row INSERT statements holding the rows for all
+        parameters. Otherwise, return None."""
+        if pymonetdb.paramstyle != 'pyformat':
+            return None
+        m = INSERT_VALUES_RE.fullmatch(operation)
+        if not m or '%' in m.group(1) or '--' in operation:
+            return None
+        return self._generate_inserts(m.group(1), m.group(2), seq_of_parameters)
+
+    def _generate_inserts(self, prefix: str, row: str, seq_of_parameters) -> Iterator[str]:
+        rows: List[str] = []
+        size = 0
+        for parameters in seq_of_parameters:
+            values = self._format_query(row, parameters)
+            if rows and size + len(values) > EXECUTEMANY_BATCH_SIZE:
+                yield prefix + ",\n".join(rows)
+                rows = []
+                size = 0
+            rows.append(values)
+            size += len(values) + 2
+        if rows:
+            yield prefix + ",\n".join(rows)
+
     def debug(self, query, fname, sample=-1):
         """ Locally debug a given Python UDF function in a SQL query
             using the PDB debugger. Optionally can run on only a
@@ -284,6 +512,7 @@ class Cursor(object):
         cache_end = self._offset + len(self._rows)
         if self.rownumber >= cache_end:
             if self.rownumber >= self.rowcount:
+                self._close_finished_resultset()
                 return None
             self._populate_cache(0, self.rownumber + 1)
 
@@ -325,6 +554,8 @@ class Cursor(object):
             result += self._rows[self.rownumber - self._offset:requested_end - self._offset]
             self.rownumber = requested_end
 
+        if self.rownumber >= self.rowcount:
+            self._close_finished_resultset()
         return result
 
     def fetchall(self):
@@ -337,26 +568,312 @@ class Cursor(object):
 
         return self.fetchmany(self.rowcount)
 
+    def fetch_batches(self, size: Optional[int] = None) -> Iterator[List[Tuple]]:
+        """Pymonetdb-specific. Iterate over the remaining rows of the result
+        set, one batch at a time.
+
+        Each batch is a list of row tuples, exactly as they were received
+        from the server. If 'size' is given, each request to the server asks
+        for at least that many rows, otherwise the batch size is determined by
+        the replysize and maxprefetch settings. The cursor does not keep a
+        reference to the batches it has yielded.
+        """
+
+        self._check_resultset()
+
+        while True:
+            batch = self._take_cached_rows()
+            if batch:
+                yield batch
+            assert self.rownumber is not None
+            if self.rownumber >= self.rowcount:
+                self._close_finished_resultset()
+                return
+            requested_end = min(self.rownumber + (size or 1), self.rowcount)
+            self._populate_cache(0, requested_end)
+
+    def _take_cached_rows(self) -> List:
+        """Remove the unread rows from the cache and return them"""
+        assert self.rownumber is not None
+        start = self.rownumber - self._offset
+        if start == 0 and isinstance(self._rows, list):
+            rows = self._rows
+        else:
+            rows = self._rows[start:]
+        self.rownumber = self._offset + len(self._rows)
+        self._offset = self.rownumber
+        self._rows = []
+        return rows
+
+    def fetch_columns(self, size: Optional[int] = None, datetime64: bool = False) -> List[Tuple[Any, Optional[Any]]]:
+        """Pymonetdb-specific. Fetch the next 'size' rows of the result set,
+        default all remaining rows, as one NumPy array per column.
+
+        Each column is returned as a pair (values, mask), where 'mask' is None
+        if the column contains no NULLs and otherwise a boolean array that is
+        True at the NULL positions. Integer, floating point and boolean columns
+        get the corresponding NumPy dtype, other columns become arrays of the
+        same Python objects :meth:`fetchall` would return. If 'datetime64' is
+        set, DATE columns get dtype datetime64[D] and TIMESTAMP columns
+        datetime64[us], with TIMESTAMPTZ values in UTC.
+
+        When the binary result set protocol is used, numeric columns, and
+        temporal columns if 'datetime64' is set, are converted directly from
+        the network buffers without creating a Python object for every value.
+
+        Requires NumPy.
+        """
+
+        self._check_resultset()
+        assert self.description is not None and self.rownumber is not None
+
+        if size is None:
+            size = self.rowcount
+        requested_end = min(self.rownumber + size, self.rowcount)
+
+        dtypes = self._column_dtypes(datetime64)
+        chunks: List[List[columnar.Column]] = [[] for _ in dtypes]
+        already_used = 0
+        while self.rownumber < requested_end:
+            if self.rownumber >= self._offset + len(self._rows):
+                self._populate_cache(already_used, requested_end)
+                continue
+            already_used += self._take_column_chunks(dtypes, chunks, requested_end)
+
+        if self.rownumber >= self.rowcount:
+            self._close_finished_resultset()
+        return [columnar.concat(chunk, dtype) for chunk, dtype in zip(chunks, dtypes)]
+
+    def _take_column_chunks(self, dtypes: List[str], chunks: List[List['columnar.Column']], requested_end: int) -> int:
+        """Append the cached rows up to 'requested_end' to the chunks of each
+        column and return how many rows were taken"""
+        assert self.rownumber is not None
+        end = min(self._offset + len(self._rows), requested_end)
+        start = self.rownumber - self._offset
+        for i, dtype in enumerate(dtypes):
+            chunks[i].append(columnar.from_batch(self._rows, i, dtype, start, end - self._offset))
+        taken = end - self.rownumber
+        self.rownumber = end
+        return taken
+
+    def _cached_batches(self, size: Optional[int]) -> Iterator[Tuple[Sequence, int, int]]:
+        """Yield the remaining rows one batch at a time, as triples
+        (batch, start, end) where batch[start:end] are the rows. The batch is
+        either a list of tuples or a ColumnBatch. The first batch holds the
+        cached rows, every next batch holds one response from the server.
+        If 'size' is given, each request to the server asks for at least that
+        many rows."""
+
+        self._check_resultset()
+        assert self.rownumber is not None
+
+        while True:
+            cache_end = self._offset + len(self._rows)
+            if self.rownumber < cache_end:
+                start = self.rownumber - self._offset
+                self.rownumber = cache_end
+                yield self._rows, start, len(self._rows)
+            if self.rownumber >= self.rowcount:
+                self._close_finished_resultset()
+                return
+            requested_end = min(self.rownumber + (size or 1), self.rowcount)
+            self._populate_cache(0, requested_end)
+
+    def _column_batches(self, size: Optional[int], datetime64: bool = False) -> Iterator[List['columnar.Column']]:
+        """Yield the remaining rows as NumPy columns, one batch at a time.
+        See :meth:`_cached_batches`."""
+        dtypes = self._column_dtypes(datetime64)
+        for batch, start, end in self._cached_batches(size):
+            yield [columnar.from_batch(batch, i, dtype, start, end) for i, dtype in enumerate(dtypes)]
+
+    def _column_dtypes(self, datetime64: bool) -> List[str]:
+        """The NumPy dtypes of the columns of the result set"""
+        assert self.description is not None
+        return [
+            columnar.column_dtype(d.type_code, datetime64, pythonize.decimal_representation(self.decimals, d.precision))
+            for d in self.description
+        ]
+
+    def fetch_df(self, categorical: bool = False):
+        """Pymonetdb-specific. Fetch all remaining rows of the result set as
+        a pandas DataFrame.
+
+        The columns are built directly from the fetched data, without creating
+        row tuples first. Integer and boolean columns that contain NULLs get
+        pandas' nullable dtypes such as Int32, DATE and TIMESTAMP columns
+        become datetime64 and string columns become categoricals if
+        'categorical' is set. Other columns hold the same Python objects
+        :meth:`fetchall` would return.
+
+        Requires pandas.
+        """
+        columns = self.fetch_columns(datetime64=True)
+        assert self.description is not None
+        return columnar.to_dataframe(columns, self.description, categorical)
+
+    def fetch_df_batches(self, size: Optional[int] = None, categorical: bool = False) -> Iterator[Any]:
+        """Pymonetdb-specific. Iterate over the remaining rows of the result
+        set as a sequence of pandas DataFrames, one per batch received from
+        the server.
+
+        If 'size' is given, each request to the server asks for at least that
+        many rows, otherwise the batch size is determined by the replysize and
+        maxprefetch settings. See :meth:`fetch_df` for the data types.
+
+        Requires pandas.
+        """
+        for columns in self._column_batches(size, datetime64=True):
+            assert self.description is not None
+            yield columnar.to_dataframe(columns, self.description, categorical)
+
+    def fetch_record_batches(self, batch_rows: Optional[int] = None) -> Iterator[Any]:
+        """Pymonetdb-specific. Iterate over the remaining rows of the result
+        set as a sequence of pyarrow.RecordBatch objects, one per batch
+        received from the server.
+
+        If 'batch_rows' is given, each request to the server asks for at least
+        that many rows, otherwise the batch size is determined by the
+        replysize and maxprefetch settings.
+
+        Numeric columns from the binary result set protocol are wrapped
+        without copying them if the byte order allows, and string columns are
+        converted to Arrow's layout in bulk. Types Arrow does not know, such
+        as UUID, INET and JSON, are returned as strings.
+
+        Requires PyArrow.
+        """
+        self._check_resultset()
+        assert self.description is not None
+        arrow_schema = arrow.schema(self.description, self.decimals)
+        for batch, start, end in self._cached_batches(batch_rows):
+            yield self._record_batch(arrow_schema, batch, start, end)
+
+    def _record_batch(self, arrow_schema, batch: Sequence, start: int, end: int) -> Any:
+        """Convert rows start:end of a cached batch to a pyarrow.RecordBatch"""
+        assert self.description is not None
+        arrays = [
+            arrow.from_batch(batch, i, d.type_code, field.type, start, end)
+            for i, (d, field) in enumerate(zip(self.description, arrow_schema))
+        ]
+        return arrow.record_batch(arrays, arrow_schema)
+
+    def fetch_arrow(self) -> Any:
+        """Pymonetdb-specific. Fetch all remaining rows of the result set as
+        a pyarrow.Table. See :meth:`fetch_record_batches`.
+
+        Requires PyArrow.
+        """
+        self._check_resultset()
+        assert self.description is not None
+        arrow_schema = arrow.schema(self.description, self.decimals)
+        batches = list(self.fetch_record_batches())
+        return arrow.pyarrow().Table.from_batches(batches, schema=arrow_schema)
+
+    def fetchnumpy(self, datetime64: bool = False) -> Dict[str, Any]:
+        """Pymonetdb-specific. Fetch all remaining rows of the result set as a
+        dict that maps each column name to a NumPy array.
+
+        Columns that contain NULLs are returned as numpy.ma.MaskedArray.
+        See :meth:`fetch_columns` for the data types and 'datetime64'.
+
+        Requires NumPy.
+        """
+        columns = self.fetch_columns(datetime64=datetime64)
+        assert self.description is not None
+        return {d.name: columnar.masked(col) for d, col in zip(self.description, columns)}
+
     def nextset(self) -> Optional[bool]:
+        self._discard_prefetch()
         if not self._next_result_sets:
             self._query_id = None
             self.description = None
             self.rownumber = None
             return None
 
-        (self._query_id, self.rowcount, self.description, self._rows) = self._next_result_sets[0]
+        (self._query_id, self.rowcount, self.description, self._rows, self.lastrowid) = self._next_result_sets[0]
         del self._next_result_sets[0]
 
         self._policy.new_query()
         self._offset = 0
         self.rownumber = 0
+        self._resultset_closed = False
         self._can_bindecode = None
         self._bindecoders = None
+        self._compact_cache()
 
         return True
 
     def _populate_cache(self, already_used, requested_end):
-        del self._rows[:]
+        stride = requested_end - (self.rownumber - already_used)
+        prefetched = self._take_prefetched(requested_end)
+        if prefetched:
+            assert isinstance(prefetched, ThreadPrefetch)
+            binary, count = prefetched.binary, prefetched.count
+            self._rows = []
+            self._offset = self.rownumber
+            response = prefetched.result()
+        else:
+            command, binary, count = self._prepare_populate(already_used, requested_end)
+            if binary:
+                # the batch keeps referring to the buffer so it must not be reused
+                response = self.connection.binary_command(command, self.connection._new_binary_buffer())
+            else:
+                response = self.connection.command(command)
+        self._store_batch(response, binary, count)
+        next_batch = self._plan_prefetch(stride)
+        if next_batch:
+            self._prefetched = ThreadPrefetch(self.connection, *next_batch)
+
+    def _store_batch(self, response, binary: bool, count: int):
+        """Store the response to an Xexport or Xexportbin command in the cache"""
+        if binary:
+            self._store_binary_result(response, count)
+        else:
+            self._store_result(response, update_existing=True)
+            self._compact_cache()
+
+    def _take_prefetched(self, requested_end: int) -> Optional[Prefetch]:
+        """Return the batch being prefetched if it starts at the current row
+        and holds the rows up to 'requested_end', otherwise discard it"""
+        prefetched = self._prefetched
+        if prefetched and prefetched.start == self.rownumber and prefetched.end >= requested_end:
+            self._prefetched = None
+            return prefetched
+        self._discard_prefetch()
+        return None
+
+    def _plan_prefetch(self, stride: int) -> Optional[Tuple[str, bool, int, int]]:
+        """If 'prefetch' is set, decide on the next batch to fetch in the
+        background, assuming the application keeps fetching 'stride' rows at
+        a time. Returns the command, whether it is binary, and the first row
+        and number of rows of the batch."""
+        start = self._offset + len(self._rows)
+        if not self.prefetch or not self.connection or start >= self.rowcount:
+            return None
+        request_end = min(start + stride, self.rowcount)
+        rows_to_fetch = self._policy.batch_size(0, start, request_end, self.rowcount)
+        command, binary = self._export_command(start, rows_to_fetch)
+        return command, binary, start, min(rows_to_fetch, self.rowcount - start)
+
+    def _discard_prefetch(self):
+        """Stop prefetching. This waits for the batch in flight, if any"""
+        prefetched = self._prefetched
+        if prefetched is not None:
+            self._prefetched = None
+            prefetched.discard()
+
+    def _compact_cache(self):
+        """Convert the rows in the cache to a compact ColumnBatch if
+        'compact_rows' is set"""
+        if self.compact_rows and self._rows and isinstance(self._rows, list) and self.description:
+            type_codes = [d.type_code for d in self.description]
+            self._rows = compact_batch(self._rows, type_codes, self.lazy_rows)
+
+    def _prepare_populate(self, already_used, requested_end) -> Tuple[str, bool, int]:
+        """Clear the cache and return the command that refills it, whether
+        that command returns a binary response and how many rows it returns."""
+        assert self.rownumber is not None
+        self._rows = []
         self._offset = self.rownumber
 
         rows_to_fetch = self._policy.batch_size(
@@ -364,16 +881,19 @@ class Cursor(object):
             self.rownumber, requested_end,
             self.rowcount)
 
+        command, binary = self._export_command(self.rownumber, rows_to_fetch)
+        count = min(rows_to_fetch, self.rowcount - self.rownumber)
+        return command, binary, count
+
+    def _export_command(self, start: int, rows_to_fetch: int) -> Tuple[str, bool]:
+        """The command that fetches the given rows, and whether it returns a
+        binary response"""
         if self._can_bindecode is None:
             self._check_bindecode_possible()
         if self._can_bindecode:
-            command = 'Xexportbin %s %s %s' % (self._query_id, self.rownumber, rows_to_fetch)
-            binary_block = self.connection.binary_command(command)
-            self._store_binary_result(binary_block)
+            return 'Xexportbin %s %s %s' % (self._query_id, start, rows_to_fetch), True
         else:
-            command = 'Xexport %s %s %s' % (self._query_id, self.rownumber, rows_to_fetch)
-            block = self.connection.command(command)
-            self._store_result(block, update_existing=True)
+            return 'Xexport %s %s %s' % (self._query_id, start, rows_to_fetch), False
 
     def _check_bindecode_possible(self):
         self._can_bindecode = False
@@ -416,8 +936,11 @@ class Cursor(object):
     def __next__(self):
         return self.next()
 
-    def _store_result(self, block, *, update_existing: bool):  # noqa: C901
-        """ parses the mapi result into a resultset"""
+    def _store_result(self, block, *, update_existing: bool, all_results: bool = False):  # noqa: C901
+        """ parses the mapi result into a resultset.
+
+        Normally only the results that have a result set are queued for
+        nextset(). If 'all_results' is set, every statement's result is."""
 
         if not update_existing:
             self._next_result_sets = []
@@ -439,11 +962,14 @@ class Cursor(object):
         msg_header = mapi.MSG_HEADER
         assert len(msg_header) == 1
 
+        converters = None
         for line in block.split("\n"):
             first = line[:1]
 
             if first == msg_tuple:
-                self._rows.append(self._parse_tuple(line))
+                if converters is None:
+                    converters = self._text_converters()
+                self._rows.append(self._parse_tuple(line, converters))  # type: ignore[union-attr]
 
             elif first == msg_header:
                 (data, identity) = line[1:].split("#")
@@ -496,8 +1022,14 @@ class Cursor(object):
                 if tuples < self.rowcount:
                     self._resultsets_to_close.append(query_id)
 
+                if line.startswith(mapi.MSG_QPREPARE):
+                    self.lastrowid = int(query_id)
+                else:
+                    self.lastrowid = None
+
                 if not update_existing:
-                    self._next_result_sets.append((query_id, self.rowcount, self.description, self._rows))
+                    self._next_result_sets.append(
+                        (query_id, self.rowcount, self.description, self._rows, self.lastrowid))
 
                 # set up fields for description
                 # table_name = [None] * columns
@@ -511,13 +1043,9 @@ class Cursor(object):
                 # typesizes = [(0, 0)] * columns
 
                 self._offset = 0
-                if line.startswith(mapi.MSG_QPREPARE):
-                    self.lastrowid = int(query_id)
-                else:
-                    self.lastrowid = None
 
             elif line.startswith(mapi.MSG_TUPLE_NOSLICE):
-                self._rows.append((line[1:],))
+                self._rows.append((line[1:],))  # type: ignore[union-attr]
 
             elif line.startswith(mapi.MSG_QBLOCK):
                 self._rows = []
@@ -528,6 +1056,8 @@ class Cursor(object):
                 self._rows = []
                 self.description = None
                 self.rowcount = -1
+                if all_results:
+                    self._next_result_sets.append((None, -1, None, [], None))
 
             elif line.startswith(mapi.MSG_QUPDATE):
                 (affected, identity) = line[2:].split()[:2]
@@ -537,6 +1067,8 @@ class Cursor(object):
                 self.rowcount = int(affected)
                 self.lastrowid = int(identity)
                 self._query_id = None
+                if all_results:
+                    self._next_result_sets.append((None, self.rowcount, None, [], self.lastrowid))
 
             elif line.startswith(mapi.MSG_QTRANS):
                 self._offset = 0
@@ -544,6 +1076,8 @@ class Cursor(object):
                 self._rows = []
                 self.description = None
                 self.rowcount = -1
+                if all_results:
+                    self._next_result_sets.append((None, -1, None, [], None))
 
             elif line == mapi.MSG_PROMPT:
                 return
@@ -553,7 +1087,18 @@ class Cursor(object):
 
         self._exception_handler(InterfaceError, "Unknown state, %s" % block)
 
-    def _store_binary_result(self, block: memoryview):
+    def _store_binary_result(self, block: memoryview, count: int):
+        """Store the 'count' rows in the binary response in the cache. The
+        columns are only decoded when they are accessed, so 'block' must not
+        be overwritten afterwards."""
+        assert self._bindecoders is not None
+        slices = self._binary_column_slices(block)
+        server_endian = self.connection.mapi.server_endian
+        self._rows = ColumnBatch(self._bindecoders, server_endian, slices, count, self.lazy_rows,
+                                 self.compact_rows)
+
+    def _binary_column_slices(self, block: memoryview) -> List[memoryview]:
+        """Check the binary response for errors and return the data of each column"""
         assert self._bindecoders is not None
         if len(block) < 8:
             self._exception_handler(InterfaceError, "binary response too short")
@@ -572,29 +1117,31 @@ class Cursor(object):
 
         # if we get here toc_pos actually points to the toc.
         ncols = len(self._bindecoders)
-        cols = []
+        slices = []
         for i in range(ncols):
-            # TODO fix endianness
             start_pos = toc_pos + 16 * i
             length_pos = start_pos + 8
             start = struct.unpack_from(self._unpack_int64, block, start_pos)[0]
             length = struct.unpack_from(self._unpack_int64, block, length_pos)[0]
-            slice = block[start:start + length]
-            decoder = self._bindecoders[i]
-            col = decoder.decode(self.connection.mapi.server_endian, slice)
-            cols.append(col)
-        rows = list(zip(*cols))
-        self._rows = rows
-
-    def _parse_tuple(self, line):
+            slices.append(block[start:start + length])
+        return slices
+
+    def _text_converters(self) -> List[Callable[[str], Any]]:
+        """The functions that convert the values of each column of a text result set"""
+        assert self.description is not None
+        return [pythonize.converter(d.type_code, d.precision, d.scale, self.decimals) for d in self.description]
+
+    def _parse_tuple(self, line, converters: Optional[List[Callable[[str], Any]]] = None):
         """
         parses a mapi data tuple, and returns a list of python types
         """
+        assert self.description is not None
         elements = line[1:-1].split(',\t')
         if len(elements) == len(self.description):
-            return tuple([pythonize.convert(element.strip(), description[1])
-                          for (element, description) in zip(elements,
-                                                            self.description)])
+            if converters is None:
+                converters = self._text_converters()
+            return tuple([None if element == "NULL" else convert(element)
+                          for (element, convert) in zip(map(str.strip, elements), converters)])
         else:
             self._exception_handler(InterfaceError, "length of row doesn't match header")
 
@@ -623,8 +1170,13 @@ class Cursor(object):
             self.rownumber = value
             return
 
+        self._discard_prefetch()
+
         if value > self.rowcount:
             self._exception_handler(IndexError, "value beyond length of resultset")
+        if self._resultset_closed and value < self.rowcount:
+            msg = "cannot scroll back, all rows have been fetched and the result set has been closed"
+            self._exception_handler(ProgrammingError, msg)
 
         self.rownumber = value
         self._offset = value
@@ -0,0 +1,109 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0.  If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright 1997 - July 2008 CWI, August 2008 - 2016 MonetDB B.V.
+
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+import pymonetdb.sql.connections
+from pymonetdb.exceptions import Error, ProgrammingError
+from pymonetdb.sql.cursors import Cursor
+
+
+class Pipeline:
+    """Executes many statements on one connection without waiting for each
+    response. Use :meth:`pymonetdb.sql.connections.Connection.pipeline` to
+    create one::
+
+        with conn.pipeline() as p:
+            for i in range(1000):
+                p.execute("INSERT INTO foo VALUES (%s)", [i])
+            c = p.execute("SELECT COUNT(*) FROM foo")
+        print(c.fetchone())
+
+    Statements are queued by :meth:`execute` and sent when :meth:`sync` is
+    called or the with-block ends. All statements are written to the server
+    before any of the responses are read, so a batch of small statements
+    costs a few network round trips rather than one per statement.
+
+    Each statement gets its own cursor, which holds the results of that
+    statement once the pipeline has been synced. If statements fail,
+    :meth:`sync` raises the first error after all responses have been read,
+    and :attr:`errors` pairs each failed cursor with its error. Note that
+    when autocommit is off, a failing statement aborts the transaction, so
+    the statements after it fail as well.
+
+    COPY INTO ... ON CLIENT cannot be pipelined.
+    """
+
+    errors: List[Tuple[Cursor, Error]]
+    """The cursors whose statement failed during the last sync, with the error"""
+
+    def __init__(self, connection: 'pymonetdb.sql.connections.Connection'):
+        self.connection = connection
+        self.errors = []
+        self._queue: List[Tuple[Cursor, str, str]] = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if exc_type is None:
+            self.sync()
+        else:
+            # Nothing has been sent yet
+            del self._queue[:]
+        # Propagate any errors
+        return False
+
+    def execute(self, operation: str, parameters: Optional[Union[Dict, Sequence[Any]]] = None) -> Cursor:
+        """Queue a statement. Returns the cursor that will hold its result."""
+        cursor = self.connection.cursor()
+        query = cursor._format_query(operation, parameters)
+        self._queue.append((cursor, operation, query))
+        return cursor
+
+    def sync(self) -> List[Cursor]:
+        """Send the queued statements and process the responses.
+
+        Returns the cursors of the statements in the order they were queued.
+        """
+        queue = self._queue
+        self._queue = []
+        self.errors = []
+        if not queue:
+            return []
+        if not self.connection.mapi:
+            raise ProgrammingError("connection closed")
+
+        commands = []
+        desired_replysize = queue[0][0]._policy.new_query()
+        change_replysize = self.connection._current_replysize != desired_replysize
+        if change_replysize:
+            commands.append("Xreply_size %d" % desired_replysize)
+        commands += ['s' + query + '\n;' for _, _, query in queue]
+
+        self.connection._wait_prefetch()
+        with self.connection._command_deadline():
+            responses = self.connection.mapi.cmd_pipelined(commands)
+
+        if change_replysize:
+            response = responses.pop(0)
+            if isinstance(response, Error):
+                raise response
+            self.connection._current_replysize = desired_replysize
+
+        for (cursor, operation, query), response in zip(queue, responses):
+            if isinstance(response, Error):
+                self.connection._statement_failed(query, response)
+                self.errors.append((cursor, response))
+                continue
+            cursor.operation = operation
+            cursor._store_result(response, update_existing=False)
+            cursor.nextset()
+            cursor._executed = operation
+
+        if self.errors:
+            raise self.errors[0][1]
+        return [cursor for cursor, _, _ in queue]
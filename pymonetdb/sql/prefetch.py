@@ -0,0 +1,82 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0.  If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright 1997 - July 2008 CWI, August 2008 - 2016 MonetDB B.V.
+
+"""
+fetching the next result set batch in a background thread
+"""
+
+import threading
+from typing import TYPE_CHECKING, Any, Optional
+
+if TYPE_CHECKING:
+    from pymonetdb.sql.connections import Connection
+
+
+class Prefetch:
+    """A result set batch that is being fetched ahead of time: 'count' rows
+    starting at row 'start', using the given Xexport or Xexportbin command."""
+
+    def __init__(self, command: str, binary: bool, start: int, count: int):
+        self.command = command
+        self.binary = binary
+        self.start = start
+        self.count = count
+
+    @property
+    def end(self) -> int:
+        return self.start + self.count
+
+    def discard(self):
+        """Give up on the batch. Its response is still received, the
+        connection cannot be used for anything else before that."""
+        pass
+
+
+class ThreadPrefetch(Prefetch):
+    """Sends the command and receives the response in a background thread.
+
+    The connection must not be used for anything else until the response
+    has been received. The connection takes care of this by calling
+    :meth:`wait` before sending other commands.
+    """
+
+    def __init__(self, connection: 'Connection', command: str, binary: bool, start: int, count: int):
+        super().__init__(command, binary, start, count)
+        self._response: Any = None
+        self._error: Optional[BaseException] = None
+        # Determine the deadline now, it applies to the current thread
+        deadline = connection._command_deadline()
+        self._thread = threading.Thread(
+            target=self._run, args=(connection, deadline), name="pymonetdb-prefetch", daemon=True)
+        connection._prefetch = self
+        self._thread.start()
+
+    def _run(self, connection: 'Connection', deadline):
+        mapi = connection.mapi
+        try:
+            with deadline:
+                if self.binary:
+                    # the batch keeps referring to the buffer so it must not be reused
+                    self._response = mapi.binary_cmd(self.command, mapi.new_binary_buffer())
+                else:
+                    self._response = mapi.cmd(self.command)
+        except BaseException as e:
+            self._error = e
+
+    def wait(self):
+        """Wait until the response has been received"""
+        self._thread.join()
+
+    def discard(self):
+        self.wait()
+
+    def result(self) -> Any:
+        """Wait for the response and return it, or raise the error that
+        occurred while fetching it"""
+        self.wait()
+        if self._error is not None:
+            raise self._error
+        return self._response
@@ -0,0 +1,160 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0.  If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright 1997 - July 2008 CWI, August 2008 - 2016 MonetDB B.V.
+
+"""
+Client-side cache of server-side prepared statements, see
+:meth:`pymonetdb.sql.connections.Connection.set_prepared_cache_size`.
+"""
+
+from collections import OrderedDict
+import re
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
+
+# The placeholders of paramstyle 'pyformat'. A % followed by anything else
+# means the operation cannot be prepared.
+PLACEHOLDER_RE = re.compile(r'%(?:\((\w+)\))?s|%%|%')
+
+# Only statements of these kinds are prepared
+PREPARABLE_RE = re.compile(r'\s*(?:SELECT|INSERT|UPDATE|DELETE|MERGE|WITH|CALL)\b', re.IGNORECASE)
+
+# The id in an EXEC statement sent by the cache
+EXEC_RE = re.compile(r'EXEC (\d+)\(')
+
+
+def convert_placeholders(operation: str,
+                         parameters: Union[Dict, Sequence[Any]]) -> Optional[Tuple[str, List[Any]]]:
+    """Turn a pyformat operation into a statement with ? placeholders.
+
+    Returns the statement, with surrounding whitespace and a trailing
+    semicolon removed, and the parameters in the order of the placeholders.
+    Returns None if the operation cannot be prepared.
+    """
+    if not PREPARABLE_RE.match(operation) or ';' in operation.rstrip().rstrip(';') or '--' in operation:
+        return None
+    if isinstance(parameters, dict):
+        names: Optional[List[str]] = []
+    elif isinstance(parameters, (list, tuple)):
+        names = None
+    else:
+        return None
+
+    parts = []
+    args: List[Any] = []
+    pos = 0
+    for m in PLACEHOLDER_RE.finditer(operation):
+        parts.append(operation[pos:m.start()])
+        pos = m.end()
+        text = m.group(0)
+        if text == '%%':
+            parts.append('%')
+            continue
+        if text == '%':
+            return None
+        name = m.group(1)
+        if (name is None) != (names is None):
+            return None
+        if name is None:
+            assert not isinstance(parameters, dict)
+            if len(args) >= len(parameters):
+                return None
+            args.append(parameters[len(args)])
+        else:
+            assert isinstance(parameters, dict)
+            if name not in parameters:
+                return None
+            args.append(parameters[name])
+        parts.append('?')
+    if names is None and len(args) != len(parameters):
+        return None
+    parts.append(operation[pos:])
+    sql = "".join(parts).strip().rstrip(';').rstrip()
+    return sql, args
+
+
+class PreparedStatementCache:
+    """Maps statements to the ids of their prepared statements on the server.
+
+    The least recently used statement is evicted when the cache is full.
+    Statements the server refused to prepare are remembered with id None so
+    they are not offered again.
+    """
+
+    size: int
+    """Maximum number of statements in the cache"""
+
+    keep_after_failure: bool
+    """Whether the server keeps its prepared statements when a transaction
+    fails. MonetDB versions older than Dec2023 drop them."""
+
+    def __init__(self, size: int, keep_after_failure: bool):
+        self.size = size
+        self.keep_after_failure = keep_after_failure
+        self._entries: 'OrderedDict[str, Optional[int]]' = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, operation: str,
+               parameters: Union[Dict, Sequence[Any]]) -> Optional[Tuple[str, List[Any], Optional[int]]]:
+        """If the operation can be prepared, return the statement to prepare,
+        the parameters in placeholder order and the id of the prepared
+        statement, which is None if it has not been prepared yet. Otherwise,
+        return None."""
+        converted = convert_placeholders(operation, parameters)
+        if converted is None:
+            return None
+        sql, args = converted
+        if sql not in self._entries:
+            return sql, args, None
+        self._entries.move_to_end(sql)
+        stmt_id = self._entries[sql]
+        if stmt_id is None:
+            return None
+        return sql, args, stmt_id
+
+    def add(self, sql: str, stmt_id: Optional[int]) -> List[int]:
+        """Remember the id of the prepared statement, or None if the server
+        could not prepare it. Returns the ids of the statements evicted to
+        make room, which should be deallocated on the server."""
+        self._entries[sql] = stmt_id
+        self._entries.move_to_end(sql)
+        return self._evict(self.size)
+
+    def resize(self, size: int) -> List[int]:
+        """Change the size of the cache. Returns the ids of the evicted
+        statements."""
+        self.size = size
+        return self._evict(size)
+
+    def clear(self) -> List[int]:
+        """Empty the cache. Returns the ids of the evicted statements."""
+        return self._evict(0)
+
+    def _evict(self, size: int) -> List[int]:
+        evicted: List[int] = []
+        while len(self._entries) > size:
+            _, stmt_id = self._entries.popitem(last=False)
+            if stmt_id is not None:
+                evicted.append(stmt_id)
+        return evicted
+
+    def statement_failed(self, query: str, error: Exception):
+        """Update the cache after the server reported an error for 'query'"""
+        if not self.keep_after_failure:
+            self.rolled_back()
+            return
+        m = EXEC_RE.match(query)
+        if m and 'prepared statement' in str(error).lower():
+            # someone else deallocated it
+            stmt_id = int(m.group(1))
+            for sql in [sql for sql, i in self._entries.items() if i == stmt_id]:
+                del self._entries[sql]
+
+    def rolled_back(self):
+        """Update the cache after the transaction was rolled back"""
+        if not self.keep_after_failure:
+            # the server has already dropped them
+            self._entries.clear()
@@ -16,6 +16,7 @@ import re
 import uuid
 from decimal import Decimal
 from datetime import timedelta
+from typing import Any, Callable, Dict, Optional
 
 from pymonetdb.sql import types
 from pymonetdb.exceptions import ProgrammingError
@@ -146,7 +147,7 @@ def oid(data):
     return oid
 
 
-mapping = {
+mapping: Dict[str, Callable[[str], Any]] = {
     types.CHAR: strip,
     types.VARCHAR: strip,
     types.CLOB: strip,
@@ -189,6 +190,47 @@ mapping = {
 }
 
 
+# The ways DECIMAL values can be represented, see Cursor.decimals
+DECIMAL_REPRESENTATIONS = ('decimal', 'float', 'scaled')
+
+
+def decimal_representation(decimals: str, precision: Optional[int]) -> str:
+    """The representation of the values of a DECIMAL column with the given
+    precision if 'decimals' is requested. Scaled integers are only used if
+    they fit in 64 bits."""
+    if decimals not in DECIMAL_REPRESENTATIONS:
+        raise ProgrammingError("unknown decimal representation: %s" % decimals)
+    if decimals == 'scaled' and (precision is None or precision > 18):
+        return 'decimal'
+    return decimals
+
+
+def py_scaled_decimal(data, scale):
+    """ returns the decimal as an integer, multiplied by 10 ** scale """
+    integer, _, fraction = data.partition('.')
+    return int(integer + fraction.ljust(scale, '0'))
+
+
+def converter(type_code, precision: Optional[int] = None, scale: Optional[int] = None,
+              decimals: str = 'decimal') -> Callable[[str], Any]:
+    """
+    Returns the convertion function for values of the given type, which
+    does not handle NULL. For DECIMAL, 'decimals' picks the representation.
+    """
+    if type_code == types.DECIMAL:
+        representation = decimal_representation(decimals, precision)
+        if representation == 'float':
+            return float
+        if representation == 'scaled':
+            return lambda data: py_scaled_decimal(data, scale or 0)
+    try:
+        return mapping[type_code]
+    except KeyError:
+        def unsupported(data):
+            raise ProgrammingError("type %s is not supported" % type_code)
+        return unsupported
+
+
 def convert(data, type_code):
     """
     Calls the appropriate convertion function based upon the python type
@@ -11,17 +11,18 @@ functions for converting binary result sets to Python objects
 from abc import abstractmethod
 import array
 from datetime import date, datetime, time, timezone, timedelta
-from decimal import Decimal
+from decimal import Context, Decimal
+from functools import partial
 from ipaddress import IPv4Address, IPv6Address
 import json
 from math import isnan
 import struct
 import sys
-from typing import Any, Callable, List, Optional
+from typing import Any, Callable, List, Optional, Sequence
 from uuid import UUID
 from pymonetdb.exceptions import InternalError
 
-from pymonetdb.sql import types
+from pymonetdb.sql import pythonize, types
 import pymonetdb.sql.cursors
 
 
@@ -41,6 +42,17 @@ assert FLOAT_WIDTH_TO_ARRAY_TYPE[32] == 'f'
 assert FLOAT_WIDTH_TO_ARRAY_TYPE[64] == 'd'
 
 
+def _as_array(server_endian: str, data: memoryview, letter: str) -> Sequence:
+    """Interpret the bytes as items of the given array type code.
+    No copy is made if the server has the same byte order as we do."""
+    if server_endian == sys.byteorder:
+        return data.cast(letter)  # type: ignore[call-overload]
+    arr = array.array(letter)
+    arr.frombytes(data)
+    arr.byteswap()
+    return arr
+
+
 class BinaryDecoder:
     @abstractmethod
     def decode(self, server_endian: str, data: memoryview) -> List[Any]:
@@ -61,10 +73,7 @@ class IntegerDecoder(BinaryDecoder):
         self.null_value = -(1 << (width - 1))
 
     def decode(self, server_endian: str, data: memoryview) -> List[Any]:
-        arr = array.array(self.array_letter)
-        arr.frombytes(data)
-        if server_endian != sys.byteorder:
-            arr.byteswap()
+        arr = _as_array(server_endian, data, self.array_letter)
         null_value = self.null_value
         if self.mapper:
             m = self.mapper
@@ -74,6 +83,19 @@ class IntegerDecoder(BinaryDecoder):
         return values
 
 
+class DecimalDecoder(IntegerDecoder):
+    """Decodes DECIMAL values, which are transferred as integers multiplied
+    by 10 ** scale"""
+    scale: int
+
+    def __init__(self,
+                 width: int,
+                 scale: int,
+                 mapper: Optional[Callable[[int], Any]] = None):
+        super().__init__(width, mapper)
+        self.scale = scale
+
+
 class HugeIntDecoder(BinaryDecoder):
     mapper: Optional[Callable[[int], Any]]
 
@@ -83,10 +105,7 @@ class HugeIntDecoder(BinaryDecoder):
     def decode(self, server_endian: str, data: memoryview) -> List[Any]:
         # we cannot directly decode 128 bits but we can decode 64 bits
         letter = INT_WIDTH_TO_ARRAY_TYPE[64].upper()
-        arr = array.array(letter)
-        arr.frombytes(data)
-        if server_endian != sys.byteorder:
-            arr.byteswap()
+        arr = _as_array(server_endian, data, letter)
         # maybe some day we can come up with something faster
         result: List[Optional[int]] = []
         high1 = 1 << 64
@@ -126,10 +145,7 @@ class FloatDecoder(BinaryDecoder):
         self.array_letter = FLOAT_WIDTH_TO_ARRAY_TYPE[width]
 
     def decode(self, server_endian: str, data: memoryview) -> List[Any]:
-        arr = array.array(self.array_letter)
-        arr.frombytes(data)
-        if server_endian != sys.byteorder:
-            arr.byteswap()
+        arr = _as_array(server_endian, data, self.array_letter)
         values = [None if isnan(v) else v for v in arr]
         return values
 
@@ -187,96 +203,89 @@ class ZeroDelimitedDecoder(BinaryDecoder):
         return values
 
 
-class TimestampDecoder(BinaryDecoder):
-    seconds_east: Optional[int]
+# Temporal values in the binary protocol, as struct formats without the byte
+# order prefix. TIMESTAMP is a time followed by a date, TIME and DATE are
+# padded to 8 and 4 bytes.
+TIMESTAMP_FORMAT = 'IBBBxBBh'   # micros, second, minute, hour, day, month, year
+TIME_FORMAT = 'IBBBx'           # micros, second, minute, hour
+DATE_FORMAT = 'BBh'             # day, month, year
 
-    def __init__(self, seconds_east: Optional[int]):
-        self.seconds_east = seconds_east
+# NULL times have a microseconds field of at least this, NULL dates a
+# month field above 12.
+NULL_MICROS = 1_000_000
+NULL_MONTH = 12
 
-    def decode(self, server_endian: str, data: memoryview) -> List[Any]:
-        if self.seconds_east is None:
-            utczone = None
-            ourzone = None
-        else:
-            utczone = timezone.utc
-            ourzone = timezone(timedelta(seconds=self.seconds_east))
-        # this is going to be dreadfully slow
-        result = []
 
-        for i in range(0, len(data), 12):
-            rec = data[i:i + 12]
-            micros = int.from_bytes(rec[0:4], server_endian, signed=False)   # type: ignore
-            second = int(rec[4])
-            minute = int(rec[5])
-            hour = int(rec[6])
-            # byte 7 is padding
-            day = int(rec[8])
-            month = int(rec[9])
-            year = int.from_bytes(rec[10:12], server_endian, signed=True)   # type: ignore
-            if micros < 1e6:
-                ts = datetime(year, month, day, hour, minute, second, micros, tzinfo=utczone)
-                if ourzone:
-                    ts = ts.astimezone(ourzone)
-            else:
-                ts = None
-            result.append(ts)
+class TemporalDecoder(BinaryDecoder):
+    struct_format: str
 
-        return result
+    def _records(self, server_endian: str, data: memoryview):
+        """Iterate over the fields of the records in 'data' as tuples"""
+        prefix = '>' if server_endian == 'big' else '<'
+        return struct.iter_unpack(prefix + self.struct_format, data)
 
 
-class TimeDecoder(BinaryDecoder):
+class TimestampDecoder(TemporalDecoder):
+    struct_format = TIMESTAMP_FORMAT
     seconds_east: Optional[int]
 
     def __init__(self, seconds_east: Optional[int]):
         self.seconds_east = seconds_east
 
     def decode(self, server_endian: str, data: memoryview) -> List[Any]:
+        records = self._records(server_endian, data)
         if self.seconds_east is None:
-            ourzone = None
-            delta = 0
-        else:
-            ourzone = timezone(timedelta(seconds=self.seconds_east))
-            delta = int(timedelta(seconds=self.seconds_east).total_seconds())
-        # this is going to be dreadfully slow
-        result = []
+            return [
+                datetime(year, month, day, hour, minute, second, micros) if micros < NULL_MICROS else None
+                for micros, second, minute, hour, day, month, year in records
+            ]
+        # The values are in UTC. Shifting them by the fixed offset of our
+        # zone gives the same result as astimezone() but is much cheaper.
+        ourzone = timezone(timedelta(seconds=self.seconds_east))
+        delta = timedelta(seconds=self.seconds_east)
+        return [
+            datetime(year, month, day, hour, minute, second, micros, ourzone) + delta if micros < NULL_MICROS else None
+            for micros, second, minute, hour, day, month, year in records
+        ]
+
+
+class TimeDecoder(TemporalDecoder):
+    struct_format = TIME_FORMAT
+    seconds_east: Optional[int]
 
-        for i in range(0, len(data), 8):
-            rec = data[i:i + 12]
-            micros = int.from_bytes(rec[0:4], server_endian, signed=False)   # type: ignore
-            second = int(rec[4])
-            minute = int(rec[5])
-            hour = int(rec[6])
-            # byte 7 is padding
-            if micros < 1e6:
-                if delta:
-                    adjusted = (3600 * hour + 60 * minute + second + delta) % 86400
-                    hour = adjusted // 3600
-                    minute = (adjusted // 60) % 60
-                    second = adjusted % 60
-                t = time(hour, minute, second, micros, tzinfo=ourzone)
-            else:
-                t = None
-            result.append(t)
+    def __init__(self, seconds_east: Optional[int]):
+        self.seconds_east = seconds_east
 
+    def decode(self, server_endian: str, data: memoryview) -> List[Any]:
+        records = self._records(server_endian, data)
+        if not self.seconds_east:
+            ourzone = None if self.seconds_east is None else timezone.utc
+            return [
+                time(hour, minute, second, micros, ourzone) if micros < NULL_MICROS else None
+                for micros, second, minute, hour in records
+            ]
+        ourzone = timezone(timedelta(seconds=self.seconds_east))
+        delta = self.seconds_east
+        result: List[Optional[time]] = []
+        for micros, second, minute, hour in records:
+            if micros < NULL_MICROS:
+                adjusted = (3600 * hour + 60 * minute + second + delta) % 86400
+                hour, adjusted = divmod(adjusted, 3600)
+                minute, second = divmod(adjusted, 60)
+                result.append(time(hour, minute, second, micros, ourzone))
+            else:
+                result.append(None)
         return result
 
 
-class DateDecoder(BinaryDecoder):
-    def decode(self, server_endian: str, data: memoryview) -> List[Any]:
-        result = []
-
-        for i in range(0, len(data), 4):
-            rec = data[i:i + 4]
-            day = int(rec[0])
-            month = int(rec[1])
-            year = int.from_bytes(rec[2:4], server_endian, signed=True)   # type: ignore
-            if month <= 12:
-                d = date(year, month, day)
-            else:
-                d = None
-            result.append(d)
+class DateDecoder(TemporalDecoder):
+    struct_format = DATE_FORMAT
 
-        return result
+    def decode(self, server_endian: str, data: memoryview) -> List[Any]:
+        return [
+            date(year, month, day) if month <= NULL_MONTH else None
+            for day, month, year in self._records(server_endian, data)
+        ]
 
 
 class BlobDecoder(BinaryDecoder):
@@ -291,7 +300,7 @@ class BlobDecoder(BinaryDecoder):
         while pos < length:
             if 8 > length - pos:
                 raise InternalError(f"incomplete blob header after {len(result)} blobs")
-            header = struct.unpack(struct_letter, data[pos:pos + 8])[0]
+            header = struct.unpack_from(struct_letter, data, pos)[0]
             pos += 8
             if header >= 0:
                 if header > length - pos:
@@ -315,14 +324,31 @@ def get_decoder(cursor: 'pymonetdb.sql.cursors.Cursor', colno: int) -> Optional[
     return decoder
 
 
+# Room for the 38 digits of the widest DECIMAL, so the multiplication in
+# _decimal_mapper is exact
+DECIMAL_CONTEXT = Context(prec=40)
+
+
+def _decimal_mapper(scale: int, representation: str) -> Optional[Callable[[int], Any]]:
+    """Return the function that turns the integer n into the value of a
+    DECIMAL with the given scale, or None if n itself is the value"""
+    if representation == 'scaled':
+        return None
+    if representation == 'float':
+        divisor = 10 ** scale
+        return lambda n: n / divisor
+    # Multiplying by 1E-scale yields the same digits and exponent as the text
+    # protocol, and is much cheaper than Decimal(n) / 10 ** scale.
+    return partial(DECIMAL_CONTEXT.multiply, Decimal(1).scaleb(-scale))
+
+
 def make_decimal_decoder(cursor: 'pymonetdb.sql.cursors.Cursor', colno: int) -> BinaryDecoder:
     assert cursor.description
     description: 'pymonetdb.sql.cursors.Description' = cursor.description[colno]
-    scale = 10 ** description.scale
+    scale = description.scale
     precision = description.precision
-
-    def mapper(n):
-        return Decimal(n) / scale
+    representation = pythonize.decimal_representation(cursor.decimals, precision)
+    mapper = _decimal_mapper(scale, representation)
 
     if precision <= 2:
         bit_width = 8
@@ -340,7 +366,7 @@ def make_decimal_decoder(cursor: 'pymonetdb.sql.cursors.Cursor', colno: int) ->
         # as far as we know MonetDB only supports up to 38
         assert precision <= 38
 
-    return IntegerDecoder(bit_width, mapper=mapper)
+    return DecimalDecoder(bit_width, scale, mapper=mapper)
 
 
 mapping = {
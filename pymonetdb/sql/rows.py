@@ -0,0 +1,256 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0.  If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright 1997 - July 2008 CWI, August 2008 - 2016 MonetDB B.V.
+
+"""
+containers for the rows of a result set batch
+
+Batches are normally decoded to lists of Python objects. In compact mode,
+fixed width and string columns are kept in arrays and bytes instead, and
+values are only converted to Python objects when they are accessed.
+"""
+
+import array
+from collections.abc import Sequence
+from itertools import accumulate
+from math import isnan
+import sys
+from typing import Any, Callable, List, Optional
+
+from pymonetdb.exceptions import InterfaceError
+from pymonetdb.sql import pythonizebin, types
+
+
+class ColumnBatch(Sequence):
+    """The rows of a binary result set batch, stored column by column.
+
+    Each column is kept in its binary form until one of its values is needed
+    and then decoded in one go, or wrapped in a compact column if 'compact'
+    is set. Indexing and slicing return row tuples, or :class:`Row` objects
+    if 'lazy_rows' is set.
+
+    Batches created with :meth:`from_columns` have no binary form, their
+    'decoders' and 'slices' are empty.
+    """
+
+    def __init__(self,
+                 decoders: List['pythonizebin.BinaryDecoder'],
+                 server_endian: str,
+                 slices: List[memoryview],
+                 nrows: int,
+                 lazy_rows: bool = False,
+                 compact: bool = False):
+        self.decoders = decoders
+        self.server_endian = server_endian
+        self.slices = slices
+        self.nrows = nrows
+        self.ncols = len(decoders)
+        self.lazy_rows = lazy_rows
+        self.compact = compact
+        self._columns: List[Optional[Sequence]] = [None] * len(decoders)
+
+    @classmethod
+    def from_columns(cls, columns: List[Sequence], nrows: int, lazy_rows: bool = False) -> 'ColumnBatch':
+        """Create a batch from columns that have already been decoded"""
+        batch = cls([], sys.byteorder, [], nrows, lazy_rows)
+        batch.ncols = len(columns)
+        batch._columns = list(columns)
+        return batch
+
+    def __len__(self) -> int:
+        return self.nrows
+
+    def is_decoded(self, colno: int) -> bool:
+        return self._columns[colno] is not None
+
+    def column(self, colno: int) -> Sequence:
+        """Return the values of the given column, decoding it if necessary"""
+        col = self._columns[colno]
+        if col is None:
+            if self.compact:
+                col = binary_column(self.decoders[colno], self.server_endian, self.slices[colno])
+            else:
+                col = self.decoders[colno].decode(self.server_endian, self.slices[colno])
+            if len(col) != self.nrows:
+                raise InterfaceError(f"expected {self.nrows} values in column {colno}, found {len(col)}")
+            self._columns[colno] = col
+        return col
+
+    def columns(self) -> List[Sequence]:
+        return [self.column(i) for i in range(self.ncols)]
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if self.lazy_rows:
+                return [Row(self, i) for i in range(*index.indices(self.nrows))]
+            return list(zip(*(col[index] for col in self.columns())))
+        if index < 0:
+            index += self.nrows
+        if not 0 <= index < self.nrows:
+            raise IndexError("row index out of range")
+        if self.lazy_rows:
+            return Row(self, index)
+        return tuple(col[index] for col in self.columns())
+
+
+class Row(Sequence):
+    """A row of a :class:`ColumnBatch` that behaves like a read-only tuple.
+
+    Only the columns that are actually accessed are decoded.
+    """
+
+    __slots__ = ('_batch', '_index')
+
+    def __init__(self, batch: ColumnBatch, index: int):
+        self._batch = batch
+        self._index = index
+
+    def __len__(self) -> int:
+        return self._batch.ncols
+
+    def __getitem__(self, colno):
+        if isinstance(colno, slice):
+            return tuple(self)[colno]
+        return self._batch.column(colno)[self._index]
+
+    def __iter__(self):
+        batch = self._batch
+        index = self._index
+        for colno in range(batch.ncols):
+            yield batch.column(colno)[index]
+
+    def __eq__(self, other):
+        if isinstance(other, (tuple, Row)):
+            return tuple(self) == tuple(other)
+        return NotImplemented
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __repr__(self):
+        return repr(tuple(self))
+
+
+class ArrayColumn(Sequence):
+    """Fixed width values in an array, with 'null_value' standing for NULL.
+    If 'null_value' is None, NaN stands for NULL. If given, 'mapper' is
+    applied to the values that are not NULL."""
+
+    __slots__ = ('values', 'null_value', 'mapper')
+
+    def __init__(self, values: Sequence, null_value: Optional[int], mapper: Optional[Callable[[Any], Any]] = None):
+        self.values = values
+        self.null_value = null_value
+        self.mapper = mapper
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return self._convert(self.values[index])
+        return self._convert((self.values[index],))[0]
+
+    def _convert(self, values) -> List[Any]:
+        null_value = self.null_value
+        mapper = self.mapper
+        if null_value is None:
+            return [None if isnan(v) else v for v in values]
+        if mapper is None:
+            return [None if v == null_value else v for v in values]
+        return [None if v == null_value else mapper(v) for v in values]
+
+
+class StringColumn(Sequence):
+    """Strings stored back to back in a bytes object, each followed by a
+    separator byte. The entry after entry i starts at position starts[i].
+    The entry b'\\x80' stands for NULL. 'converter' turns the other entries
+    into Python values."""
+
+    __slots__ = ('data', 'starts', 'converter')
+
+    def __init__(self, data: bytes, starts: Sequence[int], converter: Callable[[bytes], Any]):
+        self.data = data
+        self.starts = starts
+        self.converter = converter
+
+    @classmethod
+    def from_parts(cls, parts: List[bytes], converter: Callable[[bytes], Any]) -> 'StringColumn':
+        """Create a column from the encoded entries, using a NUL byte as the separator"""
+        starts = array.array('q', accumulate(len(p) + 1 for p in parts))
+        return cls(b'\x00'.join(parts) + b'\x00', starts, converter)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self.starts)))]
+        if index < 0:
+            index += len(self.starts)
+        if not 0 <= index < len(self.starts):
+            raise IndexError("string column index out of range")
+        end = self.starts[index] - 1
+        start = self.starts[index - 1] if index > 0 else 0
+        raw = self.data[start:end]
+        return None if raw == b'\x80' else self.converter(raw)
+
+
+def binary_column(decoder: 'pythonizebin.BinaryDecoder', server_endian: str, data: memoryview) -> Sequence:
+    """Return a compact column for a column of a binary result set, or the
+    decoded values if the column type has no compact form. Fixed width
+    columns keep referring to 'data'."""
+    if isinstance(decoder, pythonizebin.IntegerDecoder):
+        values = pythonizebin._as_array(server_endian, data, decoder.array_letter)
+        return ArrayColumn(values, decoder.null_value, decoder.mapper)
+    if isinstance(decoder, pythonizebin.FloatDecoder):
+        return ArrayColumn(pythonizebin._as_array(server_endian, data, decoder.array_letter), None)
+    if isinstance(decoder, pythonizebin.ZeroDelimitedDecoder):
+        parts = data.tobytes().split(b'\x00')
+        parts.pop()  # empty tail element caused by trailing \x00
+        return StringColumn.from_parts(parts, decoder.converter)
+    return decoder.decode(server_endian, data)
+
+
+# Array type code and NULL value for the fixed width types in compact text batches.
+# These are the same as in the binary protocol.
+TEXT_ARRAY_TYPES = {
+    types.TINYINT: ('b', -(1 << 7)),
+    types.SMALLINT: ('h', -(1 << 15)),
+    types.INT: ('i', -(1 << 31)),
+    types.BIGINT: ('q', -(1 << 63)),
+    types.MONTH_INTERVAL: ('i', -(1 << 31)),
+    # the text protocol parses REAL into a double, keep all of it
+    types.REAL: ('d', None),
+    types.FLOAT: ('d', None),
+    types.DOUBLE: ('d', None),
+}
+
+TEXT_STRING_TYPES = {types.CHAR, types.VARCHAR, types.CLOB, types.URL}
+
+
+def _decode_utf8(x: bytes) -> str:
+    return str(x, 'utf-8')
+
+
+def compact_column(values: Sequence[Any], type_code: str) -> Sequence:
+    """Store the Python values of a column of the given type compactly, if
+    the type has a compact form"""
+    if type_code in TEXT_ARRAY_TYPES:
+        letter, null_value = TEXT_ARRAY_TYPES[type_code]
+        fill = float('nan') if null_value is None else null_value
+        return ArrayColumn(array.array(letter, [fill if v is None else v for v in values]), null_value)
+    if type_code == types.BOOLEAN:
+        return ArrayColumn(array.array('b', [-128 if v is None else v for v in values]), -128, bool)
+    if type_code in TEXT_STRING_TYPES:
+        parts = [b'\x80' if v is None else v.encode('utf-8') for v in values]
+        return StringColumn.from_parts(parts, _decode_utf8)
+    return list(values)
+
+
+def compact_batch(rows: List[tuple], type_codes: List[str], lazy_rows: bool = False) -> ColumnBatch:
+    """Convert a list of row tuples to a ColumnBatch holding compact columns"""
+    columns = [compact_column(values, type_code) for values, type_code in zip(zip(*rows), type_codes)]
+    return ColumnBatch.from_columns(columns, len(rows), lazy_rows)
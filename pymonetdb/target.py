@@ -9,7 +9,7 @@ Utilities for parsing MonetDB URLs
 
 
 import re
-from typing import Any, Callable, Union
+from typing import Any, Callable, Tuple, Union
 from urllib.parse import parse_qsl, urlparse, quote as urlquote
 
 
@@ -145,6 +145,10 @@ class Target:
     def clone(self):
         return Target(prototype=self)
 
+    def cache_key(self) -> Tuple:
+        """Return a hashable value which is equal for Targets with equal settings"""
+        return (tuple(sorted(self._VALUES.items())), tuple(sorted(self._OTHERS.items())))
+
     tls = urlparam('tls', 'bool', 'secure the connection using TLS')
     host = urlparam(
         'host', 'string', 'IP number, domain name or one of the special values `localhost` and `localhost.`')
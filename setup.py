@@ -15,6 +15,9 @@ tests_require = ['pytest', 'mypy', 'pycodestyle', 'types-setuptools']
 extras_require = {
     'test': tests_require,
     'doc': ['sphinx', 'sphinx_rtd_theme'],
+    'numpy': ['numpy'],
+    'pandas': ['pandas'],
+    'arrow': ['pyarrow'],
 
 }
 
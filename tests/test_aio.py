@@ -0,0 +1,217 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0.  If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright 1997 - July 2008 CWI, August 2008 - 2016 MonetDB B.V.
+
+import asyncio
+import socket
+from unittest import TestCase, skipUnless
+
+import pymonetdb
+import pymonetdb.aio
+import pymonetdb.aio.connections
+import pymonetdb.aio.mapi
+import pymonetdb.mapi
+from tests.util import test_args, test_have_numpy, test_have_pandas, test_have_pyarrow, test_url
+
+QUERY = "SELECT value, CAST(value AS VARCHAR(10)) FROM sys.generate_series(0, %d)"
+
+
+class TestAio(TestCase):
+
+    def run_async(self, coro):
+        return asyncio.run(coro)
+
+    def test_connect_url(self):
+        async def go():
+            async with await pymonetdb.aio.connect(test_url) as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute("SELECT 42")
+                    return await cursor.fetchone()
+        self.assertEqual(self.run_async(go()), (42,))
+
+    def test_connect_args(self):
+        async def go():
+            async with await pymonetdb.aio.connect(**test_args) as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute("SELECT %s", [42])
+                    return await cursor.fetchall()
+        self.assertEqual(self.run_async(go()), [(42,)])
+
+    def test_same_results_as_sync(self):
+        n = 5_000
+        with pymonetdb.connect(**test_args) as conn, conn.cursor() as cursor:
+            cursor.execute(QUERY % n)
+            expected = cursor.fetchall()
+
+        for binary in [0, 1]:
+            async def go():
+                async with await pymonetdb.aio.connect(**test_args, binary=binary) as conn:
+                    async with conn.cursor() as cursor:
+                        await cursor.execute(QUERY % n)
+                        first = await cursor.fetchone()
+                        some = await cursor.fetchmany(10)
+                        rest = await cursor.fetchall()
+                        return [first] + some + rest, cursor.used_binary_protocol()
+            rows, used_binary = self.run_async(go())
+            self.assertEqual(rows, expected)
+            self.assertEqual(used_binary, bool(binary))
+
+    def test_async_iteration(self):
+        async def go():
+            async with await pymonetdb.aio.connect(**test_args) as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(QUERY % 1000)
+                    return [row async for row in cursor]
+        rows = self.run_async(go())
+        self.assertEqual(len(rows), 1001)
+        self.assertEqual(rows[-1], (1000, '1000'))
+
+    def test_fetch_batches(self):
+        async def go():
+            async with await pymonetdb.aio.connect(**test_args, replysize=100) as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(QUERY % 9_999)
+                    return [batch async for batch in cursor.fetch_batches()]
+        batches = self.run_async(go())
+        self.assertGreater(len(batches), 1)
+        self.assertEqual(len(batches[0]), 100)
+        rows = [row for batch in batches for row in batch]
+        self.assertEqual([row[0] for row in rows], list(range(10_000)))
+
+    def test_prefetch(self):
+        async def go():
+            async with await pymonetdb.aio.connect(**test_args, replysize=100) as conn:
+                async with conn.cursor() as cursor:
+                    cursor.prefetch = True
+                    await cursor.execute(QUERY % 9_999)
+                    rows = await cursor.fetchmany(500)
+                    async with conn.cursor() as other:
+                        await other.execute("SELECT 42")
+                        self.assertEqual(await other.fetchone(), (42,))
+                    rows += [row async for row in cursor]
+                    return rows
+        rows = self.run_async(go())
+        self.assertEqual([row[0] for row in rows], list(range(10_000)))
+
+    @skipUnless(test_have_numpy, "numpy not installed")
+    def test_fetch_columns(self):
+        async def go():
+            async with await pymonetdb.aio.connect(**test_args, replysize=100) as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(QUERY % 999)
+                    values, mask = (await cursor.fetch_columns(150))[0]
+                    rest = await cursor.fetchnumpy()
+                    return values.tolist(), mask, rest['value'].tolist()
+        first, mask, rest = self.run_async(go())
+        self.assertIsNone(mask)
+        self.assertEqual(first + rest, list(range(1000)))
+
+    @skipUnless(test_have_pandas, "pandas not installed")
+    def test_fetch_df(self):
+        async def go():
+            async with await pymonetdb.aio.connect(**test_args, replysize=100) as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(QUERY % 999)
+                    df = await cursor.fetch_df()
+                    await cursor.execute(QUERY % 999)
+                    sizes = [len(df) async for df in cursor.fetch_df_batches(300)]
+                    return df['value'].tolist(), sizes
+        values, sizes = self.run_async(go())
+        self.assertEqual(values, list(range(1000)))
+        self.assertEqual(sum(sizes), 1000)
+
+    @skipUnless(test_have_pyarrow, "pyarrow not installed")
+    def test_fetch_arrow(self):
+        async def go():
+            async with await pymonetdb.aio.connect(**test_args, replysize=100) as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(QUERY % 999)
+                    table = await cursor.fetch_arrow()
+                    await cursor.execute(QUERY % 999)
+                    sizes = [batch.num_rows async for batch in cursor.fetch_record_batches(300)]
+                    return table.column('value').to_pylist(), sizes
+        values, sizes = self.run_async(go())
+        self.assertEqual(values, list(range(1000)))
+        self.assertEqual(sum(sizes), 1000)
+
+    def test_concurrent_connections(self):
+        async def query(i):
+            async with await pymonetdb.aio.connect(**test_args) as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute(QUERY % i)
+                    return len(await cursor.fetchall())
+
+        async def go():
+            return await asyncio.gather(*(query(i) for i in range(20)))
+
+        self.assertEqual(self.run_async(go()), [i + 1 for i in range(20)])
+
+    def test_concurrent_cursors(self):
+        async def go():
+            async with await pymonetdb.aio.connect(**test_args) as conn:
+                async def query(i):
+                    async with conn.cursor() as cursor:
+                        await cursor.execute(QUERY % i)
+                        return len(await cursor.fetchall())
+                return await asyncio.gather(*(query(i) for i in range(10)))
+
+        self.assertEqual(self.run_async(go()), [i + 1 for i in range(10)])
+
+    def test_error(self):
+        async def go():
+            async with await pymonetdb.aio.connect(**test_args) as conn:
+                async with conn.cursor() as cursor:
+                    with self.assertRaises(pymonetdb.OperationalError):
+                        await cursor.execute("SELECT * FROM nonexistent_table")
+                    await conn.rollback()
+                    await cursor.execute("SELECT 1")
+                    return await cursor.fetchone()
+        self.assertEqual(self.run_async(go()), (1,))
+
+    def test_sync_iteration_rejected(self):
+        async def go():
+            async with await pymonetdb.aio.connect(**test_args) as conn:
+                async with conn.cursor() as cursor:
+                    await cursor.execute("SELECT 1")
+                    with self.assertRaises(pymonetdb.ProgrammingError):
+                        iter(cursor)
+        self.run_async(go())
+
+    def test_cancelled_command_closes_connection(self):
+        async def go():
+            client, server = socket.socketpair()
+            try:
+                mapi = pymonetdb.aio.mapi.Connection()
+                mapi.reader, mapi.writer = await asyncio.open_connection(sock=client)
+                mapi.state = pymonetdb.mapi.STATE_READY
+                # the server never answers
+                with self.assertRaises(asyncio.TimeoutError):
+                    await asyncio.wait_for(mapi.cmd("sSELECT 1;"), 0.1)
+                self.assertEqual(pymonetdb.mapi.STATE_INIT, mapi.state)
+                self.assertIsNone(mapi.reader)
+                with self.assertRaises(pymonetdb.ProgrammingError):
+                    await mapi.cmd("sSELECT 2;")
+            finally:
+                server.close()
+        self.run_async(go())
+
+    def test_close_after_cancelled_command(self):
+        async def go():
+            client, server = socket.socketpair()
+            try:
+                conn = pymonetdb.aio.connections.Connection.__new__(pymonetdb.aio.connections.Connection)
+                conn.autocommit = False
+                conn.mapi = pymonetdb.aio.mapi.Connection()
+                conn.mapi.reader, conn.mapi.writer = await asyncio.open_connection(sock=client)
+                conn.mapi.state = pymonetdb.mapi.STATE_READY
+                # the server never answers
+                with self.assertRaises(asyncio.TimeoutError):
+                    await asyncio.wait_for(conn.execute("SELECT 1"), 0.1)
+                # the broken connection is closed without a rollback
+                await conn.close()
+                self.assertIsNone(conn.mapi)
+            finally:
+                server.close()
+        self.run_async(go())
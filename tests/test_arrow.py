@@ -0,0 +1,116 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0.  If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright 1997 - July 2008 CWI, August 2008 - 2016 MonetDB B.V.
+
+import array
+import datetime
+from decimal import Decimal
+import sys
+from unittest import TestCase, skipUnless
+from uuid import UUID
+
+import pymonetdb
+from pymonetdb.sql import arrow, pythonizebin, types
+from pymonetdb.sql.cursors import Description
+from tests.util import test_args, test_have_pyarrow
+
+QUERY = """\
+SELECT
+    value AS i,
+    CASE WHEN value % 7 = 0 THEN NULL ELSE value / 2.0e0 END AS d,
+    CASE WHEN value % 3 = 0 THEN NULL ELSE 'x' || value END AS s,
+    value % 2 = 0 AS b,
+    CAST(value AS DECIMAL(10, 2)) / 4 AS dec
+FROM sys.generate_series(0, %d)
+"""
+
+
+def description(type_code, precision=None, scale=None):
+    return Description('c', type_code, None, None, precision, scale, None)
+
+
+@skipUnless(test_have_pyarrow, "pyarrow not installed")
+class TestArrowConversion(TestCase):
+    """Check the conversions without needing a server"""
+
+    def convert(self, type_code, decoder, data, server_endian=sys.byteorder):
+        atype = arrow.arrow_type(description(type_code))
+        result = arrow.from_binary(decoder, type_code, atype, server_endian, memoryview(data))
+        result.validate(full=True)
+        return result.to_pylist()
+
+    def test_strings(self):
+        data = b'abc\x00\x00\x80\x00\xe2\x82\xac\x00'
+        result = self.convert(types.VARCHAR, pythonizebin.ZeroDelimitedDecoder(str), data)
+        self.assertEqual(result, ['abc', '', None, '€'])
+        self.assertEqual(self.convert(types.VARCHAR, pythonizebin.ZeroDelimitedDecoder(str), b''), [])
+
+    def test_integers(self):
+        data = array.array('i', [1, -(1 << 31), -3]).tobytes()
+        self.assertEqual(self.convert(types.INT, pythonizebin.IntegerDecoder(32), data), [1, None, -3])
+
+    def test_byteswapped_integers(self):
+        arr = array.array('h', [1, -(1 << 15), 300])
+        arr.byteswap()
+        other = 'big' if sys.byteorder == 'little' else 'little'
+        result = self.convert(types.SMALLINT, pythonizebin.IntegerDecoder(16), arr.tobytes(), other)
+        self.assertEqual(result, [1, None, 300])
+
+    def test_floats_and_booleans(self):
+        data = array.array('f', [0.5, float('nan')]).tobytes()
+        self.assertEqual(self.convert(types.REAL, pythonizebin.FloatDecoder(32), data), [0.5, None])
+        data = array.array('b', [1, 0, -128] * 5).tobytes()
+        result = self.convert(types.BOOLEAN, pythonizebin.IntegerDecoder(8, mapper=bool), data)
+        self.assertEqual(result, [True, False, None] * 5)
+
+    def test_from_values(self):
+        cases = [
+            (description(types.DECIMAL, 10, 2), [Decimal('1.25'), None]),
+            (description(types.HUGEINT), [1 << 100, None]),
+            (description(types.UUID), [UUID(int=1), None]),
+            (description(types.JSON), [{"a": 1}, None]),
+            (description(types.TIMESTAMP), [datetime.datetime(2020, 1, 2, 3, 4, 5), None]),
+        ]
+        results = [arrow.from_values(values, d.type_code, arrow.arrow_type(d)).to_pylist() for d, values in cases]
+        self.assertEqual(results, [
+            [Decimal('1.25'), None],
+            [Decimal(1 << 100), None],
+            [str(UUID(int=1)), None],
+            ['{"a": 1}', None],
+            [datetime.datetime(2020, 1, 2, 3, 4, 5), None],
+        ])
+
+
+@skipUnless(test_have_pyarrow, "pyarrow not installed")
+class TestArrowFetch(TestCase):
+    def setUp(self):
+        self.conn = pymonetdb.connect(**test_args, replysize=100)
+        self.cursor = self.conn.cursor()
+
+    def tearDown(self):
+        self.cursor.close()
+        self.conn.close()
+
+    def test_same_as_fetchall(self):
+        n = 5_000
+        self.cursor.execute(QUERY % n)
+        expected = self.cursor.fetchall()
+        for binary in [0, 1]:
+            self.conn.set_binary(binary)
+            self.cursor.execute(QUERY % n)
+            table = self.cursor.fetch_arrow()
+            table.validate(full=True)
+            self.assertEqual(table.column_names, ['i', 'd', 's', 'b', 'dec'])
+            rows = [tuple(row.values()) for row in table.to_pylist()]
+            self.assertEqual(rows, expected)
+            self.assertEqual(self.cursor.used_binary_protocol(), bool(binary))
+
+    def test_record_batches(self):
+        self.cursor.execute(QUERY % 4_999)
+        batches = list(self.cursor.fetch_record_batches(1000))
+        self.assertGreater(len(batches), 1)
+        self.assertEqual(sum(b.num_rows for b in batches), 5_000)
+        self.assertTrue(all(b.schema == batches[0].schema for b in batches))
+        self.assertIsNone(self.cursor.fetchone())
@@ -0,0 +1,186 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0.  If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright 1997 - July 2008 CWI, August 2008 - 2016 MonetDB B.V.
+
+import array
+import datetime
+import struct
+import sys
+from unittest import TestCase, skipUnless
+
+import pymonetdb
+from pymonetdb.sql import columnar, pythonizebin, types
+from pymonetdb.sql.cursors import Description
+from tests.util import test_args, test_have_numpy, test_have_pandas
+
+QUERY = """\
+SELECT
+    value AS i,
+    CASE WHEN value % 7 = 0 THEN NULL ELSE value / 2.0e0 END AS d,
+    CASE WHEN value % 3 = 0 THEN NULL ELSE 'x' || value END AS s,
+    value % 2 = 0 AS b
+FROM sys.generate_series(0, %d)
+"""
+
+
+@skipUnless(test_have_numpy, "numpy not installed")
+class TestColumnarConversion(TestCase):
+    """Check the conversions without needing a server"""
+
+    def test_from_values(self):
+        values, mask = columnar.from_values((1, None, 3), 'i4')
+        self.assertEqual(values.dtype.str[1:], 'i4')
+        self.assertEqual(mask.tolist(), [False, True, False])
+        self.assertEqual(columnar.to_values((values, mask)), [1, None, 3])
+
+    def test_from_values_objects(self):
+        values, mask = columnar.from_values(('a', None, b'xy'), 'O')
+        self.assertEqual(values.shape, (3,))
+        self.assertEqual(mask.tolist(), [False, True, False])
+
+    def test_integers(self):
+        decoder = pythonizebin.IntegerDecoder(32)
+        data = array.array('i', [1, -(1 << 31), 3]).tobytes()
+        values, mask = columnar.from_binary(decoder, 'i4', sys.byteorder, memoryview(data))
+        self.assertEqual(values[[0, 2]].tolist(), [1, 3])
+        self.assertEqual(mask.tolist(), [False, True, False])
+
+    def test_byteswapped_integers(self):
+        decoder = pythonizebin.IntegerDecoder(64)
+        arr = array.array('q', [1, 2, 3])
+        arr.byteswap()
+        other = 'big' if sys.byteorder == 'little' else 'little'
+        values, mask = columnar.from_binary(decoder, 'i8', other, memoryview(arr.tobytes()))
+        self.assertEqual(values.tolist(), [1, 2, 3])
+        self.assertTrue(values.dtype.isnative)
+        self.assertIsNone(mask)
+
+    def test_floats_and_booleans(self):
+        data = array.array('d', [0.5, float('nan')]).tobytes()
+        values, mask = columnar.from_binary(pythonizebin.FloatDecoder(64), 'f8', sys.byteorder, memoryview(data))
+        self.assertEqual(columnar.to_values((values, mask)), [0.5, None])
+
+        decoder = pythonizebin.IntegerDecoder(8, mapper=bool)
+        data = array.array('b', [1, 0, -128]).tobytes()
+        values, mask = columnar.from_binary(decoder, '?', sys.byteorder, memoryview(data))
+        self.assertEqual(columnar.to_values((values, mask)), [True, False, None])
+
+    def test_datetime64(self):
+        data = (struct.pack('<IBBBxBBh', 250, 12, 34, 22, 29, 2, 2024)
+                + struct.pack('<IBBBxBBh', 1 << 31, 0, 0, 0, 0, 0, 0))
+        decoder = pythonizebin.TimestampDecoder(None)
+        values, mask = columnar.from_binary(decoder, 'datetime64[us]', 'little', memoryview(data))
+        self.assertEqual(str(values[0]), '2024-02-29T22:34:12.000250')
+        self.assertEqual(mask.tolist(), [False, True])
+        self.assertEqual(columnar.to_values((values, mask)), decoder.decode('little', memoryview(data)))
+
+        data = struct.pack('>BBh', 1, 3, 1900) + struct.pack('>BBh', 31, 12, -44)
+        values, mask = columnar.from_binary(pythonizebin.DateDecoder(), 'datetime64[D]', 'big', memoryview(data))
+        self.assertEqual([str(v) for v in values], ['1900-03-01', '-044-12-31'])
+        self.assertIsNone(mask)
+
+        values, mask = columnar.from_values((None, datetime.date(2020, 1, 2)), 'datetime64[D]')
+        self.assertEqual(str(values[1]), '2020-01-02')
+        self.assertEqual(mask.tolist(), [True, False])
+
+    def test_concat(self):
+        chunks = [columnar.from_values((1, 2), 'i8'), columnar.from_values((None, 4), 'i8')]
+        column = columnar.concat(chunks, 'i8')
+        self.assertEqual(columnar.to_values(column), [1, 2, None, 4])
+        self.assertEqual(columnar.to_values(columnar.concat([], 'i8')), [])
+
+
+@skipUnless(test_have_pandas, "pandas not installed")
+class TestDataFrameConversion(TestCase):
+    def description(self, name, type_code):
+        return Description(name, type_code, None, None, None, None, None)
+
+    def test_dtypes(self):
+        columns = [
+            columnar.from_values((1, None), 'i4'),
+            columnar.from_values((1, 2), 'i8'),
+            columnar.from_values((True, None), '?'),
+            columnar.from_values((None, 1.5), 'f8'),
+            columnar.from_values((datetime.date(2020, 1, 2), None), 'O'),
+            columnar.from_values((None, datetime.datetime(2020, 1, 2, 3, 4, 5)), 'O'),
+            columnar.from_values(('a', None), 'O'),
+        ]
+        description = [
+            self.description('i', types.INT),
+            self.description('j', types.BIGINT),
+            self.description('b', types.BOOLEAN),
+            self.description('f', types.DOUBLE),
+            self.description('d', types.DATE),
+            self.description('t', types.TIMESTAMP),
+            self.description('s', types.VARCHAR),
+        ]
+        df = columnar.to_dataframe(columns, description, categorical=True)
+        self.assertEqual(list(df.columns), ['i', 'j', 'b', 'f', 'd', 't', 's'])
+        self.assertEqual([str(t) for t in df.dtypes[:4]], ['Int32', 'int64', 'boolean', 'float64'])
+        self.assertEqual([t.kind for t in df.dtypes[4:6]], ['M', 'M'])
+        self.assertEqual(str(df.dtypes.iloc[6]), 'category')
+        self.assertEqual(df.isna().values.tolist(), [
+            [False, False, False, True, False, True, False],
+            [True, False, True, False, True, False, True],
+        ])
+        self.assertEqual(df['t'][1].to_pydatetime(), datetime.datetime(2020, 1, 2, 3, 4, 5))
+
+
+@skipUnless(test_have_numpy, "numpy not installed")
+class TestColumnarFetch(TestCase):
+    def setUp(self):
+        self.conn = pymonetdb.connect(**test_args, replysize=100)
+        self.cursor = self.conn.cursor()
+
+    def tearDown(self):
+        self.cursor.close()
+        self.conn.close()
+
+    def test_same_as_fetchall(self):
+        n = 5_000
+        self.cursor.execute(QUERY % n)
+        expected = self.cursor.fetchall()
+        for binary in [0, 1]:
+            self.conn.set_binary(binary)
+            self.cursor.execute(QUERY % n)
+            first = self.cursor.fetchone()
+            columns = self.cursor.fetch_columns(150)
+            some = self.cursor.fetchmany(10)
+            rest = self.cursor.fetch_columns()
+            rows = [first]
+            rows += zip(*(columnar.to_values(col) for col in columns))
+            rows += some
+            rows += zip(*(columnar.to_values(col) for col in rest))
+            self.assertEqual(rows, expected)
+            self.assertEqual(self.cursor.used_binary_protocol(), bool(binary))
+
+    def test_fetchnumpy(self):
+        self.cursor.execute(QUERY % 999)
+        result = self.cursor.fetchnumpy()
+        self.assertEqual(list(result.keys()), ['i', 'd', 's', 'b'])
+        self.assertEqual(result['i'].dtype.kind, 'i')
+        self.assertEqual(result['d'].dtype.kind, 'f')
+        self.assertEqual(result['b'].dtype.kind, 'b')
+        self.assertEqual(result['i'].tolist(), list(range(1000)))
+        self.assertTrue(result['d'].mask[7])
+        self.assertEqual(result['s'][4], 'x4')
+        self.assertEqual(self.cursor.fetchone(), None)
+
+    @skipUnless(test_have_pandas, "pandas not installed")
+    def test_fetch_df(self):
+        self.cursor.execute(QUERY % 4_999)
+        expected = self.cursor.fetchall()
+        self.cursor.execute(QUERY % 4_999)
+        df = self.cursor.fetch_df()
+        self.assertEqual(list(df.columns), ['i', 'd', 's', 'b'])
+        self.assertEqual(len(df), 5_000)
+        self.assertEqual(df['i'].tolist(), [row[0] for row in expected])
+        self.assertEqual(int(df['d'].isna().sum()), sum(1 for row in expected if row[1] is None))
+
+        self.cursor.execute(QUERY % 4_999)
+        batches = list(self.cursor.fetch_df_batches(1000))
+        self.assertGreater(len(batches), 1)
+        self.assertEqual(sum(len(b) for b in batches), 5_000)
+        self.assertEqual(batches[-1]['i'].iloc[-1], 4_999)
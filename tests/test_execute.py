@@ -4,6 +4,7 @@
 #
 # Copyright 1997 - July 2008 CWI, August 2008 - 2016 MonetDB B.V.
 
+import time
 from unittest import TestCase
 import pymonetdb
 from tests.util import test_args
@@ -36,3 +37,72 @@ class ExecuteTests(TestCase):
         self.assertIsNone(ret)
 
         conn.rollback()
+
+    def test_executemany_insert(self):
+        conn = pymonetdb.connect(**test_args)
+        c = conn.cursor()
+        c.execute("CREATE TEMPORARY TABLE foo(i INT, s TEXT) ON COMMIT PRESERVE ROWS")
+
+        rows = [(i, f"it's {i}" if i % 3 else None) for i in range(2500)]
+        ret = c.executemany("INSERT INTO foo(i, s) VALUES (%s, %s)", iter(rows))
+        self.assertEqual(ret, 2500)
+        self.assertEqual(c.rowcount, 2500)
+
+        # not an INSERT ... VALUES, executed once per parameter set
+        ret = c.executemany("INSERT INTO foo SELECT %(i)s, %(s)s", [dict(i=-1, s='x'), dict(i=-2, s='y')])
+        self.assertEqual(ret, 2)
+
+        c.execute("SELECT * FROM foo WHERE i >= 0 ORDER BY i")
+        self.assertEqual(c.fetchall(), rows)
+        conn.close()
+
+    def test_execute_batch(self):
+        conn = pymonetdb.connect(**test_args)
+        c = conn.cursor()
+        rowcounts = c.execute_batch([
+            "CREATE TEMPORARY TABLE foo(i INT) ON COMMIT PRESERVE ROWS",
+            "INSERT INTO foo VALUES (%s), (%s)",
+            "SELECT i FROM foo ORDER BY i",
+            "DELETE FROM foo WHERE i = %(i)s;",
+        ], [None, (1, 2), None, dict(i=1)])
+        self.assertEqual(rowcounts, [-1, 2, 2, 1])
+        self.assertIsNone(c.description)
+        self.assertTrue(c.nextset())
+        self.assertEqual(c.rowcount, 2)
+        self.assertTrue(c.nextset())
+        self.assertEqual(c.fetchall(), [(1,), (2,)])
+        self.assertTrue(c.nextset())
+        self.assertEqual(c.rowcount, 1)
+        self.assertFalse(c.nextset())
+
+        with self.assertRaisesRegex(pymonetdb.DatabaseError, "^statement 2: "):
+            c.execute_batch(["SELECT 1", "SELECT * FROM no_such_table", "SELECT 3"])
+        self.assertEqual(c.fetchall(), [(1,)])
+        self.assertFalse(c.nextset())
+
+        with self.assertRaises(pymonetdb.ProgrammingError):
+            c.execute_batch(["SELECT 1 -- one", "SELECT 2"])
+        conn.close()
+
+    def test_deadline(self):
+        conn = pymonetdb.connect(**test_args)
+        c = conn.cursor()
+        started = time.monotonic()
+        with self.assertRaises(pymonetdb.OperationalError):
+            with conn.deadline(0.5):
+                c.execute("SELECT sys.sleep(5000)")
+        self.assertLess(time.monotonic() - started, 4)
+        self.assertIsNone(conn.mapi.sock)
+        conn.close()
+
+    def test_statement_timeout(self):
+        conn = pymonetdb.connect(**test_args)
+        conn.set_statement_timeout(1)
+        c = conn.cursor()
+        with self.assertRaises(pymonetdb.Error):
+            c.execute("SELECT sys.sleep(5000)")
+        conn.rollback()
+        conn.set_statement_timeout(None)
+        c.execute("SELECT 42")
+        self.assertEqual(c.fetchone(), (42,))
+        conn.close()
@@ -1,6 +1,12 @@
+import socket
+import struct
+import time
 from unittest import TestCase
+from unittest.mock import patch
 from tests.util import test_mapi_args
-from pymonetdb.mapi import Connection
+from pymonetdb.exceptions import Error, OperationalError, ProgrammingError
+from pymonetdb import mapi
+from pymonetdb.mapi import Connection, MAX_PACKAGE_LENGTH, STATE_READY
 
 
 class TestMapi(TestCase):
@@ -21,3 +27,350 @@ class TestMapi(TestCase):
             data = self.conn.cmd(query)
             cleaned = [i for i in data.split('\n') if i and not i[0] in '%&']
             self.assertEqual(len(cleaned), size)
+
+
+class TestFraming(TestCase):
+    """Check the MAPI block framing without needing a server"""
+
+    def setUp(self):
+        self.conn = Connection()
+        self.conn.sock, self.peer = socket.socketpair()
+        self.conn.state = STATE_READY
+        self.peer.settimeout(5)
+
+    def tearDown(self):
+        self.conn.disconnect()
+        self.peer.close()
+
+    def read_frames(self, count):
+        frames = []
+        for _ in range(count):
+            header = self.read_exactly(2)
+            flag = struct.unpack('<H', header)[0]
+            frames.append((self.read_exactly(flag >> 1), bool(flag & 1)))
+        return frames
+
+    def read_exactly(self, n):
+        data = b''
+        while len(data) < n:
+            data += self.peer.recv(n - len(data))
+        return data
+
+    def test_small_block(self):
+        self.conn._putblock('sselect 42;')
+        self.assertEqual(self.read_frames(1), [(b'sselect 42;', True)])
+
+    def test_large_block(self):
+        text = 'x' * (3 * MAX_PACKAGE_LENGTH + 5)
+        self.conn._putblock(text)
+        frames = self.read_frames(4)
+        self.assertEqual([last for _, last in frames], [False, False, False, True])
+        self.assertEqual(b''.join(data for data, _ in frames), text.encode())
+
+    def test_exact_multiple(self):
+        # a block whose size is a multiple of the frame size ends in an empty frame
+        data = bytes(2 * MAX_PACKAGE_LENGTH)
+        self.conn._putblock_raw(data, True)
+        frames = self.read_frames(3)
+        self.assertEqual([len(d) for d, _ in frames], [MAX_PACKAGE_LENGTH, MAX_PACKAGE_LENGTH, 0])
+        self.assertEqual([last for _, last in frames], [False, False, True])
+
+    def test_unfinished_block(self):
+        self.conn._putblock_raw(b'abc', False)
+        self.conn._putblock_raw(b'def', True)
+        self.assertEqual(self.read_frames(2), [(b'abc', False), (b'def', True)])
+
+    def test_multibyte_text(self):
+        text = '\u20ac' * MAX_PACKAGE_LENGTH
+        self.conn._putblock(text)
+        encoded = text.encode('utf-8')
+        nframes = len(encoded) // MAX_PACKAGE_LENGTH + 1
+        frames = self.read_frames(nframes)
+        self.assertEqual(b''.join(data for data, _ in frames), encoded)
+
+    def send_frames(self, frames):
+        data = b''
+        for payload, last in frames:
+            data += struct.pack('<H', 2 * len(payload) + int(last)) + payload
+        self.peer.sendall(data)
+
+    def test_read_consecutive_blocks(self):
+        # both blocks arrive in a single read
+        self.send_frames([(b'first', True), (b'sec', False), (b'ond', True)])
+        self.assertEqual(self.conn._getblock(), 'first')
+        self.assertEqual(self.conn._getblock(), 'second')
+
+    def send_block(self, payload):
+        frames = []
+        for i in range(0, len(payload), MAX_PACKAGE_LENGTH):
+            chunk = payload[i:i + MAX_PACKAGE_LENGTH]
+            frames.append((chunk, i + MAX_PACKAGE_LENGTH >= len(payload)))
+        self.send_frames(frames)
+
+    def test_read_large_block(self):
+        payload = bytes(range(256)) * 200
+        self.send_block(payload)
+        buffer = bytearray(10)
+        end = self.conn._getblock_raw(buffer, 0)
+        self.assertEqual(bytes(buffer[:end]), payload)
+
+    def test_binary_cmd_buffer(self):
+        payload = bytes(range(256)) * 200
+        self.send_block(payload)
+        buffer = bytearray()
+        view = self.conn.binary_cmd('Xexportbin 1 0 100', buffer)
+        self.assertIs(view.obj, buffer)
+        self.assertEqual(bytes(view), payload)
+        self.assertEqual(self.conn.binary_size_hint, len(payload))
+        self.read_frames(1)
+
+        # the next buffer is sized up front using the previous response as a hint
+        self.send_block(payload[:100])
+        buffer2 = bytearray()
+        view = self.conn.binary_cmd('Xexportbin 1 100 100', buffer2)
+        self.assertEqual(bytes(view), payload[:100])
+        self.assertGreaterEqual(len(buffer2), len(payload))
+        self.read_frames(1)
+
+        # new buffers start out at the size of the previous response
+        self.assertEqual(len(self.conn.new_binary_buffer()), 100)
+
+    def test_read_split_header(self):
+        # the frame header is split across two reads
+        self.peer.sendall(b'\x0b')
+        self.conn._fill_recv_buffer(1)
+        self.peer.sendall(b'\x00hello')
+        self.assertEqual(self.conn._getblock(), 'hello')
+
+    def test_pipelined(self):
+        # the responses can be queued up front because the socket buffers them
+        self.send_frames([(b'&3\n', True), (b'!42000!syntax error\n', True), (b'', True)])
+        results = self.conn.cmd_pipelined(['sset schema sys;', 'sbogus;', 'Xreply_size 5'])
+        self.assertEqual(self.read_frames(3), [
+            (b'sset schema sys;', True), (b'sbogus;', True), (b'Xreply_size 5', True)])
+        self.assertEqual(results[0], '&3\n')
+        self.assertIsInstance(results[1], Error)
+        self.assertIn('syntax error', str(results[1]))
+        self.assertEqual(results[2], '')
+
+    def test_cmd_nowait(self):
+        self.conn.cmd_nowait('Xclose 1')
+        self.conn.cmd_nowait('Xclose 2')
+        self.assertEqual(self.read_frames(2), [(b'Xclose 1', True), (b'Xclose 2', True)])
+        self.assertEqual(self.conn.unread_responses, 2)
+
+        # the responses to the Xcloses are skipped, errors included
+        self.send_frames([(b'', True), (b'!no such result set\n', True), (b'&3\n', True)])
+        self.assertEqual(self.conn.cmd('sset schema sys;'), '&3\n')
+        self.assertEqual(self.conn.unread_responses, 0)
+
+    def test_cmd_nowait_defer(self):
+        self.conn.cmd_nowait('Xreply_size 10', defer=True)
+        self.assertEqual(self.conn.deferred_commands, ('Xreply_size 10',))
+        self.assertEqual(self.conn.unread_responses, 0)
+
+        # the deferred command goes out with the next command
+        self.send_frames([(b'', True), (b'&3\n', True)])
+        self.assertEqual(self.conn.cmd('sset schema sys;'), '&3\n')
+        self.assertEqual(self.read_frames(2), [(b'Xreply_size 10', True), (b'sset schema sys;', True)])
+        self.assertEqual(self.conn.deferred_commands, ())
+        self.assertEqual(self.conn.unread_responses, 0)
+
+    def test_track_transaction(self):
+        self.send_frames([(b'&4 f\n', True)])
+        self.conn.cmd('sstart transaction;')
+        self.assertTrue(self.conn.in_transaction)
+        self.send_frames([(b'&2 1 -1\n&4 t\n', True)])
+        self.conn.cmd('sinsert into foo values (1); commit;')
+        self.assertFalse(self.conn.in_transaction)
+        self.read_frames(2)
+
+    def test_pipeline_reset(self):
+        self.conn.cmd_nowait('Xclose 1')
+        self.conn.cmd_nowait('Xreply_size 10', defer=True)
+        # dropping the read-ahead data does not forget the queued commands
+        self.conn._discard_recv_buffer()
+        self.assertEqual(self.conn.unread_responses, 1)
+        self.assertEqual(self.conn.deferred_commands, ('Xreply_size 10',))
+        self.conn.disconnect()
+        self.assertEqual(self.conn.unread_responses, 0)
+        self.assertEqual(self.conn.deferred_commands, ())
+
+    def test_setup_commands(self):
+        called = []
+        self.conn.remaining_handshake_options = [
+            mapi.HandshakeOption(1, "auto_commit", called.append, True, lambda v: "Xauto_commit %d" % v),
+            mapi.HandshakeOption(3, "size_header", called.append, False),
+        ]
+        self.conn.setup_commands = ['sSET SCHEMA foo\n;']
+        # a rejected clientinfo is only logged, the option without a command
+        # falls back to its callback
+        self.send_frames([(b'!42000!unknown command\n', True), (b'', True), (b'&3\n', True)])
+        with patch.object(self.conn, '_clientinfo_command', return_value='Xclientinfo x'):
+            self.conn._run_setup_commands()
+        self.assertEqual(self.read_frames(3), [
+            (b'Xclientinfo x', True), (b'Xauto_commit 1', True), (b'sSET SCHEMA foo\n;', True)])
+        self.assertEqual(called, [False])
+
+        # other errors are raised
+        called.clear()
+        self.send_frames([(b'', True), (b'!3F000!no such schema\n', True)])
+        with patch.object(self.conn, '_clientinfo_command', return_value=None):
+            with self.assertRaises(OperationalError):
+                self.conn._run_setup_commands()
+        self.assertEqual(called, [])
+
+    def test_pipelined_file_transfer(self):
+        self.send_frames([(b'\x01\x03\nr 0 /tmp/x\n', True)])
+        with self.assertRaises(ProgrammingError):
+            self.conn.cmd_pipelined(["scopy into t from 'x' on client;", 'sselect 1;'])
+        self.assertIsNone(self.conn.sock)
+
+    def test_deadline_exceeded(self):
+        # the peer never answers
+        started = time.monotonic()
+        with self.assertRaises(OperationalError):
+            with self.conn.command_deadline(time.monotonic() + 0.2):
+                self.conn.cmd('sselect 42;')
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertIsNone(self.conn.sock)
+
+    def test_deadline_met(self):
+        self.conn.sock.settimeout(7)
+        self.send_frames([(b'&3\n', True)])
+        with self.conn.command_deadline(time.monotonic() + 5):
+            self.assertEqual(self.conn.cmd('sset schema sys;'), '&3\n')
+        self.assertEqual(self.conn.sock.gettimeout(), 7)
+
+    def test_socket_timeout_before_deadline(self):
+        # the socket's own timeout is not reported as an exceeded deadline
+        self.conn.sock.settimeout(0.2)
+        with self.assertRaises(socket.timeout):
+            with self.conn.command_deadline(time.monotonic() + 5):
+                self.conn.cmd('sselect 42;')
+        self.assertEqual(self.conn.sock.gettimeout(), 0.2)
+
+
+class TestStaggeredConnect(TestCase):
+    """Check the address racing in try_connect without needing a server"""
+
+    def setUp(self):
+        self.listener = socket.socket()
+        self.listener.bind(('127.0.0.1', 0))
+        self.listener.listen()
+        self.port = self.listener.getsockname()[1]
+        # a port nobody listens on
+        s = socket.socket()
+        s.bind(('127.0.0.1', 0))
+        self.dead_port = s.getsockname()[1]
+        s.close()
+        mapi.clear_dns_cache()
+
+    def tearDown(self):
+        self.listener.close()
+        mapi.set_dns_cache_ttl(0)
+
+    def addrinfo(self, *ports, ip='127.0.0.1'):
+        return [(socket.AF_INET, socket.SOCK_STREAM, 6, '', (ip, p)) for p in ports]
+
+    def connect(self, addrs):
+        conn = Connection()
+        conn.connect_deadline = time.time() + 5
+        conn.target.host = 'example.invalid'
+        conn.target.sock = ''
+        with patch('socket.getaddrinfo', return_value=addrs) as getaddrinfo:
+            try:
+                conn.try_connect()
+                return conn, getaddrinfo.call_count
+            except Exception:
+                conn.disconnect()
+                raise
+
+    def test_refused_address_is_skipped(self):
+        conn, _ = self.connect(self.addrinfo(self.dead_port, self.port))
+        self.assertEqual(conn.sock.getpeername()[1], self.port)
+        conn.disconnect()
+
+    def test_all_refused(self):
+        with self.assertRaises(OSError):
+            self.connect(self.addrinfo(self.dead_port, self.dead_port))
+
+    def test_stalled_address_does_not_block(self):
+        # 192.0.2.0/24 is reserved for documentation, connecting there either
+        # fails or hangs. Either way the next address must be tried quickly.
+        addrs = self.addrinfo(self.port, ip='192.0.2.1') + self.addrinfo(self.port)
+        t0 = time.time()
+        conn, _ = self.connect(addrs)
+        self.assertLess(time.time() - t0, 2)
+        self.assertEqual(conn.sock.getpeername(), ('127.0.0.1', self.port))
+        conn.disconnect()
+
+    def test_interleave_families(self):
+        v6 = [(socket.AF_INET6, socket.SOCK_STREAM, 6, '', ('::1', n, 0, 0)) for n in range(3)]
+        v4 = self.addrinfo(10, 11)
+        ordered = mapi._interleave_families(v6 + v4)
+        self.assertEqual([a[4][1] for a in ordered], [0, 10, 1, 11, 2])
+
+    def test_dns_cache(self):
+        mapi.set_dns_cache_ttl(60)
+        conn, count = self.connect(self.addrinfo(self.port))
+        conn.disconnect()
+        self.assertEqual(count, 1)
+        conn, count = self.connect(self.addrinfo(self.port))
+        conn.disconnect()
+        self.assertEqual(count, 0)
+        # failure invalidates the cached entry
+        mapi._dns_cache[('example.invalid', conn.target.connect_port)] = (time.monotonic() + 60,
+                                                                          self.addrinfo(self.dead_port))
+        with self.assertRaises(OSError):
+            self.connect(self.addrinfo(self.port))
+        conn, count = self.connect(self.addrinfo(self.port))
+        conn.disconnect()
+        self.assertEqual(count, 1)
+
+
+class TestEndpointCache(TestCase):
+    """Check that redirects are remembered, without needing a server"""
+
+    def setUp(self):
+        mapi.clear_endpoint_cache()
+        self.attempts = []
+        self.dead = set()
+
+    def tearDown(self):
+        mapi.clear_endpoint_cache()
+
+    def fake_connect_target(self, conn):
+        host = conn.target.host
+        self.attempts.append(host)
+        if host in self.dead:
+            raise ConnectionRefusedError()
+        if host == 'merovingian':
+            conn._handle_redirect('mapi:monetdb://db1:50001/demo')
+            self.attempts.append(conn.target.host)
+            if conn.target.host in self.dead:
+                raise ConnectionRefusedError()
+
+    def connect(self):
+        self.attempts = []
+        with patch.object(Connection, 'connect_target', autospec=True, side_effect=self.fake_connect_target):
+            conn = Connection()
+            conn.connect('demo', 'monetdb', 'monetdb', 'sql', hostname='merovingian')
+        return conn.target
+
+    def test_redirect_is_remembered(self):
+        self.connect()
+        self.assertEqual(self.attempts, ['merovingian', 'db1'])
+        target = self.connect()
+        self.assertEqual(self.attempts, ['db1'])
+        self.assertEqual(target.port, 50001)
+
+    def test_dead_endpoint_is_forgotten(self):
+        self.connect()
+        self.dead.add('db1')
+        with self.assertRaises(ConnectionRefusedError):
+            self.connect()
+        self.assertEqual(self.attempts, ['db1', 'merovingian', 'db1'])
+        self.dead.clear()
+        self.connect()
+        self.assertEqual(self.attempts, ['merovingian', 'db1'])
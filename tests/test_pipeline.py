@@ -0,0 +1,66 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0.  If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright 1997 - July 2008 CWI, August 2008 - 2016 MonetDB B.V.
+
+from unittest import TestCase
+
+import pymonetdb
+from tests.util import test_args
+
+
+class TestPipeline(TestCase):
+
+    def setUp(self):
+        self.conn = pymonetdb.connect(autocommit=True, **test_args)
+        with self.conn.cursor() as c:
+            c.execute("DROP TABLE IF EXISTS pipeline_test")
+            c.execute("CREATE TABLE pipeline_test(i INT)")
+
+    def tearDown(self):
+        with self.conn.cursor() as c:
+            c.execute("DROP TABLE IF EXISTS pipeline_test")
+        self.conn.close()
+
+    def test_many_statements(self):
+        n = 1000
+        with self.conn.pipeline() as p:
+            inserts = [p.execute("INSERT INTO pipeline_test VALUES (%s)", [i]) for i in range(n)]
+            select = p.execute("SELECT COUNT(*), SUM(i) FROM pipeline_test")
+        self.assertTrue(all(c.rowcount == 1 for c in inserts))
+        self.assertEqual(select.fetchone(), (n, n * (n - 1) // 2))
+
+    def test_result_sets(self):
+        with self.conn.pipeline() as p:
+            cursors = [p.execute("SELECT value FROM sys.generate_series(0, %s)", [i]) for i in range(1, 20)]
+        for i, c in enumerate(cursors, 1):
+            self.assertEqual(c.fetchall(), [(j,) for j in range(i)])
+
+    def test_large_results(self):
+        self.conn.replysize = -1
+        with self.conn.pipeline() as p:
+            cursors = [p.execute("SELECT value FROM sys.generate_series(0, 50000)") for i in range(5)]
+        for c in cursors:
+            self.assertEqual(len(c.fetchall()), 50000)
+
+    def test_errors(self):
+        p = self.conn.pipeline()
+        ok1 = p.execute("INSERT INTO pipeline_test VALUES (1)")
+        bad = p.execute("INSERT INTO nonexistent_table VALUES (2)")
+        ok2 = p.execute("SELECT 42")
+        with self.assertRaises(pymonetdb.OperationalError):
+            p.sync()
+        self.assertEqual(len(p.errors), 1)
+        self.assertIs(p.errors[0][0], bad)
+        self.assertEqual(ok1.rowcount, 1)
+        self.assertEqual(ok2.fetchone(), (42,))
+
+    def test_exception_discards_queue(self):
+        with self.assertRaises(ZeroDivisionError):
+            with self.conn.pipeline() as p:
+                p.execute("INSERT INTO pipeline_test VALUES (1)")
+                1 / 0
+        with self.conn.cursor() as c:
+            c.execute("SELECT COUNT(*) FROM pipeline_test")
+            self.assertEqual(c.fetchone(), (0,))
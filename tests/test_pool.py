@@ -0,0 +1,122 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0.  If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright 1997 - July 2008 CWI, August 2008 - 2016 MonetDB B.V.
+
+import threading
+from unittest import TestCase
+
+import pymonetdb
+from pymonetdb.pool import ConnectionPool, get_pool
+from tests.util import test_url
+
+
+class TestPool(TestCase):
+
+    def setUp(self):
+        self.pool = ConnectionPool(test_url, max_size=2, timeout=1.0)
+
+    def tearDown(self):
+        self.pool.close()
+
+    def current_schema(self, conn):
+        with conn.cursor() as c:
+            c.execute("SELECT CURRENT_SCHEMA")
+            return c.fetchone()[0]
+
+    def test_reuse(self):
+        with self.pool.connection() as conn1:
+            pass
+        with self.pool.connection() as conn2:
+            self.assertIs(conn1, conn2)
+            with conn2.cursor() as c:
+                c.execute("SELECT 42")
+                self.assertEqual(c.fetchone(), (42,))
+        stats = self.pool.stats()
+        self.assertEqual(stats.created, 1)
+        self.assertEqual(stats.checkouts, 2)
+        self.assertEqual(stats.idle, 1)
+
+    def test_reset(self):
+        with self.pool.connection() as conn:
+            schema = self.current_schema(conn)
+            with conn.cursor() as c:
+                c.execute("CREATE TEMPORARY TABLE pooltmp(i INT)")
+                c.execute("SET SCHEMA tmp")
+            conn.set_autocommit(not conn.autocommit)
+            conn.replysize = 3
+        with self.pool.connection() as conn:
+            self.assertEqual(self.current_schema(conn), schema)
+            self.assertEqual(conn.autocommit, self.pool.target.autocommit)
+            self.assertNotEqual(conn.replysize, 3)
+
+    def test_rollback_on_return(self):
+        with self.pool.connection() as conn:
+            if conn.autocommit:
+                conn.set_autocommit(False)
+            with conn.cursor() as c:
+                c.execute("CREATE TABLE pool_rollback(i INT)")
+        with self.pool.connection() as conn:
+            with conn.cursor() as c:
+                with self.assertRaises(pymonetdb.OperationalError):
+                    c.execute("SELECT * FROM pool_rollback")
+
+    def test_rollback_explicit_transaction_on_return(self):
+        with self.pool.connection() as conn:
+            if not conn.autocommit:
+                conn.set_autocommit(True)
+            with conn.cursor() as c:
+                c.execute("START TRANSACTION")
+                c.execute("CREATE TABLE pool_rollback(i INT)")
+        with self.pool.connection() as conn:
+            self.assertFalse(conn.mapi.in_transaction)
+            with conn.cursor() as c:
+                with self.assertRaises(pymonetdb.OperationalError):
+                    c.execute("SELECT * FROM pool_rollback")
+
+    def test_exhausted(self):
+        conns = [self.pool.getconn() for i in range(2)]
+        with self.assertRaises(pymonetdb.OperationalError):
+            self.pool.getconn(timeout=0.1)
+        threading.Timer(0.1, self.pool.putconn, [conns[0]]).start()
+        conn = self.pool.getconn()
+        self.assertIs(conn, conns[0])
+        self.pool.putconn(conn)
+        self.pool.putconn(conns[1])
+        stats = self.pool.stats()
+        self.assertEqual(stats.timeouts, 1)
+        self.assertEqual(stats.waits, 2)
+        self.assertGreater(stats.wait_time, 0)
+
+    def test_closed_connection_is_discarded(self):
+        with self.pool.connection() as conn1:
+            conn1.close()
+        with self.pool.connection() as conn2:
+            self.assertIsNot(conn1, conn2)
+        self.assertEqual(self.pool.stats().discarded, 1)
+
+    def test_broken_connection_fails_health_check(self):
+        with self.pool.connection() as conn1:
+            pass
+        conn1.mapi.sock.close()
+        with self.pool.connection() as conn2:
+            self.assertIsNot(conn1, conn2)
+        self.assertEqual(self.pool.stats().failed_health_checks, 1)
+
+    def test_foreign_connection(self):
+        with pymonetdb.connect(test_url) as conn:
+            with self.assertRaises(pymonetdb.ProgrammingError):
+                self.pool.putconn(conn)
+
+    def test_get_pool(self):
+        pool = get_pool(test_url)
+        try:
+            self.assertIs(pool, get_pool(test_url))
+            target = pymonetdb.Target()
+            target.parse(test_url)
+            self.assertIs(pool, get_pool(target))
+        finally:
+            pool.close()
+        self.assertIsNot(pool, get_pool(test_url))
+        get_pool(test_url).close()
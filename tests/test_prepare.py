@@ -1,5 +1,6 @@
 from unittest import TestCase
 from pymonetdb import connect
+from pymonetdb.sql.prepared import PreparedStatementCache, convert_placeholders
 from tests.util import test_args
 
 
@@ -46,3 +47,81 @@ class TestPrepare(TestCase):
         self.cursor.execute(prep)
         nrows = len(self.cursor.fetchall())
         self.assertEqual(n, nrows)
+
+    def test_prepared_cache(self):
+        self.connection.set_autocommit(True)
+        self.connection.set_prepared_cache_size(2)
+        query = "SELECT value * %s FROM sys.generate_series(0, %s)"
+        for n in range(1, 4):
+            self.cursor.execute(query, (n, 3))
+            self.assertEqual([(0,), (n,), (2 * n,)], self.cursor.fetchall())
+        self.assertEqual(1, len(self.connection._prepared_cache))
+
+        self.cursor.execute("SELECT value + %(a)s FROM sys.generate_series(0, %(b)s)", dict(a=1, b=2))
+        self.assertEqual([(1,), (2,)], self.cursor.fetchall())
+        self.cursor.execute("SELECT value FROM sys.generate_series(%s, 5)", [3])
+        self.cursor.execute(query, (5, 2))
+        self.assertEqual([(0,), (5,)], self.cursor.fetchall())
+        self.assertEqual(2, len(self.connection._prepared_cache))
+
+        self.connection.set_prepared_cache_size(0)
+        self.assertIsNone(self.connection._prepared_cache)
+
+    def test_prepared_cache_in_transaction(self):
+        self.connection.set_prepared_cache_size(2)
+        # the unknown parameter type would make PREPARE fail and abort the transaction
+        self.cursor.execute("SELECT %s", [1])
+        self.assertEqual([(1,)], self.cursor.fetchall())
+        self.assertEqual(0, len(self.connection._prepared_cache))
+        self.cursor.execute("SELECT 42")
+        self.assertEqual([(42,)], self.cursor.fetchall())
+
+
+class TestPreparedStatementCache(TestCase):
+    def test_convert_placeholders(self):
+        self.assertEqual(
+            ("SELECT ? + ?, '%'", [1, 2]),
+            convert_placeholders("  SELECT %s + %s, '%%';  ", (1, 2)))
+        self.assertEqual(
+            ("UPDATE foo SET a = ? WHERE b = ?", ['x', 'y']),
+            convert_placeholders("UPDATE foo SET a = %(a)s WHERE b = %(b)s", dict(b='y', a='x')))
+        self.assertIsNone(convert_placeholders("CREATE TABLE foo(i INT DEFAULT %s)", [1]))
+        self.assertIsNone(convert_placeholders("SELECT %d", [1]))
+        self.assertIsNone(convert_placeholders("SELECT %s, %s", [1]))
+        self.assertIsNone(convert_placeholders("SELECT %s; SELECT 1", [1]))
+        self.assertIsNone(convert_placeholders("SELECT %s, %(a)s", dict(a=1)))
+
+    def test_eviction(self):
+        cache = PreparedStatementCache(2, True)
+        self.assertEqual(("SELECT ?", [1], None), cache.lookup("SELECT %s", [1]))
+        self.assertEqual([], cache.add("SELECT ?", 10))
+        self.assertEqual([], cache.add("SELECT ? + 1", 11))
+        self.assertEqual(10, cache.lookup("SELECT %s", [2])[2])
+        self.assertEqual([11], cache.add("SELECT ? + 2", None))
+        self.assertIsNone(cache.lookup("SELECT %s + 2", [1]))
+        self.assertEqual([10], cache.clear())
+
+    def test_statement_failed(self):
+        cache = PreparedStatementCache(5, True)
+        cache.add("SELECT ?", 10)
+        cache.add("SELECT ? + 1", 11)
+        cache.statement_failed("EXEC 10(1)", Exception("no prepared statement with id: 10"))
+        self.assertEqual(1, len(cache))
+        cache.statement_failed("EXEC 11(1)", Exception("division by zero"))
+        self.assertEqual(1, len(cache))
+
+        cache = PreparedStatementCache(5, False)
+        cache.add("SELECT ?", 10)
+        cache.statement_failed("SELECT 1/0", Exception("division by zero"))
+        self.assertEqual(0, len(cache))
+
+    def test_rolled_back(self):
+        cache = PreparedStatementCache(5, True)
+        cache.add("SELECT ?", 10)
+        cache.rolled_back()
+        self.assertEqual(1, len(cache))
+
+        cache = PreparedStatementCache(5, False)
+        cache.add("SELECT ?", 10)
+        cache.rolled_back()
+        self.assertEqual(0, len(cache))
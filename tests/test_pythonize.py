@@ -5,13 +5,47 @@
 # Copyright 1997 - July 2008 CWI, August 2008 - 2016 MonetDB B.V.
 
 from datetime import datetime, timedelta, timezone
+from decimal import Decimal
 import ipaddress
+import struct
 import unittest
 import pymonetdb.sql.pythonize
 import pymonetdb
+from pymonetdb.sql import pythonizebin
 from tests.util import test_args
 
 
+class TestDecimalConversion(unittest.TestCase):
+    """Check the DECIMAL representations without needing a server"""
+
+    def test_text(self):
+        converter = pymonetdb.sql.pythonize.converter
+        cases = [
+            ('decimal', [Decimal('12.3400'), Decimal('-0.0500')]),
+            ('float', [12.34, -0.05]),
+            ('scaled', [123400, -500]),
+        ]
+        for decimals, expected in cases:
+            convert = converter(pymonetdb.types.DECIMAL, 10, 4, decimals)
+            self.assertEqual([convert('12.3400'), convert('-0.0500')], expected)
+        # scaled values must fit in 64 bits
+        self.assertEqual(converter(pymonetdb.types.DECIMAL, 38, 4, 'scaled')('1.5000'), Decimal('1.5'))
+        with self.assertRaises(pymonetdb.ProgrammingError):
+            converter(pymonetdb.types.DECIMAL, 10, 4, 'double')
+
+    def test_binary(self):
+        data = memoryview(struct.pack('<3i', 123400, -500, -(1 << 31)))
+        for representation, expected in [('float', [12.34, -0.05, None]), ('scaled', [123400, -500, None])]:
+            decoder = pythonizebin.DecimalDecoder(32, 4, pythonizebin._decimal_mapper(4, representation))
+            self.assertEqual(decoder.decode('little', data), expected)
+        decoder = pythonizebin.DecimalDecoder(32, 4, pythonizebin._decimal_mapper(4, 'decimal'))
+        # same digits and exponent as the text protocol
+        self.assertEqual([str(v) for v in decoder.decode('little', data)[:2]], ['12.3400', '-0.0500'])
+        # exact beyond the precision of the default context
+        mapper = pythonizebin._decimal_mapper(2, 'decimal')
+        self.assertEqual(mapper(10 ** 38 - 1), Decimal('9' * 36 + '.99'))
+
+
 class TestPythonize(unittest.TestCase):
     TEST_TIMEZONE = -4
 
@@ -73,6 +107,18 @@ class TestPythonize(unittest.TestCase):
         self.assertEqual(row[0].isoformat(), dt.isoformat())
         self.assertEqual(row[1].isoformat(), dtz.isoformat())
 
+    def test_decimals(self):
+        query = 'SELECT CAST(12.34 AS DECIMAL(10, 4)), CAST(-0.5 AS DECIMAL(4, 2)), CAST(NULL AS DECIMAL(10, 4))'
+        cases = [
+            ('decimal', [Decimal('12.3400'), Decimal('-0.50'), None]),
+            ('float', [12.34, -0.5, None]),
+            ('scaled', [123400, -50, None]),
+        ]
+        for decimals, expected in cases:
+            self.cursor.decimals = decimals
+            self.cursor.execute(query)
+            self.assertEqual(list(self.cursor.fetchone()), expected)
+
     def test_date_year0(self):
         with self.assertRaisesRegex(ValueError, "year"):
             self.cursor.execute("SELECT DATE '0-1-1'")
@@ -357,6 +357,29 @@ class BaseTestCases(TestCase):
     def test_fetchall_large(self):
         self.test_fetchall(100_000)
 
+    def test_fetch_batches(self):
+        self.do_query(10_000)
+        self.do_fetchmany(10)
+        nbatches = 0
+        for batch in self.cursor.fetch_batches():
+            for i, row in enumerate(batch):
+                self.verifyRow(self.cur + i, row)
+            self.cur += len(batch)
+            nbatches += 1
+        self.assertGreater(nbatches, 0)
+        self.verifyBinary()
+        self.assertAtEnd()
+
+    def test_closed_when_done(self):
+        self.do_query(10_000)
+        self.do_fetchmany(10)
+        self.do_fetchall()
+        self.assertEqual([], self.cursor._resultsets_to_close)
+        if self.cursor._offset > 0:
+            # the server no longer has the rows that are not cached
+            with self.assertRaises(pymonetdb.ProgrammingError):
+                self.cursor.scroll(0, 'absolute')
+
     def test_scroll(self):
         rng = Random()
         rng.seed(42)
@@ -785,5 +808,16 @@ class TestResultSetNoPrefetch(BaseTestCases):
         return (conn, binary_after)
 
 
+class TestResultSetBackgroundPrefetch(BaseTestCases):
+    def setup_connection(self):
+        conn = self.connect_with_args()
+        binary_after = 100
+        return (conn, binary_after)
+
+    def do_connect(self):
+        super().do_connect()
+        self.cursor.prefetch = True
+
+
 # Make sure the abstract base class doesn't get executed
 del BaseTestCases
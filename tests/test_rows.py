@@ -0,0 +1,120 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0.  If a copy of the MPL was not distributed with this
+# file, You can obtain one at http://mozilla.org/MPL/2.0/.
+#
+# Copyright 1997 - July 2008 CWI, August 2008 - 2016 MonetDB B.V.
+
+import array
+import sys
+from unittest import TestCase
+
+import pymonetdb
+from pymonetdb.exceptions import InterfaceError
+from pymonetdb.sql import pythonizebin, types
+from pymonetdb.sql.rows import ArrayColumn, ColumnBatch, Row, StringColumn, compact_batch
+from tests.util import test_args
+
+
+class CountingDecoder(pythonizebin.IntegerDecoder):
+    def __init__(self):
+        super().__init__(32)
+        self.calls = 0
+
+    def decode(self, server_endian, data):
+        self.calls += 1
+        return super().decode(server_endian, data)
+
+
+class TestColumnBatch(TestCase):
+    """Check the row containers without needing a server"""
+
+    def setUp(self):
+        self.decoders = [CountingDecoder(), CountingDecoder()]
+        slices = [
+            memoryview(array.array('i', [1, 2, 3]).tobytes()),
+            memoryview(array.array('i', [10, -(1 << 31), 30]).tobytes()),
+        ]
+        self.batch = ColumnBatch(self.decoders, sys.byteorder, slices, 3)
+
+    def test_tuples(self):
+        self.assertEqual(len(self.batch), 3)
+        self.assertEqual(self.batch[0], (1, 10))
+        self.assertEqual(self.batch[-1], (3, 30))
+        self.assertEqual(self.batch[1:], [(2, None), (3, 30)])
+        self.assertEqual([d.calls for d in self.decoders], [1, 1])
+        with self.assertRaises(IndexError):
+            self.batch[3]
+
+    def test_lazy_rows(self):
+        self.batch.lazy_rows = True
+        rows = self.batch[:]
+        self.assertIsInstance(rows[0], Row)
+        self.assertEqual([row[0] for row in rows], [1, 2, 3])
+        self.assertEqual([d.calls for d in self.decoders], [1, 0])
+        self.assertEqual(rows, [(1, 10), (2, None), (3, 30)])
+        self.assertEqual(rows[1][:], (2, None))
+        self.assertEqual(len(rows[1]), 2)
+        self.assertEqual(hash(rows[2]), hash((3, 30)))
+        self.assertEqual(repr(rows[2]), '(3, 30)')
+        self.assertEqual([d.calls for d in self.decoders], [1, 1])
+
+    def test_wrong_count(self):
+        batch = ColumnBatch(self.decoders, sys.byteorder, self.batch.slices, 4)
+        with self.assertRaises(InterfaceError):
+            batch[0]
+
+
+class TestCompactRows(TestCase):
+    def test_compact_batch(self):
+        rows = [
+            (1, 0.5, 'aap', True, None),
+            (None, None, None, None, 1),
+            (-3, 1.5, 'n\u00f6ot', False, 2),
+        ]
+        type_codes = [types.INT, types.DOUBLE, types.VARCHAR, types.BOOLEAN, types.HUGEINT]
+        batch = compact_batch(rows, type_codes)
+        self.assertEqual([type(col) for col in batch.columns()],
+                         [ArrayColumn, ArrayColumn, StringColumn, ArrayColumn, list])
+        self.assertEqual(batch[:], rows)
+        self.assertEqual(batch[-1], rows[-1])
+        self.assertEqual(batch.column(2)[1:], [None, 'n\u00f6ot'])
+        self.assertEqual(compact_batch([(0.1,)], [types.REAL])[0], (0.1,))
+        with self.assertRaises(IndexError):
+            batch.column(2)[3]
+
+    def test_compact_binary(self):
+        decoders = [pythonizebin.IntegerDecoder(64), pythonizebin.ZeroDelimitedDecoder(bytes.decode)]
+        slices = [
+            memoryview(array.array('q', [-(1 << 63), 5]).tobytes()),
+            memoryview(b'x\x00\x80\x00'),
+        ]
+        batch = ColumnBatch(decoders, sys.byteorder, slices, 2, compact=True)
+        self.assertEqual(batch[:], [(None, 'x'), (5, None)])
+        self.assertIsInstance(batch.column(0), ArrayColumn)
+
+
+class TestRowCache(TestCase):
+    def test_lazy_rows(self):
+        query = "SELECT value, 'x' || value FROM sys.generate_series(0, 5000)"
+        with pymonetdb.connect(**test_args, replysize=100) as conn, conn.cursor() as cursor:
+            cursor.execute(query)
+            expected = cursor.fetchall()
+            cursor.lazy_rows = True
+            cursor.execute(query)
+            rows = cursor.fetchall()
+            self.assertEqual(rows, expected)
+            self.assertEqual(rows[-1][1], 'x4999')
+
+    def test_compact_rows(self):
+        query = ("SELECT value, 'x' || value, value / 2.0e0, CAST(value / 10.0e0 AS REAL) "
+                 "FROM sys.generate_series(0, 5000)")
+        with pymonetdb.connect(**test_args, replysize=100) as conn, conn.cursor() as cursor:
+            for binary in [0, 1]:
+                # text and binary results disagree on the digits of a REAL
+                conn.set_binary(binary)
+                cursor.compact_rows = False
+                cursor.execute(query)
+                expected = cursor.fetchall()
+                cursor.compact_rows = True
+                cursor.execute(query)
+                self.assertEqual(cursor.fetchall(), expected)
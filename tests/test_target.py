@@ -82,6 +82,18 @@ class TargetTests(TestCase):
         for name, test in tests:
             self.run_test(test)
 
+    def test_cache_key(self):
+        a = Target()
+        a.parse("monetdb://localhost:12345/demo?user=monetdb")
+        b = a.clone()
+        self.assertEqual(a.cache_key(), b.cache_key())
+        self.assertEqual(hash(a.cache_key()), hash(b.cache_key()))
+        b.replysize = 42
+        self.assertNotEqual(a.cache_key(), b.cache_key())
+        c = a.clone()
+        c.set('my_extra', 'x')
+        self.assertNotEqual(a.cache_key(), c.cache_key())
+
     def run_test(self, test):
         target = Target()
         for line in test:
@@ -4,9 +4,11 @@
 #
 # Copyright 1997 - July 2008 CWI, August 2008 - 2016 MonetDB B.V.
 
+import struct
 import unittest
 
 import pymonetdb
+from pymonetdb.sql import pythonizebin
 
 # regular import doesn't work, don't know why
 DATE = pymonetdb.types.DATE
@@ -55,3 +57,43 @@ class TestPythonizeTemporal(unittest.TestCase):
         self.verify('2015-02-14 20:50:12-04:30', TIMESTAMPTZ)
         self.verify('2015-02-14 20:50:12.34+04:30', TIMESTAMPTZ, '2015-02-14T20:50:12.340000+04:30')
         self.verify('15-02-14 20:50:12.34-04:30', TIMESTAMPTZ, '0015-02-14T20:50:12.340000-04:30')
+
+
+class TestBinaryTemporal(unittest.TestCase):
+
+    def decode(self, decoder, fmt, records, endian='little'):
+        prefix = '<' if endian == 'little' else '>'
+        data = b''.join(struct.pack(prefix + fmt, *rec) for rec in records)
+        values = decoder.decode(endian, memoryview(data))
+        return [None if v is None else v.isoformat() for v in values]
+
+    def test_timestamp(self):
+        records = [(123456, 12, 34, 22, 14, 2, 2015), (0xFFFFFFFF, 0, 0, 0, 0, 0, 0)]
+        for endian in ['little', 'big']:
+            self.assertEqual(
+                self.decode(pythonizebin.TimestampDecoder(None), pythonizebin.TIMESTAMP_FORMAT, records, endian),
+                ['2015-02-14T22:34:12.123456', None])
+
+    def test_timestamptz(self):
+        records = [(0, 12, 34, 22, 14, 2, 2015)]
+        self.assertEqual(
+            self.decode(pythonizebin.TimestampDecoder(5400), pythonizebin.TIMESTAMP_FORMAT, records),
+            ['2015-02-15T00:04:12+01:30'])
+
+    def test_time(self):
+        records = [(500, 12, 34, 22), (0xFFFFFFFF, 0, 0, 0)]
+        self.assertEqual(
+            self.decode(pythonizebin.TimeDecoder(None), pythonizebin.TIME_FORMAT, records, 'big'),
+            ['22:34:12.000500', None])
+        self.assertEqual(
+            self.decode(pythonizebin.TimeDecoder(-3600), pythonizebin.TIME_FORMAT, records),
+            ['21:34:12.000500-01:00', None])
+
+    def test_date(self):
+        records = [(14, 2, 2015), (1, 1, -1), (29, 2, 4)]
+        self.assertEqual(
+            self.decode(pythonizebin.DateDecoder(), pythonizebin.DATE_FORMAT, records[:1] + records[2:]),
+            ['2015-02-14', '0004-02-29'])
+        self.assertEqual(
+            self.decode(pythonizebin.DateDecoder(), pythonizebin.DATE_FORMAT, [(255, 255, -1)], 'big'),
+            [None])
@@ -15,6 +15,8 @@ import urllib.request
 
 import pymonetdb
 from pymonetdb.exceptions import DatabaseError
+from pymonetdb.mapi import clear_tls_cache, get_ssl_context, tls_stats
+from pymonetdb.target import Target
 
 from tests.util import (
     test_tls_tester_host,
@@ -196,3 +198,33 @@ class TestTLS(TestCase):
     @skipUnless(test_tls_tester_sys_store, "TSTTLSTESTERSYSSTORE not set")
     def test_connect_trusted(self):
         self.try_connect("server3", cert=None)
+
+
+class TestSSLContextCache(TestCase):
+    """Does not need tlstester.py"""
+
+    def setUp(self):
+        clear_tls_cache()
+
+    def tearDown(self):
+        clear_tls_cache()
+
+    def test_context_cache(self):
+        before = tls_stats()
+        target = Target()
+        target.parse("monetdbs://localhost/demo?certhash=sha256:1234")
+        ctx = get_ssl_context(target)
+
+        # fields that do not affect the context
+        other = target.clone()
+        other.database = 'other'
+        other.user = 'someone'
+        self.assertIs(get_ssl_context(other), ctx)
+
+        other = target.clone()
+        other.certhash = ''
+        self.assertIsNot(get_ssl_context(other), ctx)
+
+        after = tls_stats()
+        self.assertEqual(after.contexts_created - before.contexts_created, 2)
+        self.assertEqual(after.context_cache_hits - before.context_cache_hits, 1)
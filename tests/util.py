@@ -145,6 +145,24 @@ try:
 except ModuleNotFoundError:
     test_have_lz4 = False
 
+try:
+    import_module('numpy')
+    test_have_numpy = True
+except ModuleNotFoundError:
+    test_have_numpy = False
+
+try:
+    import_module('pandas')
+    test_have_pandas = True
+except ModuleNotFoundError:
+    test_have_pandas = False
+
+try:
+    import_module('pyarrow')
+    test_have_pyarrow = True
+except ModuleNotFoundError:
+    test_have_pyarrow = False
+
 
 # Debug the debugging
 if __name__ == "__main__":
@@ -158,6 +176,9 @@ if __name__ == "__main__":
     print(f'test_tls_tester_port = {test_tls_tester_port!r}')
     print(f'test_tls_tester_sys_store = {test_tls_tester_sys_store!r}')
     print(f'test_have_lz4 = {test_have_lz4!r}')
+    print(f'test_have_numpy = {test_have_numpy!r}')
+    print(f'test_have_pandas = {test_have_pandas!r}')
+    print(f'test_have_pyarrow = {test_have_pyarrow!r}')
     try:
         print()
         have_monetdb_version_at_least(0, 0, 0)